@@ -8,7 +8,25 @@ from aws_cdk import aws_iam as iam
 TABLE_NAME = 'Scheduler'
 TAG_KEY = "Schedule"
 REGION = "us-west-2"
+# Regions with instances to schedule. Schedule configuration is always read from the table in REGION
+SCHEDULED_REGIONS = [REGION]
+# Roles assumed to schedule instances in member accounts, e.g. arn:aws:iam::123456789012:role/AutomatedScheduler
+# Leave empty to schedule the instances of the deployment account only
+ACCOUNT_ROLES = []
+MAX_WORKERS = 8
+# Keep an instance inventory from EC2 state/tag change events instead of describing every instance each run
+USE_INVENTORY = False
+# The scheduler re-arms its rule for the next start/stop transition of the schedules at the end of every run, so it
+# only runs when an instance may need to change state, and at least every SCHEDULER_MAX_SLEEP_MINUTES
+SCHEDULER_RULE_NAME = "AutomatedSchedulerRule"
+SCHEDULER_MAX_SLEEP_MINUTES = 24 * 60
+# A run that fails before re-arming the rule leaves the scheduler asleep until the next config upload. The heartbeat
+# rule runs it every SCHEDULER_MAX_SLEEP_MINUTES as well, so it is never asleep for longer than that, at the cost of
+# about one idle run per SCHEDULER_MAX_SLEEP_MINUTES. Set to False for no idle runs at all
+USE_HEARTBEAT = True
 LAMBDA_FUNC_PATH = 'aws_automated_scheduler/lambda'
+# Left out of the Lambda asset: the tests and util.evalmatrix, which needs numpy from requirements-dev.txt
+LAMBDA_ASSET_EXCLUDE = ["tests", "util/evalmatrix.py", "**/__pycache__"]
 
 
 class AutomatedSchedulerStack(core.Stack):
@@ -38,8 +56,8 @@ class AutomatedSchedulerStack(core.Stack):
         # Create lambda resource using code from local disk
         lambda_handler = _lambda.Function(
             self, "AutomatedScheduler",
-            code=_lambda.Code.from_asset(LAMBDA_FUNC_PATH),
-            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.from_asset(LAMBDA_FUNC_PATH, exclude=LAMBDA_ASSET_EXCLUDE),
+            runtime=_lambda.Runtime.PYTHON_3_9,
             handler="automated_scheduler.event_handler",
             memory_size=256,
             timeout=core.Duration.seconds(5)
@@ -62,6 +80,87 @@ class AutomatedSchedulerStack(core.Stack):
             value=REGION
         )
 
+        lambda_handler.add_environment(
+            key="scheduler_regions",
+            value=",".join(SCHEDULED_REGIONS)
+        )
+
+        lambda_handler.add_environment(
+            key="scheduler_max_workers",
+            value=str(MAX_WORKERS)
+        )
+
+        lambda_handler.add_environment(
+            key="scheduler_use_inventory",
+            value=str(USE_INVENTORY).lower()
+        )
+
+        lambda_handler.add_environment(
+            key="scheduler_rule_name",
+            value=SCHEDULER_RULE_NAME
+        )
+
+        lambda_handler.add_environment(
+            key="scheduler_max_sleep_minutes",
+            value=str(SCHEDULER_MAX_SLEEP_MINUTES)
+        )
+
+        # First run right after deployment, every run after that re-arms the rule
+        rule = events.Rule(
+            self,
+            "AutomatedSchedulerRule",
+            rule_name=SCHEDULER_RULE_NAME,
+            schedule=events.Schedule.expression("rate(1 minute)")
+        )
+        rule.add_target(targets.LambdaFunction(lambda_handler))
+
+        if USE_HEARTBEAT:
+            heartbeat_rule = events.Rule(
+                self,
+                "AutomatedSchedulerHeartbeatRule",
+                schedule=events.Schedule.rate(core.Duration.minutes(SCHEDULER_MAX_SLEEP_MINUTES))
+            )
+            heartbeat_rule.add_target(targets.LambdaFunction(lambda_handler))
+
+        lambda_handler.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "events:PutRule"
+                ],
+                effect=iam.Effect.ALLOW,
+                resources=[
+                    rule.rule_arn
+                ]
+            )
+        )
+
+        if USE_INVENTORY:
+            inventory_rule = events.Rule(
+                self,
+                "AutomatedSchedulerInventoryRule",
+                event_pattern=events.EventPattern(
+                    source=["aws.ec2", "aws.tag"],
+                    detail_type=["EC2 Instance State-change Notification", "Tag Change on Resource"]
+                )
+            )
+            inventory_rule.add_target(targets.LambdaFunction(lambda_handler))
+
+        if ACCOUNT_ROLES:
+            lambda_handler.add_environment(
+                key="scheduler_account_roles",
+                value=",".join(ACCOUNT_ROLES)
+            )
+
+            lambda_handler.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=[
+                        "sts:AssumeRole"
+                    ],
+                    effect=iam.Effect.ALLOW,
+                    resources=ACCOUNT_ROLES
+                )
+            )
+
         ec2_read_only = iam.PolicyStatement(
             actions=[
                 "ec2:DescribeInstances",
@@ -85,12 +184,3 @@ class AutomatedSchedulerStack(core.Stack):
 
         lambda_handler.add_to_role_policy(ec2_read_only)
         lambda_handler.add_to_role_policy(s3_read_only)
-
-    #  rule = events.Rule(
-    #      self,
-    #      "AutomatedSchedulerRule",
-    #      schedule=events.Schedule.expression("cron(0/1 * * * ? *)")
-    #  )
-
-    # Add lambda function as target of event rule
-    #   rule.add_target(targets.LambdaFunction(lambda_handler))
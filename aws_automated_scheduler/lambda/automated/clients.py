@@ -0,0 +1,101 @@
+from datetime import datetime, timezone
+import botocore.config
+import automated.throttle
+import logging
+import threading
+import config
+
+logger = logging.getLogger()
+
+# boto3 clients and resources kept for the life of the container so warm invocations skip building them again.
+# (factory, service, region, endpoint, access key id) -> (client, credential expiration or None)
+_clients: dict = {}
+# Creating clients from the default boto3 session is not thread safe, workers build them one at a time
+_clients_lock = threading.Lock()
+# created: clients built, reused: clients handed out again from the registry
+_stats = {"created": 0, "reused": 0}
+
+
+def get(factory, service_name: str, region_name: str = None, endpoint_url: str = None, credentials: dict = None,
+        client_config: botocore.config.Config = None):
+    """
+    Returns the client of the service for the region, endpoint and credentials, building it on first use
+    :param factory: boto3.client or boto3.resource, as imported by the calling component
+    :param service_name: str = e.g. "ec2"
+    :param region_name: str = AWS region, None for the default region
+    :param endpoint_url: str = endpoint of a local stand-in, None for the AWS endpoint
+    :param credentials: dict = STS credentials of an assumed role. Uses the Lambda role when not given
+    :param client_config: botocore Config merged over the connection settings of every client
+    :return: client or resource
+    """
+    access_key_id = credentials['AccessKeyId'] if credentials is not None else None
+    key = (factory, service_name, region_name, endpoint_url, access_key_id)
+
+    with _clients_lock:
+        cached = _clients.get(key)
+
+        if cached is not None:
+            _stats['reused'] += 1
+            return cached[0]
+
+        _evict_expired()
+
+        kwargs = {
+            "region_name": region_name,
+            "config": connection_config().merge(client_config or botocore.config.Config())
+        }
+        if endpoint_url is not None:
+            kwargs['endpoint_url'] = endpoint_url
+        if credentials is not None:
+            kwargs.update(
+                aws_access_key_id=credentials['AccessKeyId'],
+                aws_secret_access_key=credentials['SecretAccessKey'],
+                aws_session_token=credentials['SessionToken']
+            )
+
+        logger.info(f"Creating [{service_name}] client for region [{region_name}]")
+        client = factory(service_name, **kwargs)
+        _clients[key] = (client, credentials['Expiration'] if credentials is not None else None)
+        _stats['created'] += 1
+
+        return client
+
+
+def connection_config() -> botocore.config.Config:
+    """
+    Connection pool and timeouts shared by every client. The read timeout is fixed when the client is built and the
+    client serves every later invocation of the container, so it is bounded by the time a whole invocation has, as
+    set by the function timeout, not by the time left in the invocation that happens to build the client.
+    CLIENT_MIN_READ_TIMEOUT_SECONDS is the floor
+    :return: botocore Config
+    """
+    read_timeout = config.CLIENT_READ_TIMEOUT_SECONDS
+    invocation_time = automated.throttle.invocation_time()
+    if invocation_time is not None:
+        read_timeout = max(config.CLIENT_MIN_READ_TIMEOUT_SECONDS, min(read_timeout, invocation_time))
+
+    return botocore.config.Config(
+        max_pool_connections=config.CLIENT_MAX_POOL_CONNECTIONS,
+        connect_timeout=config.CLIENT_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=read_timeout,
+        tcp_keepalive=True
+    )
+
+
+def stats() -> dict:
+    """
+    :return: dict = clients created and reused over the life of the container
+    """
+    with _clients_lock:
+        return dict(_stats)
+
+
+def clear() -> None:
+    with _clients_lock:
+        _clients.clear()
+
+
+def _evict_expired() -> None:
+    now = datetime.now(timezone.utc)
+    for key in [key for key, (_, expiration) in _clients.items() if expiration is not None and expiration <= now]:
+        del _clients[key]
@@ -1,14 +1,48 @@
 from util import data
+import automated.clients
+import automated.dynamodb_memory
 import automated.exceptions
 import automated.s3
+import automated.throttle
 from boto3 import client
 import botocore.exceptions
 import botocore.errorfactory
+import concurrent.futures
+import itertools
 import logging
+import queue
+import random
+import threading
+import time
 import config
 
 logger = logging.getLogger()
 
+# Partition keys of the schedule configuration uploaded through put_config
+SCHEDULE_PK = "schedule"
+PERIOD_PK = "period"
+CONFIG_ITEM_PKS = (SCHEDULE_PK, PERIOD_PK)
+
+# Partition keys of the instance inventory index
+INVENTORY_PK = "inventory"
+INVENTORY_SCAN_PK = "inventory_scan"
+
+# Item holding the version of the schedule/period configuration, bumped on every config upload
+CONFIG_PK = "config"
+CONFIG_VERSION_SK = "version"
+# Compiled configuration snapshot. The head item holds the first chunk, any further chunks are stored under
+# snapshot#<version>#<index> so a new snapshot never overwrites the chunks of the one being read
+CONFIG_SNAPSHOT_SK = "snapshot"
+
+# Maximum number of requests DynamoDB accepts in a single batch_write_item call
+BATCH_WRITE_LIMIT = 25
+# Maximum number of keys DynamoDB accepts in a single batch_get_item call
+BATCH_GET_LIMIT = 100
+# batch_write_item/batch_get_item errors after which the whole chunk is resubmitted
+RETRYABLE_BATCH_ERROR_CODES = (
+    "ProvisionedThroughputExceededException", "RequestLimitExceeded", "ThrottlingException", "InternalServerError"
+)
+
 # NOTE: Had to set environment variable TZ=UTC in order for dynamodb describe table and create_table due to boto3 bug
 # for Windows.
 
@@ -22,9 +56,15 @@ class DynamoDB:
         self.__testing = config.is_test_run()
         self.__errors = []
 
-        if self.__testing:
+        if db_conn == config.DB_CONN_MEMORY:
+            logger.warning("[TESTING] Using in memory database.")
+            self.dynamodb = automated.dynamodb_memory.MemoryDynamoDBClient()
+            self.__testing_create_table()
+
+        elif self.__testing:
             logger.warning("[TESTING] Using local database connection.")
-            self.dynamodb = client(
+            self.dynamodb = automated.clients.get(
+                client,
                 "dynamodb",
                 region_name=self.__region,
                 endpoint_url=config.DB_CONN_LOCAL_ENDPOINT
@@ -32,7 +72,8 @@ class DynamoDB:
             self.__testing_create_table()
 
         else:
-            self.dynamodb = client(
+            self.dynamodb = automated.clients.get(
+                client,
                 "dynamodb",
                 region_name=self.__region,
             )
@@ -137,79 +178,276 @@ class DynamoDB:
         Retrieves all items and attributes from Automated Scheduler table
         :return: list = list of DynamoDB items
         """
-
-        response = None
         logger.info(f"Attempting to retrieve all items from DynamoDB...")
 
+        items = list(self.scan_items())
+
+        logger.info(f"Retrieved [{len(items)}] items from DynamoDB.")
+        return items
+
+    def scan_items(self, total_segments: int = config.DYNAMODB_SCAN_SEGMENTS):
+        """
+        Streams every item of the table. The table is split into total_segments segments that are scanned concurrently,
+        each following LastEvaluatedKey until its segment is exhausted. Pages are handed over through a bounded queue,
+        so only a few pages are held in memory no matter how large the table is
+        :param total_segments: int = number of segments (and worker threads) to split the scan into
+        :return: iterator of DynamoDB items
+        """
+        pages = queue.Queue(maxsize=2 * total_segments)
+        stopped = threading.Event()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=total_segments)
+        futures = [executor.submit(self.__scan_segment, segment, total_segments, pages, stopped)
+                   for segment in range(total_segments)]
+        remaining_segments = total_segments
+
         try:
-            response = self.dynamodb.scan(
-                TableName=self.__table_name
-            )
-        except botocore.exceptions.ClientError as err:
-            automated.exceptions.log_error(
-                automation_component=self,
-                error_message=f"Error retrieving all items from DynamoDB: {err}",
-                output_to_logger=True,
-                include_in_http_response=True,
-                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
-                fatal_error=True
-            )
-            logger.error()
+            while remaining_segments:
+                page = pages.get()
+
+                if page is None:
+                    # Segment finished
+                    remaining_segments -= 1
+                elif isinstance(page, Exception):
+                    # Connection errors, timeouts and invalid parameters carry no HTTP response of their own
+                    http_status_code = 500
+                    if isinstance(page, botocore.exceptions.ClientError):
+                        http_status_code = page.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
 
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb.html#DynamoDB.Client.scan
-        if "LastEvaluatedKey" in response:
-            logger.error(
-                "You have not finished writing the code to retrieve over 1MB of data. Shame shame."
-                "There should never be a chance that we exceed 1MB of data in our simple request, so... what happened?")
+                    automated.exceptions.log_error(
+                        automation_component=self,
+                        error_message=f"Error retrieving all items from DynamoDB: {page}",
+                        output_to_logger=True,
+                        include_in_http_response=True,
+                        http_status_code=http_status_code,
+                        fatal_error=True
+                    )
+                else:
+                    yield from page
+
+        finally:
+            # Unblock workers that are waiting on a full queue when the consumer stops early
+            stopped.set()
+            while not all(future.done() for future in futures):
+                try:
+                    pages.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+            executor.shutdown(wait=False)
+
+    def __scan_segment(self, segment: int, total_segments: int, pages: queue.Queue, stopped: threading.Event) -> None:
+        try:
+            paginator = self.dynamodb.get_paginator('scan')
 
-        logger.info(f"Retrieved [{len(response['Items'])}] items from DynamoDB.")
-        return response['Items']
+            for page in paginator.paginate(TableName=self.__table_name, Segment=segment, TotalSegments=total_segments):
+                if stopped.is_set():
+                    return
+                pages.put(page['Items'])
+
+        except Exception as err:
+            # Handed to the consumer, which would otherwise wait forever on a segment that never finishes
+            pages.put(err)
+
+        finally:
+            pages.put(None)
 
     def load_json_into_db(self, json_data: list) -> dict:
         """
-        Loads DynamoDB compatible JSON into DynamoDB table as batch job
+        Loads DynamoDB compatible JSON into DynamoDB table with the bulk writer
         :param json_data: DynamoDB batch write compatible JSON
-        :return:
+        :return: dict = {"written": int, "retried": int, "failed": int}
         """
 
-        # TODO: Does batch write have a limit?
-
         logger.info(f"Attempting to load [{len(json_data)}] items into DynamoDB table [{self.__table_name}]")
-        batch_write_compatible_json = []
-        response = None
 
-        # Iterate through list, and prepend the required {"PutRequest": "Item" { ... } for DynamoDB batch write
+        # Prepend the required {"PutRequest": "Item" { ... } for DynamoDB batch write
+        return self.bulk_write([{"PutRequest": {"Item": item}} for item in json_data])
+
+    def sync_config_items(self, json_data: list) -> dict:
+        """
+        Differential version of load_json_into_db. The current config items are loaded and compared with the new ones
+        by a hash of their canonical form, then only new or changed items are put and items missing from the new config
+        are deleted. Deletes are limited to the config partitions and to partitions present in json_data
+        :param json_data: DynamoDB batch write compatible JSON of the complete new config
+        :return: dict = added, changed, deleted and unchanged item counts, along with the bulk write counts
+        """
+        partitions = set(CONFIG_ITEM_PKS) | {item['pk']['S'] for item in json_data}
+        current_hashes = {
+            (item['pk']['S'], item['sk']['S']): data.canonical_item_hash(item)
+            for pk in sorted(partitions) for item in self.retrieve_partition(pk, convert=False)
+        }
+
+        counts = {"added": 0, "changed": 0, "deleted": 0, "unchanged": 0}
+        requests = []
+        new_keys = set()
+
         for item in json_data:
-            request = {
-                "PutRequest": {
-                    "Item": item
-                }
-            }
-            batch_write_compatible_json.append(request)
+            key = (item['pk']['S'], item['sk']['S'])
+            new_keys.add(key)
+            current_hash = current_hashes.get(key)
 
-        try:
-            response = self.dynamodb.batch_write_item(
-                RequestItems={
-                    self.__table_name: batch_write_compatible_json
-                }
-            )
-        except botocore.exceptions.ParamValidationError as err:
+            if current_hash == data.canonical_item_hash(item):
+                counts['unchanged'] += 1
+                continue
+
+            counts['added' if current_hash is None else 'changed'] += 1
+            requests.append({"PutRequest": {"Item": item}})
+
+        for pk, sk in current_hashes.keys() - new_keys:
+            counts['deleted'] += 1
+            requests.append({"DeleteRequest": {"Key": {"pk": {"S": pk}, "sk": {"S": sk}}}})
+
+        logger.info(f"Config sync of [{self.__table_name}]: {counts}")
+
+        return {**counts, **self.bulk_write(requests)}
+
+    def bulk_write(self, requests: list, max_workers: int = config.DYNAMODB_BATCH_WORKERS) -> dict:
+        """
+        Sends put/delete requests in batch_write_item sized chunks on a small worker pool. Unprocessed items and
+        throttled chunks are resubmitted with exponential backoff until DYNAMODB_BATCH_MAX_SECONDS, or the Lambda
+        deadline, is reached
+        :param requests: list = batch_write_item requests, e.g. {"PutRequest": {"Item": {...}}}
+        :param max_workers: int = chunks sent concurrently
+        :return: dict = {"written": int, "retried": int, "failed": int} where retried counts resubmitted requests
+        """
+        result = {"written": 0, "retried": 0, "failed": 0}
+        chunks = [requests[index:index + BATCH_WRITE_LIMIT] for index in range(0, len(requests), BATCH_WRITE_LIMIT)]
+
+        if not chunks:
+            return result
+
+        deadline = self.__batch_deadline()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for chunk_result in executor.map(lambda chunk: self.__write_chunk(chunk, deadline), chunks):
+                for count in result:
+                    result[count] += chunk_result[count]
+
+        logger.info(f"Bulk write to [{self.__table_name}] of [{len(requests)}] requests in [{len(chunks)}] chunks: "
+                    f"{result}")
+
+        if result['failed']:
             automated.exceptions.log_error(
                 automation_component=self,
-                error_message=f"DynamoDB validation failed: {err}",
+                error_message=f"Unable to write all items to [{self.__table_name}]. "
+                              f"Written: [{result['written']}], Failed: [{result['failed']}]",
                 output_to_logger=True,
+                include_in_http_response=True,
                 fatal_error=False
             )
-        except botocore.exceptions.ClientError as err:
-            automated.exceptions.log_error(
-                automation_component=self,
-                error_message=f"DynamoDB client error: {err}",
-                output_to_logger=True,
-                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
-                fatal_error=True
-            )
 
-        return response
+        return result
+
+    def __write_chunk(self, chunk: list, deadline: float) -> dict:
+        result = {"written": 0, "retried": 0, "failed": 0}
+        pending = chunk
+
+        for attempt in itertools.count():
+            try:
+                response = self.dynamodb.batch_write_item(RequestItems={self.__table_name: pending})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.__table_name, [])
+
+            except botocore.exceptions.ParamValidationError as err:
+                logger.error(f"DynamoDB validation failed: {err}")
+                result['failed'] += len(pending)
+                return result
+
+            except botocore.exceptions.ClientError as err:
+                if err.response.get('Error', {}).get('Code') not in RETRYABLE_BATCH_ERROR_CODES:
+                    logger.error(f"DynamoDB client error: {err}")
+                    result['failed'] += len(pending)
+                    return result
+                unprocessed = pending
+
+            result['written'] += len(pending) - len(unprocessed)
+            if not unprocessed:
+                return result
+
+            backoff = self.__backoff(attempt)
+            if time.monotonic() + backoff > deadline:
+                result['failed'] += len(unprocessed)
+                return result
+
+            result['retried'] += len(unprocessed)
+            time.sleep(backoff)
+            pending = unprocessed
+
+    def batch_get(self, pk: str, sort_keys, max_workers: int = config.DYNAMODB_BATCH_WORKERS) -> dict:
+        """
+        Gets the items of a partition by sort key. Keys are de-duplicated and split into batch_get_item sized chunks
+        that are requested concurrently. Unprocessed keys and throttled chunks are requested again with exponential
+        backoff until DYNAMODB_BATCH_MAX_SECONDS, or the Lambda deadline, is reached
+        :param pk: str = partition key of every requested item
+        :param sort_keys: iterable of sort keys, duplicates are requested once
+        :param max_workers: int = chunks requested concurrently
+        :return: dict = sk -> item converted to python data. Sort keys without an item are absent
+        """
+        keys = [{"pk": {"S": pk}, "sk": {"S": sort_key}} for sort_key in dict.fromkeys(sort_keys)]
+        chunks = [keys[index:index + BATCH_GET_LIMIT] for index in range(0, len(keys), BATCH_GET_LIMIT)]
+        items = {}
+
+        if not chunks:
+            return items
+
+        deadline = self.__batch_deadline()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            for chunk_items in executor.map(lambda chunk: self.__get_chunk(chunk, deadline), chunks):
+                for item in data.convert_dynamo_json_to_py_data(chunk_items):
+                    items[item['sk']] = item
+
+        return items
+
+    def __get_chunk(self, chunk: list, deadline: float) -> list:
+        items = []
+        pending = chunk
+
+        for attempt in itertools.count():
+            try:
+                response = self.dynamodb.batch_get_item(RequestItems={self.__table_name: {"Keys": pending}})
+                items.extend(response['Responses'].get(self.__table_name, []))
+                unprocessed = response.get('UnprocessedKeys', {}).get(self.__table_name, {}).get('Keys', [])
+
+            except botocore.exceptions.ClientError as err:
+                if err.response.get('Error', {}).get('Code') not in RETRYABLE_BATCH_ERROR_CODES:
+                    automated.exceptions.log_error(
+                        automation_component=self,
+                        error_message=f"While attempting to batch get items from DynamoDB. {err}",
+                        output_to_logger=True,
+                        include_in_http_response=True,
+                        http_status_code=err.response.get('ResponseMetadata', {}).get('HTTPStatusCode'),
+                        fatal_error=True
+                    )
+                unprocessed = pending
+
+            if not unprocessed:
+                return items
+
+            backoff = self.__backoff(attempt)
+            if time.monotonic() + backoff > deadline:
+                automated.exceptions.log_error(
+                    automation_component=self,
+                    error_message=f"Gave up on [{len(unprocessed)}] unprocessed keys: "
+                                  f"{[key['sk']['S'] for key in unprocessed]}",
+                    output_to_logger=True,
+                    include_in_http_response=True,
+                    fatal_error=False
+                )
+                return items
+
+            logger.info(f"Retrying [{len(unprocessed)}] unprocessed keys in [{backoff:.2f}] seconds...")
+            time.sleep(backoff)
+            pending = unprocessed
+
+    @staticmethod
+    def __batch_deadline() -> float:
+        remaining = automated.throttle.remaining_time()
+        return time.monotonic() + (config.DYNAMODB_BATCH_MAX_SECONDS if remaining is None
+                                   else min(config.DYNAMODB_BATCH_MAX_SECONDS, remaining))
+
+    @staticmethod
+    def __backoff(attempt: int) -> float:
+        # Full jitter exponential backoff
+        return random.uniform(0, min(config.API_BACKOFF_CAP_SECONDS, config.API_BACKOFF_BASE_SECONDS * 2 ** attempt))
 
     # # TODO: Is this only for testing now? Can probably move this to testing.
     # def put_period_item(self, sort_key, days_of_week=None, start_time=None, stop_time=None):
@@ -275,38 +513,218 @@ class DynamoDB:
     #     response = self.dynamodb.put_item(**request)
     #     logger.info(f"HTTP Response: {response.get('ResponseMetadata').get('HTTPStatusCode')}")
 
-    def retrieve_schedule_info(self, schedule_name: str):
+    def bump_config_version(self) -> int:
         """
-        Retrieve the periods, timezone attribute from DynamoDB table using pk: [schedule] sk: [tag_value]
-        Ex return: [{'periods': {'period_A', 'periodB', '...'}, 'timezone': 'UTC'}]
-        Note that periods is returned as a set from conversion of dynamodb JSON to python data
-        :param schedule_name: str = schedule name as retrieved from AWS scheduler tag value
-        :return:
+        Atomically increments the config version so warm containers know to reload their cached configuration
+        :return: int = new config version
         """
-        logger.info(f"Attempting to retrieve periods from DynamoDB using pk: 'schedule', sk: '{schedule_name}'")
+        try:
+            response = self.dynamodb.update_item(
+                TableName=self.__table_name,
+                Key={
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": CONFIG_VERSION_SK}
+                },
+                UpdateExpression="ADD #v :one",
+                ExpressionAttributeNames={"#v": "version"},
+                ExpressionAttributeValues={":one": {"N": "1"}},
+                ReturnValues="UPDATED_NEW"
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to bump config version: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
+                fatal_error=True
+            )
+
+        version = int(response['Attributes']['version']['N'])
+        logger.info(f"Config version bumped to [{version}]")
+        return version
 
-        # TODO: Check what happens when timezone isn't specified
+    def retrieve_config_version(self) -> int:
+        """
+        One small strongly consistent read of the config version item
+        :return: int = current config version, 0 if the config was never uploaded through put_config
+        """
         try:
             response = self.dynamodb.get_item(
                 TableName=self.__table_name,
                 Key={
-                    "pk": {
-                        'S': 'schedule'
-                    },
-                    "sk": {
-                        'S': schedule_name
-                    }
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": CONFIG_VERSION_SK}
+                },
+                ConsistentRead=True,
+                ProjectionExpression="#v",
+                ExpressionAttributeNames={"#v": "version"}
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to retrieve config version: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
+                fatal_error=True
+            )
+
+        return int(response.get('Item', {}).get('version', {}).get('N', 0))
+
+    def put_config_snapshot(self, version: int, snapshot: bytes) -> bool:
+        """
+        Stores a compiled configuration snapshot. Chunks past the first are written before the head item that points
+        at them, and the chunks of the previous snapshot are removed afterwards
+        :param version: int = config version the snapshot was compiled from
+        :param snapshot: bytes = compressed snapshot, see util.scheduleconfig.compile_snapshot
+        :return: bool = True if the snapshot was stored
+        """
+        chunk_size = config.CONFIG_SNAPSHOT_CHUNK_BYTES
+        chunks = [snapshot[index:index + chunk_size] for index in range(0, len(snapshot), chunk_size)] or [b""]
+        # Without a readable head the chunks of the previous snapshot are left behind, they are never read again
+        previous_version, previous_chunks = self.retrieve_config_snapshot_head()
+
+        result = self.bulk_write([
+            {"PutRequest": {"Item": {
+                "pk": {"S": CONFIG_PK},
+                "sk": {"S": self.__snapshot_chunk_sk(version, index)},
+                "data": {"B": chunk}
+            }}}
+            for index, chunk in enumerate(chunks[1:], start=1)
+        ])
+        if result['failed']:
+            return False
+
+        try:
+            self.dynamodb.put_item(
+                TableName=self.__table_name,
+                Item={
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": CONFIG_SNAPSHOT_SK},
+                    "version": {"N": str(version)},
+                    "chunks": {"N": str(len(chunks))},
+                    "data": {"B": chunks[0]}
+                }
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to store config snapshot: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                fatal_error=False
+            )
+            return False
+
+        logger.info(f"Stored config snapshot version [{version}]: [{len(snapshot)}] bytes in [{len(chunks)}] chunks")
+
+        if previous_version != version:
+            self.bulk_write([
+                {"DeleteRequest": {"Key": {
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": self.__snapshot_chunk_sk(previous_version, index)}
+                }}}
+                for index in range(1, previous_chunks)
+            ])
+
+        return True
+
+    def retrieve_config_snapshot(self) -> tuple:
+        """
+        Reads the compiled configuration snapshot with one get_item, plus one batch_get_item when it is chunked
+        :return: tuple = (int = snapshot version, bytes = compressed snapshot). (0, None) if there is no usable snapshot
+        """
+        try:
+            response = self.dynamodb.get_item(
+                TableName=self.__table_name,
+                Key={
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": CONFIG_SNAPSHOT_SK}
                 },
-                # timezone is a reserved key word
-                ProjectionExpression="periods, #tz",
-                ExpressionAttributeNames={
-                    "#tz": "timezone"
+                ConsistentRead=True
+            )
+        except botocore.exceptions.ClientError as err:
+            logger.warning(f"Unable to retrieve config snapshot: {err}")
+            return 0, None
+
+        item = response.get('Item')
+        if item is None:
+            return 0, None
+
+        version = int(item['version']['N'])
+        chunk_count = int(item['chunks']['N'])
+        chunks = [bytes(item['data']['B'])]
+
+        if chunk_count > 1:
+            sort_keys = [self.__snapshot_chunk_sk(version, index) for index in range(1, chunk_count)]
+            chunk_items = self.batch_get(CONFIG_PK, sort_keys)
+            if len(chunk_items) != len(sort_keys):
+                logger.warning(f"Config snapshot version [{version}] is missing chunks, ignoring it")
+                return 0, None
+            chunks.extend(bytes(chunk_items[sort_key]['data']) for sort_key in sort_keys)
+
+        return version, b"".join(chunks)
+
+    def retrieve_config_snapshot_head(self) -> tuple:
+        """
+        :return: tuple = (int = version, int = chunk count) of the stored snapshot, (0, 0) if there is none or it can
+            not be read, so the caller rebuilds it
+        """
+        try:
+            response = self.dynamodb.get_item(
+                TableName=self.__table_name,
+                Key={
+                    "pk": {"S": CONFIG_PK},
+                    "sk": {"S": CONFIG_SNAPSHOT_SK}
+                },
+                ProjectionExpression="#v, chunks",
+                ExpressionAttributeNames={"#v": "version"}
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to retrieve config snapshot head, rebuilding the snapshot: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                fatal_error=False
+            )
+            return 0, 0
+
+        item = response.get('Item', {})
+
+        return int(item.get('version', {}).get('N', 0)), int(item.get('chunks', {}).get('N', 0))
+
+    @staticmethod
+    def __snapshot_chunk_sk(version: int, index: int) -> str:
+        return f"{CONFIG_SNAPSHOT_SK}#{version}#{index}"
+
+    def retrieve_partition(self, pk: str, convert: bool = True):
+        """
+        Streams every item of a partition, e.g. all 'schedule' or all 'period' items, with one paginated Query
+        :param pk: str = partition key value
+        :param convert: bool = convert the items to python data, otherwise they are returned as DynamoDB JSON
+        :return: iterator of items
+        """
+        logger.info(f"Querying all items of partition [{pk}]...")
+        paginator = self.dynamodb.get_paginator('query')
+
+        try:
+            pages = paginator.paginate(
+                TableName=self.__table_name,
+                KeyConditionExpression="pk = :pk",
+                ExpressionAttributeValues={
+                    ":pk": {"S": pk}
                 }
             )
+
+            for page in pages:
+                yield from data.convert_dynamo_json_to_py_data(page['Items']) if convert else page['Items']
+
         except botocore.exceptions.ClientError as err:
             automated.exceptions.log_error(
                 automation_component=self,
-                error_message=f"While attempting to retrieve period information from DynamoDB. {str(err)}",
+                error_message=f"Unable to query partition [{pk}]: {err}",
                 output_to_logger=True,
                 include_in_http_response=True,
                 http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
@@ -321,92 +739,231 @@ class DynamoDB:
                 fatal_error=True
             )
 
-        period_list = None
-        periods_with_timezone = []
+    @staticmethod
+    def inventory_prefix(account_id: str, region: str) -> str:
+        """
+        Inventory items share the 'inventory' partition and are sorted by account/region so one target can be
+        loaded with a single Query
+        """
+        return f"{account_id}#{region}#"
+
+    def put_inventory_item(self, account_id: str, region: str, instance_id: str, tag_value: str, override: str,
+                           state: str = None) -> None:
+        """
+        Inserts or updates the inventory record of an instance. The last known state is kept when state is None
+        """
+        logger.info(f"Updating inventory for [{account_id}/{region}/{instance_id}] with schedule [{tag_value}] "
+                    f"override [{override}] state [{state}]")
+
+        attribute_names = {"#tag": "tag", "#region": "region", "#account": "account"}
+        attribute_values = {":tag": {"S": tag_value}, ":region": {"S": region}, ":account": {"S": account_id}}
+        update_expression = "SET #tag = :tag, #region = :region, #account = :account"
+
+        if state is not None:
+            attribute_names["#state"] = "state"
+            attribute_values[":state"] = {"S": state}
+            update_expression += ", #state = :state"
+
+        attribute_names["#override"] = "override"
+        if override is not None:
+            attribute_values[":override"] = {"S": override}
+            update_expression += ", #override = :override"
+        else:
+            update_expression += " REMOVE #override"
 
         try:
-            periods_with_timezone = data.convert_dynamo_json_to_py_data([response['Item']])
-            # period_list = response.get('Item').get('periods').get('SS')
-        except (AttributeError, KeyError) as e:
+            self.__update_inventory_item(
+                key=self.__inventory_key(account_id, region, instance_id),
+                UpdateExpression=update_expression,
+                ExpressionAttributeNames=attribute_names,
+                ExpressionAttributeValues=attribute_values
+            )
+        except botocore.exceptions.ClientError as err:
+            # Not fatal, the next full rescan of the account/region repairs the record
             automated.exceptions.log_error(
                 automation_component=self,
-                error_message=f"Unable to retrieve periods from schedule: [{schedule_name}] "
-                              f"Response: {periods_with_timezone}. "
-                              f"Are there any periods defined in the periods attribute for the schedule: "
-                              f"[{schedule_name}] ?",
+                error_message=f"Unable to update inventory of [{instance_id}]: {err}",
+                output_to_logger=True,
                 include_in_http_response=True,
                 fatal_error=False
             )
 
-        return periods_with_timezone
-
-    def retrieve_period_info(self, periods: list) -> list:
+    def update_inventory_state(self, account_id: str, region: str, instance_id: str, state: str) -> None:
         """
-        Takes a list of periods and retrieves the information associated with them from DynamoDB
-        :param: periods: list = List of periods to retrieve information about
-        :returns: list = period items and their associated information
+        Records the last known state of an instance. Instances that are not in the inventory are not scheduled,
+        so they are not added
         """
-        requested_period_amount = len(periods)
-        logger.info(f"Requesting period information for [{requested_period_amount}] periods: {periods}...")
+        logger.info(f"Updating inventory state for [{account_id}/{region}/{instance_id}] to [{state}]")
+
+        try:
+            self.__update_inventory_item(
+                key=self.__inventory_key(account_id, region, instance_id),
+                UpdateExpression="SET #state = :state",
+                ConditionExpression="attribute_exists(sk)",
+                ExpressionAttributeNames={"#state": "state"},
+                ExpressionAttributeValues={":state": {"S": state}}
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.info(f"Instance [{instance_id}] is not in the inventory. Ignoring state change.")
+        except botocore.exceptions.ClientError as err:
+            # Not fatal, the scheduler skips instances whose state is out of date and the next rescan repairs it
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to update inventory state of [{instance_id}]: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                fatal_error=False
+            )
 
-        batch_list = []
+    def delete_inventory_item(self, account_id: str, region: str, instance_id: str) -> None:
+        logger.info(f"Removing [{account_id}/{region}/{instance_id}] from inventory")
 
-        # Build the list of the periods we will batch get. This can be moved to a helper function
-        for period in periods:
-            key_structure = {
-                "pk": {
-                    "S": "period"
-                },
-                "sk": {
-                    "S": period
-                }
-            }
-            batch_list.append(key_structure)
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.__table_name,
+                Key=self.__inventory_key(account_id, region, instance_id)
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to remove [{instance_id}] from inventory: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                fatal_error=False
+            )
 
-        logger.debug(f"JSON in DynamoDB format being passed to batch_get_item: {batch_list}")
+    def retrieve_inventory(self, account_id: str, region: str):
+        """
+        Streams the inventory of an account/region from one paginated Query, a page at a time
+        :return: iterator of instance records {"instance_id": ..., "tag": ..., "override": ..., "state": ...}
+        """
+        prefix = self.inventory_prefix(account_id, region)
+        paginator = self.dynamodb.get_paginator('query')
+        instance_count = 0
 
-        response = self.dynamodb.batch_get_item(
-            RequestItems={
-                self.__table_name: {
-                    'Keys': batch_list
+        try:
+            pages = paginator.paginate(
+                TableName=self.__table_name,
+                KeyConditionExpression="pk = :pk AND begins_with(sk, :sk_prefix)",
+                ExpressionAttributeValues={
+                    ":pk": {"S": INVENTORY_PK},
+                    ":sk_prefix": {"S": prefix}
                 }
-            }
-        )
-        logger.debug(f"Query response JSON: {response['Responses'][self.__table_name]}")
-        response_period_amount = len(response['Responses'][self.__table_name])
-        response_items = response['Responses'][self.__table_name]
+            )
 
-        # We did not receive all requested items
-        if requested_period_amount != response_period_amount:
+            for page in pages:
+                for item in data.convert_dynamo_json_to_py_data(page['Items']):
+                    instance_count += 1
+                    yield {
+                        "instance_id": item['sk'][len(prefix):],
+                        "tag": item.get('tag'),
+                        "override": item.get('override'),
+                        "state": item.get('state')
+                    }
+
+        except botocore.exceptions.ClientError as err:
             automated.exceptions.log_error(
                 automation_component=self,
-                error_message=f"Did not get response for all requested period items using {periods}. Evaluating... "
-                              f"Requested: [{requested_period_amount}], Received: [{response_period_amount}].",
+                error_message=f"Unable to load inventory of [{account_id}/{region}]: {err}",
+                output_to_logger=True,
                 include_in_http_response=True,
-                fatal_error=False
+                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
+                fatal_error=True
             )
-            # Find which period was not returned properly and log it
-            for period in periods:
-                if not any(response['sk']['S'] == period for response in response_items):
-                    automated.exceptions.log_error(
-                        automation_component=self,
-                        error_message=f"Error in DynamoDB Batch Get Item when requested period information."
-                                      f"Did not get proper response for all requested period items using: '{periods}' "
-                                      f"Requested: '{requested_period_amount}', Received: '{response_period_amount}'. "
-                                      f"Period '{period}' was not properly retrieved!",
-                        include_in_http_response=True,
-                        fatal_error=False
-                    )
 
-        if not len(response.get('Responses').get(self.__table_name)):
-            logger.info(f"Unable to retrieve period information for '{periods}'")
+        logger.info(f"Loaded [{instance_count}] instances from inventory of [{account_id}/{region}]")
+
+    def replace_inventory(self, account_id: str, region: str, instance_list, scanned_at: int) -> None:
+        """
+        Repairs drift after a full describe_instances rescan. Writes every discovered instance, removes the records of
+        instances that were not discovered and records when the rescan happened
+        :param instance_list: iterable of instance records
+        """
+        for _ in self.stream_inventory_rescan(account_id, region, instance_list, scanned_at):
+            pass
+
+    def stream_inventory_rescan(self, account_id: str, region: str, instance_list, scanned_at: int):
+        """
+        Same as replace_inventory, but hands every instance record back as soon as it is queued for writing so the
+        rescan can feed evaluation directly. Writes go out every BATCH_WRITE_LIMIT records. Stale records are removed
+        and the rescan time recorded once the stream is exhausted
+        :param instance_list: iterable of instance records
+        :return: iterator of the instance records of instance_list
+        """
+        discovered = set()
+        requests = []
+
+        for instance in instance_list:
+            item = {
+                **self.__inventory_key(account_id, region, instance['instance_id']),
+                "tag": {"S": instance['tag']},
+                "region": {"S": region},
+                "account": {"S": account_id}
+            }
+            for attribute in ("override", "state"):
+                if instance.get(attribute) is not None:
+                    item[attribute] = {"S": instance[attribute]}
+
+            requests.append({"PutRequest": {"Item": item}})
+            discovered.add(instance['instance_id'])
+            if len(requests) == BATCH_WRITE_LIMIT:
+                self.bulk_write(requests)
+                requests = []
+
+            yield instance
+
+        stale = [inst['instance_id'] for inst in self.retrieve_inventory(account_id, region)
+                 if inst['instance_id'] not in discovered]
+        for instance_id in stale:
+            requests.append({"DeleteRequest": {"Key": self.__inventory_key(account_id, region, instance_id)}})
+
+        requests.append({"PutRequest": {"Item": {
+            "pk": {"S": INVENTORY_SCAN_PK},
+            "sk": {"S": self.inventory_prefix(account_id, region)},
+            "scanned_at": {"N": str(scanned_at)}
+        }}})
+
+        logger.info(f"Rewrote inventory of [{account_id}/{region}]: [{len(discovered)}] instances, "
+                    f"[{len(stale)}] stale records removed")
+        self.bulk_write(requests)
+
+    def retrieve_inventory_scan_time(self, account_id: str, region: str) -> int:
+        """
+        :return: int = epoch seconds of the last full rescan of the account/region, 0 if it was never scanned or the
+            time can not be read, so the caller rescans
+        """
+        try:
+            response = self.dynamodb.get_item(
+                TableName=self.__table_name,
+                Key={
+                    "pk": {"S": INVENTORY_SCAN_PK},
+                    "sk": {"S": self.inventory_prefix(account_id, region)}
+                }
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to retrieve inventory scan time of [{account_id}/{region}], rescanning: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                fatal_error=False
+            )
+            return 0
 
-        logger.debug(f"Received response with [{len(response['Responses'][self.__table_name])}] items.")
-        logger.debug(f"Received all items? {len(periods) == len(response['Responses'][self.__table_name])}")
+        return int(response.get('Item', {}).get('scanned_at', {}).get('N', 0))
 
-        converted_period_info = data.convert_dynamo_json_to_py_data(response['Responses'][self.__table_name])
+    def __inventory_key(self, account_id: str, region: str, instance_id: str) -> dict:
+        return {
+            "pk": {"S": INVENTORY_PK},
+            "sk": {"S": f"{self.inventory_prefix(account_id, region)}{instance_id}"}
+        }
 
-        return converted_period_info
+    def __update_inventory_item(self, key: dict, **kwargs) -> None:
+        self.dynamodb.update_item(
+            TableName=self.__table_name,
+            Key=key,
+            **kwargs
+        )
 
     # def _log_error(self, error_message: str, output_to_logger=True, include_in_http_response=True, fatal_error=False):
     #     if include_in_http_response:
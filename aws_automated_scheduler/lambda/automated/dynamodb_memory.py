@@ -0,0 +1,328 @@
+"""
+In process stand-in for the DynamoDB client used by automated.dynamodb.DynamoDB when it is created with
+db_conn=config.DB_CONN_MEMORY. Runs tests and load benchmarks at memory speed without dynamodb-local.
+Expressions are limited to the forms used by automated.dynamodb
+"""
+from collections import Counter
+import bisect
+import threading
+import botocore.exceptions
+
+# Tables shared by every in memory client of the process, like tables of a real endpoint. table name -> MemoryTable
+_tables: dict = {}
+_tables_lock = threading.Lock()
+
+# Request limits enforced by DynamoDB
+BATCH_WRITE_LIMIT = 25
+BATCH_GET_LIMIT = 100
+
+_RESPONSE_METADATA = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def client_error(error_code: str, operation_name: str, message: str = None) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {
+            "Error": {"Code": error_code, "Message": message or f"Simulated {error_code}"},
+            "ResponseMetadata": {"HTTPStatusCode": 400}
+        },
+        operation_name
+    )
+
+
+def reset() -> None:
+    """
+    Drops every in memory table
+    """
+    with _tables_lock:
+        _tables.clear()
+
+
+class MemoryTable:
+    """
+    Items of a pk/sk table in a dict, with a sorted index of their keys for Query and Scan
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # (pk, sk) -> DynamoDB JSON item
+        self.items = {}
+        self.__keys = []
+        self.lock = threading.RLock()
+
+    def get(self, key: tuple):
+        return self.items.get(key)
+
+    def put(self, key: tuple, item: dict) -> None:
+        if key not in self.items:
+            bisect.insort(self.__keys, key)
+        self.items[key] = item
+
+    def delete(self, key: tuple) -> None:
+        if self.items.pop(key, None) is not None:
+            del self.__keys[bisect.bisect_left(self.__keys, key)]
+
+    def keys_from(self, start: tuple = None) -> list:
+        """
+        :param start: tuple = exclusive start key, None to start at the first key
+        :return: list = keys in sort order after start
+        """
+        return self.__keys[bisect.bisect_right(self.__keys, start):] if start is not None else list(self.__keys)
+
+    def partition_keys(self, pk: str, sk_prefix: str = "", start: tuple = None) -> list:
+        """
+        :return: list = keys of the partition whose sort key starts with sk_prefix, in sort order after start
+        """
+        index = bisect.bisect_left(self.__keys, (pk, sk_prefix))
+        if start is not None:
+            index = max(index, bisect.bisect_right(self.__keys, start))
+
+        keys = []
+        for key in self.__keys[index:]:
+            if key[0] != pk or not key[1].startswith(sk_prefix):
+                break
+            keys.append(key)
+        return keys
+
+
+class MemoryExceptions:
+    class ConditionalCheckFailedException(botocore.exceptions.ClientError):
+        def __init__(self):
+            super().__init__({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+
+
+class MemoryPaginator:
+    """
+    Follows LastEvaluatedKey like the boto3 query and scan paginators
+    """
+
+    def __init__(self, client, operation_name: str):
+        self.__client = client
+        self.__operation_name = operation_name
+
+    def paginate(self, **kwargs):
+        operation = getattr(self.__client, self.__operation_name)
+        start_key = None
+
+        while True:
+            page = operation(**kwargs, **({"ExclusiveStartKey": start_key} if start_key is not None else {}))
+            yield page
+
+            start_key = page.get('LastEvaluatedKey')
+            if start_key is None:
+                return
+
+
+class MemoryDynamoDBClient:
+    """
+    Supports get_item, put_item, update_item, delete_item, batch_get_item, batch_write_item, query and scan along with
+    the query and scan paginators. Keeps a count of every call.
+    page_size items are returned per query/scan page, standing in for the 1 MB page limit. write_capacity and
+    read_capacity limit the requests processed per batch call, the rest is returned as UnprocessedItems/UnprocessedKeys
+    """
+
+    exceptions = MemoryExceptions
+
+    def __init__(self, page_size: int = 100, tables: dict = None):
+        """
+        :param page_size: int = items per query/scan page
+        :param tables: dict = table name -> MemoryTable. Tables shared by the process when not given
+        """
+        self.page_size = page_size
+        self.tables = _tables if tables is None else tables
+        # Requests processed per batch_write_item call, None for all of them
+        self.write_capacity = None
+        # Keys read per batch_get_item call, None for all of them
+        self.read_capacity = None
+        self.calls = Counter()
+        self.__calls_lock = threading.Lock()
+
+    def _call(self, operation_name: str) -> None:
+        with self.__calls_lock:
+            self.calls[operation_name] += 1
+
+    def _table(self, table_name: str, operation_name: str) -> MemoryTable:
+        table = self.tables.get(table_name)
+        if table is None:
+            raise client_error("ResourceNotFoundException", operation_name, f"Requested table not found: {table_name}")
+        return table
+
+    @staticmethod
+    def _key(key: dict) -> tuple:
+        return key['pk']['S'], key['sk']['S']
+
+    @staticmethod
+    def _project(item: dict, projection_expression: str = None, names: dict = None) -> dict:
+        if projection_expression is None:
+            return item
+        names = names or {}
+        attributes = [names.get(name.strip(), name.strip()) for name in projection_expression.split(",")]
+        return {name: item[name] for name in attributes if name in item}
+
+    def create_table(self, TableName, **kwargs):
+        self._call('create_table')
+        with _tables_lock:
+            if TableName in self.tables:
+                raise client_error("ResourceInUseException", "CreateTable")
+            self.tables[TableName] = MemoryTable(TableName)
+        return {"TableDescription": {"TableName": TableName, "TableStatus": "ACTIVE"}, **_RESPONSE_METADATA}
+
+    def describe_table(self, TableName):
+        self._call('describe_table')
+        self._table(TableName, "DescribeTable")
+        return {"Table": {"TableName": TableName, "TableStatus": "ACTIVE"}, **_RESPONSE_METADATA}
+
+    def get_item(self, TableName, Key, ConsistentRead=False, ProjectionExpression=None,
+                 ExpressionAttributeNames=None):
+        self._call('get_item')
+        table = self._table(TableName, "GetItem")
+
+        with table.lock:
+            item = table.get(self._key(Key))
+
+        if item is None:
+            return dict(_RESPONSE_METADATA)
+        return {"Item": self._project(item, ProjectionExpression, ExpressionAttributeNames), **_RESPONSE_METADATA}
+
+    def put_item(self, TableName, Item):
+        self._call('put_item')
+        table = self._table(TableName, "PutItem")
+
+        with table.lock:
+            table.put(self._key(Item), Item)
+        return dict(_RESPONSE_METADATA)
+
+    def delete_item(self, TableName, Key):
+        self._call('delete_item')
+        table = self._table(TableName, "DeleteItem")
+
+        with table.lock:
+            table.delete(self._key(Key))
+        return dict(_RESPONSE_METADATA)
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ConditionExpression=None, ReturnValues=None):
+        """
+        Supports "ADD #name :value" and "SET #a = :a, ... [REMOVE #b, ...]" with an optional attribute_exists(sk)
+        condition
+        """
+        self._call('update_item')
+        table = self._table(TableName, "UpdateItem")
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        key = self._key(Key)
+
+        with table.lock:
+            if ConditionExpression == "attribute_exists(sk)" and table.get(key) is None:
+                raise self.exceptions.ConditionalCheckFailedException()
+
+            item = dict(table.get(key) or Key)
+
+            if UpdateExpression.startswith("ADD "):
+                name, value = UpdateExpression[len("ADD "):].split(" ")
+                name = names.get(name, name)
+                item[name] = {"N": str(int(item.get(name, {"N": "0"})['N']) + int(values[value]['N']))}
+                table.put(key, item)
+                return {"Attributes": {name: item[name]}, **_RESPONSE_METADATA}
+
+            set_expression, _, remove_expression = UpdateExpression.partition(" REMOVE ")
+            for assignment in set_expression[len("SET "):].split(", "):
+                name, value = assignment.split(" = ")
+                item[names.get(name, name)] = values[value]
+            for name in filter(None, remove_expression.split(", ")):
+                item.pop(names.get(name, name), None)
+
+            table.put(key, item)
+        return dict(_RESPONSE_METADATA)
+
+    def batch_get_item(self, RequestItems):
+        self._call('batch_get_item')
+        responses, unprocessed_keys = {}, {}
+
+        if sum(len(request['Keys']) for request in RequestItems.values()) > BATCH_GET_LIMIT:
+            raise botocore.exceptions.ParamValidationError(report="Too many items requested")
+
+        for table_name, request in RequestItems.items():
+            table = self._table(table_name, "BatchGetItem")
+            keys = [self._key(key) for key in request['Keys']]
+            if len(set(keys)) != len(keys):
+                raise client_error("ValidationException", "BatchGetItem", "Provided list of keys contains duplicates")
+
+            # Like a table short on read capacity, anything past read_capacity keys is left unprocessed
+            processed = keys if self.read_capacity is None else keys[:self.read_capacity]
+            if len(processed) < len(keys):
+                unprocessed_keys[table_name] = {**request, "Keys": request['Keys'][len(processed):]}
+
+            with table.lock:
+                responses[table_name] = [
+                    self._project(table.get(key), request.get('ProjectionExpression'),
+                                  request.get('ExpressionAttributeNames'))
+                    for key in processed if table.get(key) is not None
+                ]
+
+        return {"Responses": responses, "UnprocessedKeys": unprocessed_keys, **_RESPONSE_METADATA}
+
+    def batch_write_item(self, RequestItems):
+        self._call('batch_write_item')
+        unprocessed_items = {}
+
+        if sum(len(requests) for requests in RequestItems.values()) > BATCH_WRITE_LIMIT:
+            raise botocore.exceptions.ParamValidationError(report="Too many items requested")
+
+        for table_name, requests in RequestItems.items():
+            table = self._table(table_name, "BatchWriteItem")
+
+            # Like a table short on write capacity, anything past write_capacity items is left unprocessed
+            processed = requests if self.write_capacity is None else requests[:self.write_capacity]
+            if len(processed) < len(requests):
+                unprocessed_items[table_name] = requests[len(processed):]
+
+            with table.lock:
+                for request in processed:
+                    if "PutRequest" in request:
+                        table.put(self._key(request['PutRequest']['Item']), request['PutRequest']['Item'])
+                    else:
+                        table.delete(self._key(request['DeleteRequest']['Key']))
+
+        return {"UnprocessedItems": unprocessed_items, **_RESPONSE_METADATA}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExclusiveStartKey=None,
+              Limit=None, **kwargs):
+        """
+        Supports "pk = :pk" and "pk = :pk AND begins_with(sk, :sk_prefix)"
+        """
+        self._call('query')
+        table = self._table(TableName, "Query")
+        start = self._key(ExclusiveStartKey) if ExclusiveStartKey is not None else None
+
+        with table.lock:
+            keys = table.partition_keys(
+                ExpressionAttributeValues[':pk']['S'],
+                ExpressionAttributeValues.get(':sk_prefix', {}).get('S', ""),
+                start
+            )
+            return self._page(table, keys, Limit)
+
+    def scan(self, TableName, Segment=0, TotalSegments=1, ExclusiveStartKey=None, Limit=None, **kwargs):
+        """
+        Items are spread over the segments by their position in key order
+        """
+        self._call('scan')
+        table = self._table(TableName, "Scan")
+
+        with table.lock:
+            keys = table.keys_from()[Segment::TotalSegments]
+            if ExclusiveStartKey is not None:
+                keys = keys[bisect.bisect_right(keys, self._key(ExclusiveStartKey)):]
+            return self._page(table, keys, Limit)
+
+    def get_paginator(self, operation_name):
+        return MemoryPaginator(self, operation_name)
+
+    def _page(self, table: MemoryTable, keys: list, limit: int = None) -> dict:
+        page_size = min(limit or self.page_size, self.page_size)
+        page_keys = keys[:page_size]
+        page = {"Items": [table.get(key) for key in page_keys], "Count": len(page_keys), **_RESPONSE_METADATA}
+
+        if len(keys) > page_size:
+            page['LastEvaluatedKey'] = {"pk": {"S": page_keys[-1][0]}, "sk": {"S": page_keys[-1][1]}}
+        return page
@@ -1,23 +1,42 @@
 from boto3 import client
+import botocore.config
 import botocore.exceptions
+import jmespath
+import automated.clients
 import automated.exceptions
+import automated.throttle as throttle
 import logging
 import automated.ec2_actions as ec2_actions
 import config
 
 logger = logging.getLogger()
 
+OVERRIDE_TAG_KEY = "override"
+
+# Errors caused by a single instance of a batch. The batch is split to find it instead of failing all instances
+BISECT_ERROR_CODES = ("IncorrectInstanceState", "InvalidInstanceID.NotFound")
+
+# Throttling and retries are handled by automated.throttle, so botocore must not retry on its own as well
+CLIENT_CONFIG = botocore.config.Config(retries={"max_attempts": 1, "mode": "standard"})
+
 
 class EC2:
 
-    def __init__(self, region: str, ec2_conn: str = config.EC2_CONN_DEFAULT):
+    def __init__(self, region: str, ec2_conn: str = config.EC2_CONN_DEFAULT, credentials: dict = None,
+                 page_size: int = config.EC2_DESCRIBE_PAGE_SIZE):
         """
         :param region: str - AWS region for connection endpoint
         :param ec2_conn: str - EC2 connection endpoint. Used for mock testing methods
+        :param credentials: dict - STS credentials of an assumed role. Uses the Lambda role when not given
+        :param page_size: int - Instances returned per describe_instances page (5 - 1000)
         """
         self._region = region
         self.__ec2_conn = ec2_conn
-        self.__ec2 = client("ec2", region_name=self._region)
+        self.__page_size = page_size
+
+        self.__ec2 = automated.clients.get(client, "ec2", region_name=self._region, credentials=credentials,
+                                           client_config=CLIENT_CONFIG)
+
         self._test_run = config.is_test_run()
         self.__errors = []
 
@@ -33,87 +52,133 @@ class EC2:
     def errors(self):
         return self.__errors
 
-    def get_instances_from_tag_key(self, tag_key: str) -> list:
+    def get_instances_from_tag_key(self, tag_key: str):
         """
         Retrieve instance id's from EC2 instances tagged with AWS automated scheduler defined automation tag only
+        Instances are yielded page by page as describe_instances results come in, so callers can start acting on the
+        first page while later pages are still being fetched
         :param tag_key: str = The tag key to filter ec2 results on
-        :return list = collection of instances and associated tag values retrieved from them
+        :return: iterator of instances, their current state and associated tag values retrieved from them
         """
 
         if not self._test_run:
-            paginated_instances = self._retrieve_all_instances_with_tag_key(tag_key=tag_key)
-            instance_id_list: list = self._retrieve_instance_id_and_schedule_tag_info(
-                paginated_instances=paginated_instances,
+            projected_instances = self._retrieve_all_instances_with_tag_key(tag_key=tag_key)
+            return self._retrieve_instance_id_and_schedule_tag_info(
+                projected_instances=projected_instances,
                 tag_key=tag_key
             )
-        else:
-            instance_id_list: list = self.__testing_get_mock_ec2_instances()
 
-        return instance_id_list
+        return iter(self.__testing_get_mock_ec2_instances())
 
     def _retrieve_all_instances_with_tag_key(self, tag_key: str):
-        ec2_paginator = self.__ec2.get_paginator('describe_instances')
-        ec2_iterator = None
-
+        """
+        Pages through describe_instances. EC2 filters out instances that are not tagged or not in a state we can act on,
+        and each page is projected down to the instance id, state and scheduler tags before it is handed back.
+        Every page request goes through the describe rate limiter.
+        :param tag_key: str = The tag key to filter ec2 results on
+        :return: iterator of projected instances {"instance_id": ..., "state": ..., "tags": [...]}
+        """
         logger.info(f"Looking for all instances in '{self._region} with tag: '{tag_key}'")
 
-        query_filter = {
+        projection = jmespath.compile(self.__instance_projection((tag_key, OVERRIDE_TAG_KEY)))
+        request = {
             "Filters": [
                 {
                     "Name": "tag-key",
                     "Values": [tag_key]
+                },
+                {
+                    "Name": "instance-state-name",
+                    "Values": list(config.EC2_ACTIONABLE_INSTANCE_STATES)
                 }
-            ]
+            ],
+            "MaxResults": self.__page_size
         }
 
-        try:
-            ec2_iterator = ec2_paginator.paginate(**query_filter)
-
-        except botocore.exceptions.ParamValidationError as err:
-            automated.exceptions.log_error(
-                automation_component=self,
-                error_message=f"AWS Tag key in improper format or missing: {err}",
-                output_to_logger=True,
-                include_in_http_response=True,
-                fatal_error=True
-            )
+        while True:
+            try:
+                page = throttle.call(throttle.DESCRIBE, self.__ec2.describe_instances, **request)
+
+            except botocore.exceptions.ParamValidationError as err:
+                automated.exceptions.log_error(
+                    automation_component=self,
+                    error_message=f"AWS Tag key in improper format or missing: {err}",
+                    output_to_logger=True,
+                    include_in_http_response=True,
+                    fatal_error=True
+                )
+
+            yield from projection.search(page) or []
+
+            if not page.get('NextToken'):
+                break
+            request['NextToken'] = page['NextToken']
+
+    @staticmethod
+    def __instance_projection(tag_keys: tuple) -> str:
+        """
+        JMESPath expression applied to every describe_instances page. Instance lifecycles can only be filtered on by
+        inclusion server side, so the lifecycles we can not stop (spot, scheduled) are dropped here instead
+        """
+        def literal(value: str) -> str:
+            return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+        lifecycle_filter = " && ".join(
+            f"InstanceLifecycle != {literal(lifecycle)}" for lifecycle in config.EC2_UNSCHEDULABLE_LIFECYCLES
+        )
+        tag_filter = " || ".join(f"Key == {literal(tag_key)}" for tag_key in tag_keys)
 
-        return ec2_iterator
+        return f"Reservations[].Instances[] | [?{lifecycle_filter}]" \
+               f".{{instance_id: InstanceId, state: State.Name, tags: Tags[?{tag_filter}]}}"
 
-    def _retrieve_instance_id_and_schedule_tag_info(self, paginated_instances, tag_key) -> list:
-        instance_id_list: list = []
+    def _retrieve_instance_id_and_schedule_tag_info(self, projected_instances, tag_key):
+        """
+        Builds the instance records from the projected describe_instances results. Tags are read from the 'Tags' array
+        that describe_instances already returns, so discovery costs one API call per page rather than per instance.
+        :param projected_instances: iterator of projected instances from _retrieve_all_instances_with_tag_key
+        :param tag_key: str = The scheduler tag key
+        :return: iterator of instance records {"instance_id": ..., "tag": ..., "override": ..., "state": ...}
+        """
+        tag_keys: tuple = (tag_key, OVERRIDE_TAG_KEY)
+
+        for instance in projected_instances:
+            tag_values = self.get_tag_values(instance.get('tags') or [], tag_keys)
 
-        # CODE REVIEW: Is there a more performant way to do this? Each iteration is a little slow and would cause
-        # a linear decrease in speed with n number of instances. Is it because we are calling describe tags twice
-        # for each instance?
+            inst = {
+                "instance_id": instance['instance_id'],
+                "tag": tag_values[tag_key],
+                "override": tag_values[OVERRIDE_TAG_KEY],
+                "state": instance.get('state')
+            }
 
-        for results in paginated_instances:
-            for reservations in results['Reservations']:
-                for instance in reservations['Instances']:
-                    tag_value = self.get_tag_value(instance['InstanceId'], tag_key)
-                    override = self.get_tag_value(instance['InstanceId'], "override")
+            logger.info(f"Discovered EC2 resource: {inst}")
+            yield inst
 
-                    inst = {
-                        "instance_id": instance['InstanceId'],
-                        "tag": tag_value,
-                        "override": override
-                    }
+    @staticmethod
+    def get_tag_values(tags: list, tag_keys: tuple) -> dict:
+        """
+        Extracts the values of the requested tag keys from an EC2 'Tags' array, e.g. [{"Key": "k", "Value": "v"}]
+        :param list tags: Tags as returned in the describe_instances response
+        :param tuple tag_keys: Tag keys to get the values of
+        :return dict: tag key -> tag value. Keys that are not present on the resource map to None
+        """
+        tag_values = dict.fromkeys(tag_keys)
 
-                    instance_id_list.append(inst)
-                    logger.info(f"Discovered EC2 resource: {inst}")
+        for tag in tags:
+            if tag.get('Key') in tag_values:
+                tag_values[tag.get('Key')] = tag.get('Value')
 
-        return instance_id_list
+        return tag_values
 
     def get_tag_value(self, resource_id: str, tag_key: str) -> str:
         """
         Gets the value of the specified tag from the specified resource
+        Costs a describe_tags call, use get_tag_values when the resource description is already at hand
         :param str resource_id: AWS ID of the resource
         :param str tag_key: Tag key to get the value of
         :return str tag_value: Value of tag retrieved from tag key
         """
 
-        tag_value = None
-
         query = {
             "Filters": [
                 {
@@ -125,154 +190,172 @@ class EC2:
 
         # It seems that boto3.resource.ec2.describe_tags can not use multiple filters or I would filter on the
         # instance and the tag itself. Instead, filter off the instance id, then retrieve the tag from it
-        tags = self.__ec2.describe_tags(**query)
+        tags = throttle.call(throttle.DESCRIBE, self.__ec2.describe_tags, **query)
 
-        # Find our scheduling tag and get the value of the [key: value] pair
-        # Since we only filters on instance type, we have to loop through all the tags to find the one we want
-        for tag in tags['Tags']:
-            if tag.get('Key') == tag_key:
-                tag_value = tag.get('Value')
+        return self.get_tag_values(tags['Tags'], (tag_key,))[tag_key]
 
-        return tag_value
+    def perform_action(self, action: str, instance_id: str) -> bool:
+        """
+        Performs the action on a single instance
+        :param action: str = ec2_actions.START or ec2_actions.STOP
+        :param instance_id: str = instance to perform the action on
+        :return: bool = True if the instance changed state
+        """
+        return any(transition['changed'] for transition in self.perform_batch_action(action, [instance_id]))
 
-    def get_tag_value_v2(self, resource_id: str, tag_keys: set) -> set:
+    def perform_batch_action(self, action: str, instance_ids: list) -> list:
         """
-        Attempt to speed up calls to retrieve tags. Instead of one call for each tag, make it get all tags for one call
+        Performs the action on all of the instances with a single start_instances/stop_instances call.
+        If the call is rejected because of one bad instance (wrong state or not found) the batch is bisected and
+        retried so the remaining instances still get their action.
+        :param action: str = ec2_actions.START or ec2_actions.STOP
+        :param instance_ids: list = instances to perform the action on
+        :return: list = state transitions of {"instance_id", "action", "previous_state", "current_state", "changed"}
         """
+        if action is ec2_actions.NONE or not instance_ids:
+            return []
 
-        tag_value = None
+        logger.info(f"Received call to perform action [{action}] on [{len(instance_ids)}] instances: {instance_ids}")
 
-        query = {
-            "Filters": [
-                {
-                    "Name": "resource-id",
-                    "Values": [resource_id]
-                }
-            ]
-        }
+        response = None
 
-        # It seems that boto3.resource.ec2.describe_tags can not use multiple filters or I would filter on the
-        # instance and the tag itself. Instead, filter off the instance id, then retrieve the tag from it
-        tags = self.__ec2.describe_tags(**query)
+        try:
+            if action == ec2_actions.START:
+                response = self.__start_instances(instance_ids)
+            elif action == ec2_actions.STOP:
+                response = self.__stop_instances(instance_ids)
+
+        except botocore.exceptions.ClientError as err:
+            error_code = err.response.get('Error').get('Code')
+
+            if error_code == "UnauthorizedOperation":
+                logger.warning(err)
+            elif error_code in throttle.THROTTLE_ERROR_CODES + throttle.TRANSIENT_ERROR_CODES:
+                # Retries ran out. Report the instances that were not actioned rather than aborting the run
+                automated.exceptions.log_error(
+                    automation_component=self,
+                    error_message=f"Unable to perform action <{action}> on {instance_ids} after retries: {err}",
+                    output_to_logger=True,
+                    include_in_http_response=True,
+                    fatal_error=False
+                )
+            elif error_code in BISECT_ERROR_CODES and len(instance_ids) > 1:
+                logger.warning(f"Action [{action}] rejected for batch of [{len(instance_ids)}] instances "
+                               f"({error_code}). Splitting batch to isolate the failing instance...")
+                middle = len(instance_ids) // 2
+                return self.perform_batch_action(action, instance_ids[:middle]) + \
+                    self.perform_batch_action(action, instance_ids[middle:])
+            elif error_code in BISECT_ERROR_CODES:
+                logger.error(f"Unable to perform action <{action}> on {instance_ids[0]} - {err}")
+            else:
+                logger.error(f"Problem performing action <{action}> on {instance_ids}: {err}")
+                raise automated.exceptions.ClientError(err)
 
-        schedule_value = None
-        override_value = None
+        if response is None:
+            return []
 
-        # Find our scheduling tag and get the value of the [key: value] pair
-        # Since we only filters on instance type, we have to loop through all the tags to find the one we want
-        for tag in tags['Tags']:
-            if tag.get('Key') in tag_keys:
-                if tag.get('Key') == "Schedule":
-                    schedule_value = tag.get('Value')
-                elif tag.get('Key') == "override":
-                    override_value = tag.get('Value')
+        return self.__parse_state_changes(action, response)
 
-        return set(resource_id, schedule_value, override_value)
+    def __start_instances(self, instance_ids: list) -> dict:
+        return throttle.call(
+            throttle.MUTATE,
+            self.__ec2.start_instances,
+            InstanceIds=instance_ids,
+            DryRun=False
+        )
 
-    def perform_action(self, action: str, instance_id: str) -> bool:
+    def __stop_instances(self, instance_ids: list) -> dict:
+        """
+        Look into enabling hibernation for instances, but probably not a use case for this app
+        This does not throw an error if the instance is already stopped, pending start, or pending stop
         """
-        :param action:
-        :param instance_id:
+        return throttle.call(
+            throttle.MUTATE,
+            self.__ec2.stop_instances,
+            InstanceIds=instance_ids,
+            Hibernate=False,
+            DryRun=False
+        )
+
+    def __parse_state_changes(self, action: str, instance_api_response: dict) -> list:
         """
-        logger.info(f"Received call to perform action [{action}] on [{instance_id}]")
+        Converts every entry of the StartingInstances/StoppingInstances response into a state transition
+        """
+        response_key = 'StartingInstances' if action == ec2_actions.START else 'StoppingInstances'
+        transitions = []
 
-        response = None
-        state_changed = False
+        for state_change in instance_api_response.get(response_key, []):
+            instance_id = state_change.get('InstanceId')
+            previous_state = state_change.get('PreviousState', {}).get('Name')
+            current_state = state_change.get('CurrentState', {}).get('Name')
+
+            if current_state != previous_state:
+                logger.info(f"Instance [{instance_id}] changed states from {previous_state} to {current_state}.")
+            else:
+                logger.info(f"Instance [{instance_id}] desired state {action} was already in state {previous_state}")
+
+            transitions.append({
+                "instance_id": instance_id,
+                "action": action,
+                "previous_state": previous_state,
+                "current_state": current_state,
+                "changed": current_state != previous_state
+            })
 
-        if action is ec2_actions.START:
-            logger.info(f"Starting instance [{instance_id}]...")
-            response = self.__start_instance(instance_id)
-        elif action is ec2_actions.STOP:
-            logger.info(f"Stopping instance [{instance_id}]...")
-            response = self.__stop_instance(instance_id)
+        return transitions
+
+    # TESTING ONLY
+    def __testing_get_mock_ec2_instances(self) -> list:
+        return [
+            {"instance_id": "i-007", "tag": "us_hours", "override": None, "state": "running"},
+            {"instance_id": "i-0049", "tag": "uk_hours", "override": None, "state": "stopped"},
+            {"instance_id": "i-512", "tag": "austin_offices", "override": None, "state": "running"},
+            {"instance_id": "i-212", "tag": "new_york_offices", "override": None, "state": "stopping"},
+        ]
 
-        if response is not None:
-            state_changed = self.__was_instances_state_changed(action, response)
 
-        return state_changed
+class ActionAccumulator:
+    """
+    Groups instance ids by action so they can be sent as chunked start_instances/stop_instances calls
+    instead of one call per instance. A chunk is sent as soon as it is full, so actions go out while instances are
+    still being discovered and at most batch_size ids are held per action
+    """
 
-    # TODO: Ran into this situation
-    # [ERROR] Problem starting instance i-00a9e45169fcb0651: An error occurred (IncorrectInstanceState) when calling
-    # the StartInstances operation: The instance 'i-00a9e45169fcb0651' is not in a state from which it can be started.
-    # I want to log the error, but not cause a fatal response or exception
+    def __init__(self, ec2: EC2, batch_size: int = config.EC2_ACTION_BATCH_SIZE):
+        self.__ec2 = ec2
+        self.__batch_size = batch_size
+        self.__pending = {ec2_actions.START: [], ec2_actions.STOP: []}
 
-    def __start_instance(self, instance_id: str):
+    def add(self, action: str, instance_id: str) -> list:
         """
-        :param instance_id:
-        :return:
+        :return: list = state transitions of the chunk that was sent because it filled up, empty otherwise
         """
-        response = None
+        if action not in self.__pending:
+            return []
 
-        try:
-            response = self.__ec2.start_instances(
-                InstanceIds=[
-                    instance_id
-                ],
-                DryRun=False
-            )
-        except botocore.exceptions.ClientError as err:
-            if err.response.get('Error').get('Code') == "UnauthorizedOperation":
-                logger.warning(err)
-            elif err.response.get('Error').get('Code') == "InvalidInstanceID.NotFound":
-                logger.error(f"Unable to perform action <stop> on {instance_id} - Unable to find the instance.")
-            else:
-                logger.error(f"Problem starting instance {instance_id}: {err}")
-                raise automated.exceptions.ClientError(err)
+        self.__pending[action].append(instance_id)
+        if len(self.__pending[action]) < self.__batch_size:
+            return []
 
-        return response
+        return self.__send(action)
 
-    def __stop_instance(self, instance_id: str):
+    def dispatch(self) -> list:
         """
-        Look into enabling hibernation for instances, but probably not a use case for this app
-        :param instance_id:
-        :return:
+        Sends every action that is still pending
+        :return: list = state transitions of every instance that was sent an action
         """
-        # This could become a single call for stopped instances if we want by building up a list of actions.stop
-        # This does not throw an error if the instance is already stopped, pending start, or pending stop
-        # and we try and stop it. It might be worthwhile to just make a single stop call rather than check the state
-
-        response = None
-        try:
-            response = self.__ec2.stop_instances(
-                InstanceIds=[
-                    instance_id
-                ],
-                Hibernate=False,
-                DryRun=False
-            )
-        except botocore.exceptions.ClientError as err:
-            if err.response.get('Error').get('Code') == "UnauthorizedOperation":
-                logger.warning(err)
-            elif err.response.get('Error').get('Code') == "InvalidInstanceID.NotFound":
-                logger.error(f"Unable to perform action <stop> on {instance_id} - Unable to find the instance.")
-            else:
-                raise automated.exceptions.ClientError(err)
+        transitions = []
 
-        return response
+        for action in self.__pending:
+            transitions.extend(self.__send(action))
 
-    def __was_instances_state_changed(self, action, instance_api_response):
-        # Assumption that we are only stopping one instance at a time, if we end up starting/stopping
-        # multiple then we will have to rework the logic to return the status code along with the instance
-        # or change the logic otherwise to receive the single response and return result
-        if action == ec2_actions.STOP:
-            current_state = instance_api_response.get('StoppingInstances')[0].get('CurrentState')
-            previous_state = instance_api_response.get('StoppingInstances')[0].get('PreviousState')
-        elif action == ec2_actions.START:
-            current_state = instance_api_response.get('StartingInstances')[0].get('CurrentState')
-            previous_state = instance_api_response.get('StartingInstances')[0].get('PreviousState')
+        return transitions
 
-        if current_state != previous_state:
-            logger.info(f"Instance changed states from {previous_state} to {current_state}.")
-        else:
-            logger.info(f"Instance desired state {action} was already in state {previous_state['Name']}")
+    def __send(self, action: str) -> list:
+        instance_ids = self.__pending[action]
+        self.__pending[action] = []
 
-        return current_state != previous_state
+        if not instance_ids:
+            return []
 
-    # TESTING ONLY
-    def __testing_get_mock_ec2_instances(self) -> list:
-        return [
-            {"instance_id": "i-007", "tag": "us_hours", "override": None},
-            {"instance_id": "i-0049", "tag": "uk_hours", "override": None},
-            {"instance_id": "i-512", "tag": "austin_offices", "override": None},
-            {"instance_id": "i-212", "tag": "new_york_offices", "override": None},
-        ]
+        return self.__ec2.perform_batch_action(action, instance_ids)
@@ -0,0 +1,66 @@
+from boto3 import client
+from datetime import datetime
+import botocore.exceptions
+import automated.clients
+import automated.exceptions
+import logging
+
+logger = logging.getLogger()
+
+
+def one_shot_expression(run_at: datetime) -> str:
+    """
+    Cron expression matching a single minute, the year field keeps it from firing again a year later
+    :param run_at: datetime = UTC time to run at, seconds are ignored
+    :return: str = e.g. cron(30 8 16 10 ? 2026)
+    """
+    return f"cron({run_at.minute} {run_at.hour} {run_at.day} {run_at.month} ? {run_at.year})"
+
+
+class EventBridge:
+    """
+    Re-arms the EventBridge rule that invokes the scheduler so it only runs when a schedule changes action
+    """
+
+    def __init__(self, region: str):
+        self._region = region
+        self.__events = automated.clients.get(client, "events", region_name=self._region)
+        self.__errors = []
+
+    @property
+    def errors(self):
+        return self.__errors
+
+    @errors.setter
+    def errors(self, error_message):
+        self.__errors.append(error_message)
+
+    @errors.getter
+    def errors(self):
+        return self.__errors
+
+    def rearm_rule(self, rule_name: str, run_at: datetime) -> bool:
+        """
+        Replaces the schedule expression of the rule so its next, and only, invocation is at run_at. The targets of
+        the rule are left as they are
+        :param rule_name: str = name of the scheduler rule
+        :param run_at: datetime = UTC time of the next run
+        :return: bool = True if the rule was updated
+        """
+        expression = one_shot_expression(run_at)
+
+        try:
+            self.__events.put_rule(Name=rule_name, ScheduleExpression=expression, State="ENABLED")
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to re-arm rule [{rule_name}] with [{expression}]: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
+                fatal_error=False
+            )
+            return False
+
+        logger.info(f"Re-armed rule [{rule_name}] with [{expression}]")
+        return True
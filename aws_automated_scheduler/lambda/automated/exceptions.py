@@ -149,3 +149,14 @@ class ConnectionError(Error):
         self.expression = expression
         logger.error(expression)
         sys.exit(RECOVERABLE_ERROR)
+
+
+class DeadlineExceeded(Error):
+    """
+    Raised when waiting on a rate limit or retry backoff would run past the Lambda deadline
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        logger.error(expression)
+        super().__init__(expression)
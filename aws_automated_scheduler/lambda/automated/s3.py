@@ -2,6 +2,7 @@ from boto3 import resource
 import logging
 import config
 import os
+import automated.clients
 import automated.exceptions
 
 
@@ -19,7 +20,7 @@ class S3:
         """
         self.__s3_conn = s3_conn
         self.__testing = config.is_test_run()
-        self._s3 = resource('s3')
+        self._s3 = automated.clients.get(resource, "s3")
         self.__errors = []
 
         if self.__testing:
@@ -0,0 +1,112 @@
+from boto3 import client
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import botocore.exceptions
+import automated.clients
+import automated.exceptions
+import logging
+import threading
+import config
+
+logger = logging.getLogger()
+
+# Assumed role credentials are kept for the life of the container so warm invocations do not assume the roles again.
+# role arn -> STS credentials
+_credentials_cache: dict = {}
+_cache_lock = threading.Lock()
+# One lock per role so concurrent workers assume different roles in parallel, but the same role only once
+_role_locks = defaultdict(threading.Lock)
+# Account id of the Lambda role, looked up once per container
+_account_id: str = None
+
+
+def account_id_from_role_arn(role_arn: str) -> str:
+    """
+    arn:aws:iam::123456789012:role/SchedulerRole -> 123456789012
+    """
+    try:
+        return role_arn.split(':')[4]
+    except (AttributeError, IndexError):
+        return role_arn
+
+
+class STS:
+    """
+    Assumes the scheduler role in member accounts
+    """
+
+    def __init__(self, region: str):
+        self._region = region
+        self.__sts = automated.clients.get(client, "sts", region_name=self._region)
+        self.__errors = []
+
+    @property
+    def errors(self):
+        return self.__errors
+
+    @errors.setter
+    def errors(self, error_message):
+        self.__errors.append(error_message)
+
+    @errors.getter
+    def errors(self):
+        return self.__errors
+
+    def get_credentials(self, role_arn: str) -> dict:
+        """
+        Returns credentials of the assumed role. The role is assumed once and the credentials are reused until
+        shortly before they expire
+        :param role_arn: str = ARN of the role to assume
+        :return: dict = STS credentials with AccessKeyId, SecretAccessKey, SessionToken and Expiration
+        """
+        with _cache_lock:
+            role_lock = _role_locks[role_arn]
+
+        with role_lock:
+            credentials = _credentials_cache.get(role_arn)
+
+            if credentials is not None and not self.__is_expiring(credentials):
+                logger.debug(f"Using cached credentials for role [{role_arn}]")
+                return credentials
+
+            credentials = self.__assume_role(role_arn)
+            _credentials_cache[role_arn] = credentials
+
+        return credentials
+
+    def get_account_id(self) -> str:
+        """
+        :return: str = account id of the credentials the Lambda runs with
+        """
+        global _account_id
+
+        with _cache_lock:
+            if _account_id is None:
+                _account_id = self.__sts.get_caller_identity()['Account']
+
+        return _account_id
+
+    def __assume_role(self, role_arn: str) -> dict:
+        logger.info(f"Assuming role [{role_arn}]...")
+
+        try:
+            response = self.__sts.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=config.ASSUME_ROLE_SESSION_NAME
+            )
+        except botocore.exceptions.ClientError as err:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to assume role [{role_arn}]: {err}",
+                output_to_logger=True,
+                include_in_http_response=True,
+                http_status_code=err.response.get('ResponseMetadata').get('HTTPStatusCode'),
+                fatal_error=True
+            )
+
+        return response['Credentials']
+
+    @staticmethod
+    def __is_expiring(credentials: dict) -> bool:
+        refresh_time = datetime.now(timezone.utc) + timedelta(seconds=config.CREDENTIALS_REFRESH_SECONDS)
+        return credentials['Expiration'] <= refresh_time
@@ -0,0 +1,183 @@
+import botocore.exceptions
+import automated.exceptions
+import logging
+import random
+import threading
+import time
+import config
+
+logger = logging.getLogger()
+
+# API families. EC2 throttles non-mutating (Describe*) and mutating (Start/Stop*) calls with separate token buckets
+DESCRIBE = "describe"
+MUTATE = "mutate"
+
+THROTTLE_ERROR_CODES = ("RequestLimitExceeded", "Throttling", "ThrottlingException", "TooManyRequestsException")
+# Retried without slowing down the request rate
+TRANSIENT_ERROR_CODES = ("InternalError", "InternalFailure", "ServiceUnavailable", "Unavailable")
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every thread calling an API family. The refill rate is halved when a call is throttled
+    and grows back a little after each successful call (additive increase, multiplicative decrease)
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, min_rate: float, max_rate: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.__tokens = float(burst)
+        self.__last_refill = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for one if the bucket is empty. Raises DeadlineExceeded instead of waiting past the
+        invocation deadline
+        :return: float = seconds waited
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__last_refill) * self.rate)
+            self.__last_refill = now
+            # Tokens may go negative, later callers then wait for the tokens reserved before them
+            self.__tokens -= 1
+            wait_seconds = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+
+        if wait_seconds:
+            _sleep_before_deadline(wait_seconds, f"waiting for a [{self.name}] request token")
+
+        return wait_seconds
+
+    def on_throttle(self) -> None:
+        with self.__lock:
+            self.rate = max(self.min_rate, self.rate * config.RATE_LIMIT_DECREASE_FACTOR)
+            self.__tokens = min(self.__tokens, 0.0)
+        logger.warning(f"[{self.name}] requests throttled. Lowering request rate to [{self.rate:.2f}/s]")
+
+    def on_success(self) -> None:
+        with self.__lock:
+            self.rate = min(self.max_rate, self.rate + config.RATE_LIMIT_INCREASE)
+
+
+# Limiters live for the life of the container so the learned rate carries over to warm invocations
+_limiters = {
+    DESCRIBE: AdaptiveRateLimiter(
+        name=DESCRIBE,
+        rate=config.EC2_DESCRIBE_RATE,
+        burst=config.EC2_DESCRIBE_BURST,
+        min_rate=config.RATE_LIMIT_MIN_RATE,
+        max_rate=config.EC2_DESCRIBE_RATE
+    ),
+    MUTATE: AdaptiveRateLimiter(
+        name=MUTATE,
+        rate=config.EC2_MUTATE_RATE,
+        burst=config.EC2_MUTATE_BURST,
+        min_rate=config.RATE_LIMIT_MIN_RATE,
+        max_rate=config.EC2_MUTATE_RATE
+    )
+}
+
+_stats_lock = threading.Lock()
+_stats = {"throttles": 0, "retries": 0, "wait_seconds": 0.0}
+# time.monotonic() value by which all calls must be finished, None when there is no deadline
+_deadline: float = None
+# Seconds from the start of the invocation to its deadline, the function timeout less DEADLINE_MARGIN_SECONDS
+_invocation_seconds: float = None
+
+
+def start_invocation(context) -> None:
+    """
+    Resets the counters and sets the deadline from the Lambda context of the invocation
+    :param context: Lambda context. Local test runs pass a dict which has no deadline
+    """
+    global _deadline, _invocation_seconds
+
+    if hasattr(context, "get_remaining_time_in_millis"):
+        _invocation_seconds = context.get_remaining_time_in_millis() / 1000 - config.DEADLINE_MARGIN_SECONDS
+        _deadline = time.monotonic() + _invocation_seconds
+    else:
+        _deadline, _invocation_seconds = None, None
+
+    with _stats_lock:
+        _stats.update(throttles=0, retries=0, wait_seconds=0.0)
+
+
+def remaining_time() -> float:
+    """
+    :return: float = seconds left before the invocation deadline, None when there is no deadline
+    """
+    return None if _deadline is None else _deadline - time.monotonic()
+
+
+def invocation_time() -> float:
+    """
+    :return: float = seconds an invocation has from its start to its deadline, None when there is no deadline
+    """
+    return _invocation_seconds
+
+
+def stats() -> dict:
+    """
+    :return: dict = throttles, retries and seconds spent waiting on rate limits/backoff during this invocation
+    """
+    with _stats_lock:
+        return {**_stats, "wait_seconds": round(_stats['wait_seconds'], 3)}
+
+
+def call(api_family: str, operation, *args, **kwargs):
+    """
+    Calls the API operation under the rate limiter of its family. Throttled and transient errors are retried with
+    full jitter exponential backoff for as long as the invocation deadline allows
+    :param api_family: str = DESCRIBE or MUTATE
+    :param operation: boto3 client method
+    :return: response of the operation
+    """
+    limiter = _limiters[api_family]
+
+    for attempt in range(config.API_MAX_ATTEMPTS):
+        _record(wait_seconds=limiter.acquire())
+
+        try:
+            response = operation(*args, **kwargs)
+        except botocore.exceptions.ClientError as err:
+            error_code = err.response.get('Error', {}).get('Code')
+
+            if error_code in THROTTLE_ERROR_CODES:
+                limiter.on_throttle()
+                _record(throttles=1)
+            elif error_code not in TRANSIENT_ERROR_CODES:
+                raise
+
+            backoff = random.uniform(
+                0, min(config.API_BACKOFF_CAP_SECONDS, config.API_BACKOFF_BASE_SECONDS * 2 ** attempt)
+            )
+            remaining = remaining_time()
+            if attempt + 1 == config.API_MAX_ATTEMPTS or (remaining is not None and remaining < backoff):
+                raise
+
+            logger.info(f"[{api_family}] call failed with {error_code}, retrying in [{backoff:.2f}] seconds...")
+            _record(retries=1)
+            _sleep_before_deadline(backoff, f"backing off [{api_family}] call")
+        else:
+            limiter.on_success()
+            return response
+
+
+def _sleep_before_deadline(seconds: float, reason: str) -> None:
+    remaining = remaining_time()
+    if remaining is not None and remaining < seconds:
+        raise automated.exceptions.DeadlineExceeded(f"Lambda deadline reached while {reason}")
+
+    _record(wait_seconds=seconds)
+    time.sleep(seconds)
+
+
+def _record(throttles: int = 0, retries: int = 0, wait_seconds: float = 0.0) -> None:
+    with _stats_lock:
+        _stats['throttles'] += throttles
+        _stats['retries'] += retries
+        _stats['wait_seconds'] += wait_seconds
@@ -28,8 +28,6 @@ def event_handler(event, context) -> dict:
     """
 
     '''
-    TODO: Consider making all ec2 start/stop calls a single batch API call rather than individual start/stop
-        The downside to this is fatal errors and timeouts will have to be considered more or all actions will fail
     TODO: send JSON payload directly via API GW for placing config to DynamoDB instead of uploading config to S3
     CONSIDER: API call for check mode to output what actions would happen to what resource over day or time. 
             Would give feedback to check if scheduling behavior will work as intended.
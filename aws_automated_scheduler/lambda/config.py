@@ -20,11 +20,89 @@ S3_CONN_DEFAULT = "s3_conn_default"
 EC2_CONN_LOCAL = "ec2_conn_local"
 EC2_CONN_DEFAULT = "ec2_conn_default"
 
+# Maximum number of account/region pairs scheduled concurrently. Overridden by 'scheduler_max_workers'
+MAX_SCHEDULER_WORKERS = 8
+
+# Cross account scheduling
+ASSUME_ROLE_SESSION_NAME = "AutomatedScheduler"
+# Cached assumed role credentials are refreshed when they expire within this many seconds
+CREDENTIALS_REFRESH_SECONDS = 300
+
+# Instance discovery. Only instances in these states are returned by describe_instances
+EC2_ACTIONABLE_INSTANCE_STATES = ("pending", "running", "stopping", "stopped")
+# Instance lifecycles that can not be stopped/started by the scheduler
+EC2_UNSCHEDULABLE_LIFECYCLES = ("spot", "scheduled")
+# Instances per describe_instances page. Larger pages mean fewer calls, smaller pages mean less memory per page
+EC2_DESCRIBE_PAGE_SIZE = 500
+
+# EC2 API rate limiting (requests per second and burst size) per API family, see automated.throttle
+EC2_DESCRIBE_RATE = 20.0
+EC2_DESCRIBE_BURST = 100
+EC2_MUTATE_RATE = 5.0
+EC2_MUTATE_BURST = 50
+RATE_LIMIT_MIN_RATE = 0.5
+# Rate is multiplied by this factor when throttled, and grows by RATE_LIMIT_INCREASE per successful call
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+RATE_LIMIT_INCREASE = 0.5
+# Retries of throttled/transient API errors, bounded by the time left in the Lambda invocation
+API_MAX_ATTEMPTS = 8
+API_BACKOFF_BASE_SECONDS = 0.1
+API_BACKOFF_CAP_SECONDS = 2.0
+# Seconds kept free at the end of the invocation to build and return the response
+DEADLINE_MARGIN_SECONDS = 0.5
+
+# Number of segments scanned concurrently when the whole table is read, e.g. for the config export
+DYNAMODB_SCAN_SEGMENTS = 4
+
+# batch_write_item/batch_get_item chunks sent concurrently, and for how long unprocessed items and keys are
+# resubmitted before giving up. The time is also bounded by the time left in the Lambda invocation
+DYNAMODB_BATCH_WORKERS = 4
+DYNAMODB_BATCH_MAX_SECONDS = 60
+
+# put_config only writes config items that changed and deletes the ones removed from the config file, instead of
+# rewriting every item
+CONFIG_DIFFERENTIAL_SYNC = True
+
+# Seconds a warm container keeps using its cached schedule/period configuration before reloading it, even when the
+# config version item did not change
+CONFIG_CACHE_TTL_SECONDS = 900
+
+# put_config compiles the whole schedule/period configuration into a single compressed snapshot item the scheduler
+# loads with one get_item. Snapshots larger than CONFIG_SNAPSHOT_CHUNK_BYTES are split over several items to stay under
+# the 400 KB DynamoDB item size limit
+CONFIG_SNAPSHOT = True
+CONFIG_SNAPSHOT_CHUNK_BYTES = 350000
+
+# When the scheduler rule name is configured ('scheduler_rule_name') every run re-arms the rule for the next start/stop
+# transition of any schedule instead of the scheduler running every minute. Runs are never further apart than this, so
+# nothing that is not in the configuration, e.g. the inventory rescan, waits forever. Overridden by
+# 'scheduler_max_sleep_minutes'
+SCHEDULER_MAX_SLEEP_MINUTES = 24 * 60
+# A run that skipped instances still on their way to another state (pending/stopping) or failed to act on some of its
+# account/region pairs, e.g. a batch that was still throttled after the retries or a run out of time, re-arms the rule
+# this soon so the instances are not left alone until the next transition
+SCHEDULER_RETRY_MINUTES = 1
+
+# Seconds between full describe_instances rescans that repair the inventory index
+INVENTORY_RESCAN_SECONDS = 3600
+
+# Maximum number of instances sent in a single start_instances/stop_instances call
+EC2_ACTION_BATCH_SIZE = 100
+
+# boto3 clients are built once per container and reused by warm invocations, see automated.clients. The pool is large
+# enough for every worker thread of the scheduler and the DynamoDB batch/scan workers to hold a connection
+CLIENT_MAX_POOL_CONNECTIONS = 16
+CLIENT_CONNECT_TIMEOUT_SECONDS = 2
+CLIENT_READ_TIMEOUT_SECONDS = 10
+CLIENT_MIN_READ_TIMEOUT_SECONDS = 1
+
 # Database connection options
 DB_CONN_LOCAL = "db_conn_local"
 DB_CONN_LOCAL_ENDPOINT = "http://127.0.0.1:8000"
 # DB_CONN_LOCAL_ENDPOINT = "http://192.168.99.100:8000"
 DB_CONN_SERVERLESS = "db_conn_serverless"
+# In process tables, see automated.dynamodb_memory. Used by tests and benchmarks that run without dynamodb-local
+DB_CONN_MEMORY = "db_conn_memory"
 
 
 def is_test_run() -> bool:
@@ -0,0 +1,90 @@
+import automated.dynamodb
+import automated.ec2
+import logging
+import config
+import events.type
+import events.http_response as http_response
+
+logger = logging.getLogger()
+
+# States after which the instance can never be scheduled again
+REMOVED_INSTANCE_STATES = ("terminated",)
+
+
+def record_state_change(event: dict, env_vars: dict) -> dict:
+    """
+    Updates the last known state of an instance from an 'EC2 Instance State-change Notification' event
+    Ex detail: {"instance-id": "i-0123456789abcdef0", "state": "running"}
+    :param event: EventBridge event
+    :param env_vars: Environment variables retrieved from Lambda
+    :return: dict = HTTP response
+    """
+    dynamodb = _get_dynamodb(env_vars)
+    instance_id: str = event['detail']['instance-id']
+    state: str = event['detail']['state']
+
+    if state in REMOVED_INSTANCE_STATES:
+        dynamodb.delete_inventory_item(event['account'], event['region'], instance_id)
+    else:
+        dynamodb.update_inventory_state(event['account'], event['region'], instance_id, state)
+
+    return _construct_response(dynamodb, events.type.CW_EC2_STATE_CHANGE_EVENT)
+
+
+def record_tag_change(event: dict, env_vars: dict) -> dict:
+    """
+    Adds, updates or removes an instance from the inventory from a 'Tag Change on Resource' event
+    The event carries every tag of the resource after the change, so a missing scheduler tag means it was removed
+    Ex detail: {"service": "ec2", "resource-type": "instance", "changed-tag-keys": [...], "tags": {"Schedule": "..."}}
+    :param event: EventBridge event
+    :param env_vars: Environment variables retrieved from Lambda
+    :return: dict = HTTP response
+    """
+    dynamodb = _get_dynamodb(env_vars)
+    detail: dict = event['detail']
+    tag_key: str = env_vars.get("tag_key")
+
+    if detail.get('service') != "ec2" or detail.get('resource-type') != "instance":
+        logger.info(f"Ignoring tag change of [{detail.get('service')}/{detail.get('resource-type')}] resource")
+        return _construct_response(dynamodb, events.type.CW_TAG_CHANGE_EVENT)
+
+    tags: dict = detail.get('tags', {})
+
+    for resource_arn in event.get('resources', []):
+        # arn:aws:ec2:us-west-2:123456789012:instance/i-0123456789abcdef0
+        instance_id = resource_arn.split('/')[-1]
+
+        if tag_key in tags:
+            dynamodb.put_inventory_item(
+                account_id=event['account'],
+                region=event['region'],
+                instance_id=instance_id,
+                tag_value=tags[tag_key],
+                override=tags.get(automated.ec2.OVERRIDE_TAG_KEY)
+            )
+        else:
+            dynamodb.delete_inventory_item(event['account'], event['region'], instance_id)
+
+    return _construct_response(dynamodb, events.type.CW_TAG_CHANGE_EVENT)
+
+
+def _get_dynamodb(env_vars: dict) -> automated.dynamodb.DynamoDB:
+    db_conn = config.DB_CONN_LOCAL if config.is_test_run() else config.DB_CONN_SERVERLESS
+    return automated.dynamodb.DynamoDB(
+        region=env_vars.get("region"),
+        table_name=env_vars.get("table_name"),
+        db_conn=db_conn
+    )
+
+
+def _construct_response(dynamodb: automated.dynamodb.DynamoDB, event_type: str) -> dict:
+    if dynamodb.errors:
+        return http_response.construct_http_response(
+            status_code=http_response.INTERNAL_ERROR,
+            message=dynamodb.errors
+        )
+
+    return http_response.construct_http_response(
+        status_code=http_response.OK,
+        message=f"Success from '{event_type}'"
+    )
@@ -1,4 +1,6 @@
+from datetime import datetime, timedelta
 import automated.dynamodb
+import automated.eventbridge
 import automated.s3
 import logging
 import events.type
@@ -6,6 +8,7 @@ import automated.exceptions
 import config
 import sys
 from util import data
+import util.scheduleconfig
 import events.http_response as http_response
 
 logger = logging.getLogger()
@@ -23,6 +26,7 @@ def put_config_into_dynamo(env_vars) -> dict:
 
     region: str = env_vars.get("region")
     table_name: str = env_vars.get("table_name")
+    rule_name: str = env_vars.get("rule_name")
 
     test_run: bool = config.is_test_run()
 
@@ -39,24 +43,44 @@ def put_config_into_dynamo(env_vars) -> dict:
 
     logger.info("Config JSON to DynamoDB compatible JSON conversion successful")
 
-    response: dict = dynamodb.load_json_into_db(converted_json)
-    response_status_code: str = response.get('ResponseMetadata').get('HTTPStatusCode')
-
-    # This returns a set or dict, not a list? We can change this to be something other than length, depending on..
-    # TODO: Implement logic to handle batch writes that need to pass unprocessed items
-    if len(response.get('UnprocessedItems')):
-        logger.info("FOUND UNPROCESSED ITEMS... FIGURE OUT WHAT TO DO NEXT!")
-        logger.info(f"Unprocessed Items: {response.get('UnprocessedItems')}")
+    if config.CONFIG_DIFFERENTIAL_SYNC:
+        result: dict = dynamodb.sync_config_items(converted_json)
+    else:
+        result: dict = {"added": len(converted_json), "changed": 0, "deleted": 0, "unchanged": 0,
+                        **dynamodb.load_json_into_db(converted_json)}
 
-    elif len(response.get('UnprocessedItems')) == 0 and response_status_code == http_response.OK:
-        logger.info("Successfully loaded items into DynamoDB")
+    if result['failed']:
         return http_response.construct_http_response(
-            status_code=http_response.OK,
-            message=f"Success from '{events.type.API_S3_PUT_CONFIG}'"
+            status_code=http_response.INTERNAL_ERROR,
+            message=dynamodb.errors
         )
 
+    logger.info("Successfully loaded items into DynamoDB")
+    if result['written']:
+        # Tells warm scheduler containers to reload their cached configuration
+        version: int = dynamodb.bump_config_version()
     else:
-        return http_response.construct_http_response(
-            status_code=response_status_code,
-            message=str(response)
-        )
+        version: int = dynamodb.retrieve_config_version()
+
+    if config.CONFIG_SNAPSHOT and dynamodb.retrieve_config_snapshot_head()[0] != version:
+        # The per item layout stays the source of truth, the snapshot only speeds up loading it
+        dynamodb.put_config_snapshot(version, util.scheduleconfig.compile_snapshot(validated_json, version))
+
+    if rule_name and result['written']:
+        # The rule may be armed for a transition of the old configuration. Run the scheduler in the next minute, it
+        # re-arms the rule from the new configuration
+        event_bridge = automated.eventbridge.EventBridge(region=region)
+        next_run = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        if not event_bridge.rearm_rule(rule_name, next_run):
+            return http_response.construct_http_response(
+                status_code=http_response.INTERNAL_ERROR,
+                message=event_bridge.errors
+            )
+
+    return http_response.construct_http_response(
+        status_code=http_response.OK,
+        message=f"Success from '{events.type.API_S3_PUT_CONFIG}': added [{result['added']}], "
+                f"changed [{result['changed']}], deleted [{result['deleted']}], unchanged [{result['unchanged']}] "
+                f"items, [{result['retried']}] write requests retried"
+    )
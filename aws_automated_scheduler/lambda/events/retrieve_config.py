@@ -1,3 +1,4 @@
+import itertools
 import automated.dynamodb
 import automated.s3
 import logging
@@ -20,19 +21,27 @@ def retrieve_dynamo_as_config(env_vars: dict):
     else:
         dynamodb = automated.dynamodb.DynamoDB(region=region, table_name=table_name, db_conn=config.DB_CONN_SERVERLESS)
 
-    response = dynamodb.retrieve_all_items_from_dynamo()
-    converted_json = data.convert_dynamo_json_to_py_data(response)
+    # Only the schedule and period partitions are config. The version, snapshot and inventory items the scheduler keeps
+    # in the same table are left out. Items are converted one at a time as the Queries stream them in, so neither the
+    # raw DynamoDB JSON nor the converted config is ever held in memory as a whole
+    config_items = itertools.chain.from_iterable(
+        dynamodb.retrieve_partition(pk, convert=False) for pk in automated.dynamodb.CONFIG_ITEM_PKS
+    )
+    converted_items = (data.convert_dynamo_item_to_py_data(item) for item in config_items)
 
     # TODO: Currently this outputs it as a JSON compatible HTTP response.
     #  Consider outputting to S3 Object (watch out for infinite loop on S3 PutObject).
 
     if test_run:
         # Output to file so we can test locally and see the response JSON
-        data.write_json_to_file(converted_json, use_pretty_json=True)
+        converted_items = data.tee_json_to_file(converted_items, use_pretty_json=True)
+
+    # Same text as str() of the list of items
+    message = "[" + ", ".join(str(item) for item in converted_items) + "]"
 
     # TODO: Add error checking before sending good response
 
     return http_response.construct_http_response(
         status_code=http_response.OK,
-        message=str(converted_json)
+        message=message
     )
@@ -1,7 +1,17 @@
+import concurrent.futures
+import threading
+import time
+from datetime import datetime, timedelta
+import automated.clients
+import automated.eventbridge
 import automated.ec2
+import automated.sts
+import automated.throttle
 import automated.dynamodb
 import events.http_response as http_response
-import util.evalperiod
+import util.timezones
+import util.transitions
+import util.scheduleconfig
 import util.eventhandler
 import logging
 import automated.exceptions
@@ -11,6 +21,36 @@ import events.type
 
 logger = logging.getLogger()
 
+# Instance states from which an action is a real transition. Instances in any other state are either already in the
+# desired state or on their way to it (pending/stopping), so sending the action again would be a wasted API call
+ACTIONABLE_STATES = {
+    ec2_actions.START: ("stopped",),
+    ec2_actions.STOP: ("running",)
+}
+# Instance states that change by themselves. An instance skipped in one of these states is checked again on the next run
+TRANSITIONAL_STATES = ("pending", "stopping")
+
+
+def utcnow() -> datetime:
+    """
+    Clock of the scheduler, replaced by tests
+    """
+    return datetime.utcnow()
+
+
+def is_actionable(action_type: str, instance_state: str) -> bool:
+    """
+    Checks the current state of the instance against the action to decide if an API call is needed
+    :param action_type: str = action evaluated for the instance
+    :param instance_state: str = instance state name as reported by describe_instances
+    :return: bool = True if the action should be sent
+    """
+    if action_type is ec2_actions.NONE:
+        return False
+
+    # Without a known state we can not tell, so let EC2 decide
+    return instance_state is None or instance_state in ACTIONABLE_STATES[action_type]
+
 
 class Scheduler:
     """
@@ -19,33 +59,49 @@ class Scheduler:
 
     def __init__(self, env_vars):
         self._region: str = env_vars.get("region")
+        # Regions with instances to schedule. The schedule configuration always comes from the home region table
+        self._regions: list = env_vars.get("regions") or [self._region]
+        # Roles assumed to schedule instances in member accounts. None schedules the Lambda account itself
+        self._account_roles: list = env_vars.get("account_roles") or [None]
+        self._max_workers: int = env_vars.get("max_workers") or config.MAX_SCHEDULER_WORKERS
+        # Load instances from the inventory index instead of describing every instance on each run
+        self._use_inventory: bool = env_vars.get("use_inventory", False)
         self._tag_key: str = env_vars.get("tag_key")
         self._table_name: str = env_vars.get("table_name")
+        # EventBridge rule re-armed for the next schedule transition. None leaves the rule as it is
+        self._rule_name: str = env_vars.get("rule_name")
+        # Longest time between two runs when the rule is re-armed
+        self._max_sleep_minutes: int = env_vars.get("max_sleep_minutes") or config.SCHEDULER_MAX_SLEEP_MINUTES
         self._test_run: bool = config.is_test_run()
         self.__errors: list = []
 
         if self._test_run:
-            self.__ec2: automated.ec2.EC2 = automated.ec2.EC2(
-                region=self._region,
-                ec2_conn=config.EC2_CONN_LOCAL
-            )
+            self.__ec2_conn = config.EC2_CONN_LOCAL
             self.__dynamo_db = automated.dynamodb.DynamoDB(
                 region=self._region,
                 table_name=self._table_name,
                 db_conn=config.DB_CONN_LOCAL)
 
         elif not self._test_run:
-            self.__ec2 = automated.ec2.EC2(
-                region=self._region,
-                ec2_conn=config.EC2_CONN_DEFAULT
-            )
+            self.__ec2_conn = config.EC2_CONN_DEFAULT
             self.__dynamo_db = automated.dynamodb.DynamoDB(
                 region=self._region,
                 table_name=self._table_name,
                 db_conn=config.DB_CONN_SERVERLESS
             )
 
-        self.__evaluator = util.evalperiod.EvalPeriod()
+        self.__sts = automated.sts.STS(region=self._region)
+        self.__event_bridge = automated.eventbridge.EventBridge(region=self._region) if self._rule_name else None
+        self.__schedule_config: util.scheduleconfig.ScheduleConfig = None
+        # Time every schedule is evaluated at, frozen at the start of the run so all instances see the same "now"
+        self.__now: datetime = None
+        # schedule name -> action. Each distinct schedule is evaluated once per run, shared by every account/region
+        self.__schedule_actions: dict = {}
+        self.__schedule_actions_lock = threading.Lock()
+        # timezone name -> (ZoneOffsets or None, wall clock time at __now or None, error or None). Built once per
+        # distinct timezone per run, however many schedules use it
+        self.__zone_clocks: dict = {}
+        self.__zone_clocks_lock = threading.Lock()
 
     @property
     def errors(self):
@@ -62,28 +118,53 @@ class Scheduler:
     def automated_schedule(self) -> dict:
         """
         Start of path for scheduling operations.
+        Every account/region pair is scheduled concurrently on a bounded thread pool, for each pair:
         Search for EC2 instances that have our automation tag applied to them.
         Retrieve the instance id and tag value as the schedule value for that instance.
-        Query DynamoDB with the schedule tag value to find all the periods (days/hours/start and stop times) assigned
-        Check if any of those periods are a match for the current day/hour/time.
+        Look up the periods (days/hours/start and stop times) assigned to the schedule in the configuration, which is
+        loaded from DynamoDB, or the warm container cache, once before any account/region pair is scheduled
+        Check if any of those periods are a match for the current day/hour/time of the schedule's timezone, frozen at
+        the start of the run. Each distinct schedule is evaluated once and its action is shared by every instance
+        using it
         Perform the appropriate scheduling action if a match
+        Re-arm the scheduler rule for the next time any schedule changes action, so there are no idle runs in between,
+        or for a retry within minutes when instances were skipped on their way to another state or actions failed
         :return: dict = http response with results of operation
         """
 
-        instance_list: list = self.__ec2.get_instances_from_tag_key(self._tag_key)
-        logger.info(f"Found [{len(instance_list)}] instances with tag [{self._tag_key}] in [{self._region}]")
-
-        modified_instances: list = []
-
-        if instance_list:
-            evaluator = util.evalperiod.EvalPeriod()
-            modified_instances = self.__evaluate_instances(instance_list, evaluator)
-
-        logger.info(f"No more instances found in region [{self._region}] with tag name [{self._tag_key}]")
-        logger.info(f"--------------------------------")
-        logger.info(f"Final results of instances that changed state:\n{modified_instances}")
-
-        found_errors = self.retrieve_errors_from_components()
+        self.__schedule_config = util.scheduleconfig.get_schedule_config(self.__dynamo_db)
+        self.__now = utcnow()
+
+        targets = [(role_arn, region) for role_arn in self._account_roles for region in self._regions]
+        max_workers = min(len(targets), self._max_workers)
+        logger.info(f"Scheduling [{len(targets)}] account/region pairs using [{max_workers}] workers")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            target_results: list = list(executor.map(self.__schedule_target, targets))
+
+        message = [f"Success from event: '{events.type.CW_SCHEDULED_EVENT}'"]
+        for target_result in target_results:
+            modified_instances = target_result['modified_instances']
+            logger.info(f"[{target_result['target']}] Final results of [{target_result['evaluated_instances']}] "
+                        f"evaluated instances: {modified_instances}")
+            message.extend([
+                f"[{target_result['target']}] Modified instances: started [{modified_instances[ec2_actions.START]}], "
+                f"stopped [{modified_instances[ec2_actions.STOP]}] of [{target_result['evaluated_instances']}] "
+                f"evaluated",
+                f"[{target_result['target']}] Skipped actions for instances already in desired state: "
+                f"{target_result['skipped_actions']}"
+            ])
+
+        message.append(f"Schedules evaluated: {len(self.__schedule_actions)}")
+        if self.__event_bridge is not None:
+            unsettled = any(target_result['errors'] or target_result['unsettled_instances']
+                            for target_result in target_results)
+            message.append(f"Next run: {self.__rearm(retry=unsettled)}")
+        message.append(f"EC2 API throttling: {automated.throttle.stats()}")
+        message.append(f"Config cache: {util.scheduleconfig.cache_stats()}")
+        message.append(f"AWS clients: {automated.clients.stats()}")
+
+        found_errors = self.retrieve_errors_from_components(target_results)
         if found_errors:
             # TODO: Consider different HTTP response code for multiple errors
             response = http_response.construct_http_response(http_response.INTERNAL_ERROR, found_errors)
@@ -91,120 +172,250 @@ class Scheduler:
             # TODO: Add better JSON response indicating how many actions were performed
             response = http_response.construct_http_response(
                 status_code=http_response.OK,
-                message=[f"Success from event: '{events.type.CW_SCHEDULED_EVENT}'",
-                         f"Modified instances: {modified_instances}"]
+                message=message
             )
 
         return response
 
-    def __evaluate_instances(self, instance_list: list, evaluator: util.evalperiod.EvalPeriod) -> list:
+    def __schedule_target(self, target: tuple) -> dict:
         """
-        Checks list of instances to see if any of the returned schedule tag values should be evaluated
-        Overview:
-            - Instance has automation scheduler tag: e.g. ['Schedule', 'austin_hours']
-            - DynamoDB is queried to see what periods 'austin_hours' schedule item contains
-            - 'austin_hours' returns periods ['MON-FRI-START-0800-STOP-1800', 'SAT-START-1000-STOP-1400']
-            - DynamoDB is queried to retrieve information on the each associated period
-            - Evaluate if any of those periods are a match for the current day/hour/time.
-            - Perform the appropriate scheduling(start/stop) action if a match
-        :param instance_list: list = instance list with element structure {"instance_id": "foo", "tag": "bar"}
-        :param evaluator:
-        :return:
+        Runs discovery, evaluation and actions for a single account/region pair. Runs on a worker thread
+        :param target: tuple = (role arn to assume or None for the Lambda account, region)
+        :return: dict = results and errors of the account/region pair
         """
+        role_arn, region = target
+        target_result = {
+            "target": region if role_arn is None else f"{automated.sts.account_id_from_role_arn(role_arn)}/{region}",
+            "region": region,
+            # Counts rather than lists so the memory used does not grow with the fleet
+            "evaluated_instances": 0,
+            "modified_instances": {ec2_actions.START: 0, ec2_actions.STOP: 0},
+            "skipped_actions": 0,
+            # Skipped instances in a TRANSITIONAL_STATES state
+            "unsettled_instances": 0,
+            "errors": []
+        }
+
+        ec2 = None
+
+        # Components exit on fatal errors. Catch them here so a failing target does not abort the other targets
+        try:
+            credentials = self.__sts.get_credentials(role_arn) if role_arn is not None else None
+            ec2 = automated.ec2.EC2(region=region, ec2_conn=self.__ec2_conn, credentials=credentials)
+
+            if self._use_inventory:
+                instance_stream = self.__retrieve_inventory(ec2, role_arn, region)
+            else:
+                instance_stream = ec2.get_instances_from_tag_key(self._tag_key)
 
-        # TODO break this function up into multiple functions
+            self.__evaluate_instances(instance_stream, ec2, target_result)
 
-        instances_with_changed_status: list = []
+            logger.info(f"Evaluated [{target_result['evaluated_instances']}] instances with tag [{self._tag_key}] in "
+                        f"[{target_result['target']}]")
+            logger.info(f"No more instances found in [{target_result['target']}] with tag name [{self._tag_key}]")
+            logger.info(f"--------------------------------")
 
-        for index, instance in enumerate(instance_list, start=1):
+        except (Exception, SystemExit) as err:
+            logger.error(f"[{target_result['target']}] Scheduling failed: {err}")
+            target_result['errors'].append(str(err))
 
-            instance_id: str = instance['instance_id']
-            tag_value: str = instance['tag']
-            # Override is not a required tag
-            override: str = instance.get('override', None)
-            logger.info(f"Evaluating instance [{index} of {len(instance_list)}]...")
-            logger.info(
-                f"Instance Id: [{instance_id}] with schedule tag value: [{tag_value}] and override action: [{override}]"
-            )
+        ec2_errors = ec2.errors if ec2 is not None else []
+        target_result['errors'] = ec2_errors + target_result['errors']
 
-            schedule_info: list = self.__dynamo_db.retrieve_schedule_info(schedule_name=tag_value)
+        return target_result
 
-            # timezone is not implement yet
-            periods, timezone = self._retrieve_period_info_from_schedule(schedule_info=schedule_info)
+    def __retrieve_inventory(self, ec2: automated.ec2.EC2, role_arn: str, region: str):
+        """
+        Loads the instances of the account/region from the inventory index. The index is kept current by EC2 state and
+        tag change events. A periodic full describe_instances rescan rewrites it to repair any drift
+        :return: iterator of instance records {"instance_id": ..., "tag": ..., "override": ..., "state": ...}
+        """
+        account_id = automated.sts.account_id_from_role_arn(role_arn) if role_arn else self.__sts.get_account_id()
+        now = int(time.time())
+        last_scan = self.__dynamo_db.retrieve_inventory_scan_time(account_id, region)
 
-            action_type = ec2_actions.NONE
+        if now - last_scan < config.INVENTORY_RESCAN_SECONDS:
+            return self.__dynamo_db.retrieve_inventory(account_id, region)
 
-            period_info: list = []
-            if len(periods):
-                logger.info(
-                    f"Using sk: [{tag_value}], retrieved [{len(periods)}] values from periods attribute - {periods}"
-                )
+        logger.info(f"Inventory of [{account_id}/{region}] last scanned at [{last_scan}]. Rescanning instances...")
+        return self.__dynamo_db.stream_inventory_rescan(
+            account_id, region, ec2.get_instances_from_tag_key(self._tag_key), scanned_at=now
+        )
 
-                period_info = self.__dynamo_db.retrieve_period_info(periods)
+    def __rearm(self, retry: bool = False) -> datetime:
+        """
+        Re-arms the scheduler rule for the earliest upcoming start/stop transition of any schedule in the configuration,
+        whether or not an instance uses it yet, bounded by the maximum sleep ('scheduler_max_sleep_minutes')
+        :param retry: bool = instances were left unsettled or an account/region pair failed, run again within
+            config.SCHEDULER_RETRY_MINUTES
+        :return: datetime = UTC time of the next run
+        """
+        schedules, zones = {}, {}
+        for schedule_name, (periods, timezone_name) in self.__schedule_config.compiled_schedules().items():
+            zone = self.zone_clock(timezone_name)[0]
+            # Schedules in unknown timezones never run, they are reported when an instance uses them
+            if zone is not None:
+                schedules[schedule_name] = periods
+                zones[schedule_name] = zone
 
-                if len(period_info):
-                    for period in period_info:
-                        action_type = evaluator.eval_period(period)
+        calendar = util.transitions.TransitionCalendar(schedules, zones)
+        next_run, schedule_names = calendar.next_transition(self.__now)
+        sleep_minutes = self._max_sleep_minutes
+        if retry:
+            sleep_minutes = min(sleep_minutes, config.SCHEDULER_RETRY_MINUTES)
+        latest_run = self.__now.replace(second=0, microsecond=0) + timedelta(minutes=sleep_minutes)
 
-                        if action_type is not ec2_actions.NONE:
-                            # We have found an action, stop evaluating the remaining periods, no conflicting actions.
-                            logger.info(f"Found [{action_type}] action! Breaking check for remaining periods...")
-                            break
-                else:
-                    logger.info(
-                        f"No period information was gathered from: [{periods}]. Do these items exist in the db?")
-            else:
-                logger.warning(f"Unable to retrieve period info from empty period list: {periods}")
+        if next_run is None or next_run > latest_run:
+            next_run, schedule_names = latest_run, []
 
-            logger.info(f"Received action type '{action_type}' for '{instance_id}'")
+        # A long run can end after the transition it was going to wake up for. Never arm a minute that has passed
+        next_run = max(next_run, utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1))
 
-            if self._test_run:
-                logger.info(f"Using local (not real) EC2: Performing action type '{action_type}' on '{instance_id}'")
-            else:
-                instance_changed = self.__ec2.perform_action(action_type, instance_id)
-                if instance_changed:
-                    instances_with_changed_status.append((instance_id, action_type))
+        logger.info(f"Next transition of [{len(calendar)}] schedules at [{next_run}]: {schedule_names}")
+        self.__event_bridge.rearm_rule(self._rule_name, next_run)
 
-            logger.info(f"Finished evaluating InstanceId: '{instance_id}', [{len(instance_list) - index}] remaining.")
-            logger.info(f"--------------------------------")
+        return next_run
+
+    def zone_clock(self, timezone_name: str) -> tuple:
+        """
+        Offset table and wall clock time of the timezone at the time frozen for the run, built the first time a
+        schedule in the timezone is seen
+        :param timezone_name: str = timezone of the schedule, None or "" for UTC
+        :return: tuple = (util.timezones.ZoneOffsets, datetime = wall clock time, None), or (None, None, str = error)
+            when the timezone is unknown
+        """
+        timezone_name = timezone_name or util.timezones.DEFAULT_TIMEZONE
+
+        with self.__zone_clocks_lock:
+            if timezone_name not in self.__zone_clocks:
+                try:
+                    zone = util.timezones.ZoneOffsets(timezone_name, around=self.__now)
+                    self.__zone_clocks[timezone_name] = (zone, zone.local(self.__now), None)
+                except ValueError as err:
+                    self.__zone_clocks[timezone_name] = (None, None, str(err))
+
+            return self.__zone_clocks[timezone_name]
+
+    def schedule_action(self, schedule_name: str) -> str:
+        """
+        Action of a schedule at the time frozen for the run. Evaluated the first time an instance with the schedule is
+        seen and reused for every later instance, in any account/region, so evaluation depends on the number of
+        distinct schedules rather than on the number of instances
+        :param schedule_name: str = schedule tag value of the instance
+        :return: str = action type
+        """
+        with self.__schedule_actions_lock:
+            if schedule_name not in self.__schedule_actions:
+                self.__schedule_actions[schedule_name] = self.__evaluate_schedule(schedule_name)
+
+            return self.__schedule_actions[schedule_name]
+
+    def __evaluate_schedule(self, schedule_name: str) -> str:
+        """
+        Looks up the periods (days/hours/start and stop times) of the schedule, e.g. 'austin_hours' returns periods
+        ['MON-FRI-START-0800-STOP-1800', 'SAT-START-1000-STOP-1400'], merged into one week of intervals, and returns
+        the action of the interval holding the current day/hour/time of the schedule's timezone. Where periods overlap
+        the action that began last wins, see util.timeline.PRECEDENCE, whatever order the periods are in
+        """
+        timeline, timezone_name = self.__schedule_config.get_timeline(schedule_name)
+        zone, local_now, error = self.zone_clock(timezone_name)
+
+        if error is not None:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Schedule [{schedule_name}] is in an unknown timezone: {error}. "
+                              f"Please use an IANA timezone, e.g. America/Chicago. No actions will be performed.",
+                include_in_http_response=True,
+                fatal_error=False
+            )
+            return ec2_actions.NONE
+
+        action_type = timeline.action(local_now.weekday(), local_now.hour * 60 + local_now.minute)
+
+        logger.info(f"Schedule [{schedule_name}] at [{local_now}] [{zone.name}]: action [{action_type}] from "
+                    f"[{len(timeline.starts)}] intervals")
 
-        return instances_with_changed_status
+        return action_type
 
-    def _retrieve_period_info_from_schedule(self, schedule_info: list) -> tuple:
+    def __evaluate_instances(self, instance_stream, ec2: automated.ec2.EC2, target_result: dict) -> None:
         """
-        We are only retrieving a single schedule item from DynamoDB. If this is ever changed to batch get
-        all the scheduled items, then the following logic will need to be modified to handle multiple items
-        Periods are retrieved as a set from DynamoDB JSON response
-        :param schedule_info:
-        :return: tuple = (list = list of periods, str = timezone)
+        Joins the action of each instance's schedule onto the instance stream and performs the actions
+        Overview:
+            - Instance has automation scheduler tag: e.g. ['Schedule', 'austin_hours']
+            - The action of the 'austin_hours' schedule is looked up, it is evaluated the first time it is seen
+            - Reconcile the action with the current state of the instance
+            - Perform the appropriate scheduling(start/stop) action if needed
+        :param instance_stream: iterator of instances with element structure {"instance_id": "foo", "tag": "bar"}
+            consumed one at a time so only the current instance and the pending action chunks are held in memory
+        :param ec2: EC2 client of the account/region the instances are in
+        :param target_result: dict = results of the target, updated with instance and action counts
+        :return:
         """
-        periods, timezone = None, None
-        if len(schedule_info):
-            periods = schedule_info[0].get('periods')
-            timezone = schedule_info[0].get('timezone')
+        action_accumulator = automated.ec2.ActionAccumulator(ec2)
+        target: str = target_result['target']
+
+        for index, instance in enumerate(instance_stream, start=1):
+
+            instance_id: str = instance['instance_id']
+            action_type = self.schedule_action(instance['tag'])
+
+            logger.debug(f"[{target}] Instance [{index}] [{instance_id}] with schedule [{instance['tag']}] and "
+                         f"override [{instance.get('override')}]: action [{action_type}]")
+
+            # Reconcile the action with the current state so only real transitions are sent
+            if action_type is not ec2_actions.NONE and not is_actionable(action_type, instance.get('state')):
+                logger.debug(f"Instance [{instance_id}] is [{instance.get('state')}], skipping action [{action_type}]")
+                target_result['skipped_actions'] += 1
+                if instance.get('state') in TRANSITIONAL_STATES:
+                    target_result['unsettled_instances'] += 1
+                action_type = ec2_actions.NONE
 
-        # Convert periods retrieved from set to list
-        if periods:
-            periods = list(periods)
+            if self._test_run:
+                logger.debug(f"Using local (not real) EC2: Performing action type '{action_type}' on '{instance_id}'")
+            else:
+                self.__count_transitions(action_accumulator.add(action_type, instance_id), target_result)
+
+            target_result['evaluated_instances'] = index
+
+        # Send the chunks that did not fill up
+        self.__count_transitions(action_accumulator.dispatch(), target_result)
 
-        return periods, timezone
+    @staticmethod
+    def __count_transitions(transitions: list, target_result: dict) -> None:
+        for transition in transitions:
+            if transition['changed']:
+                logger.info(f"[{target_result['target']}] Instance [{transition['instance_id']}] changed state: "
+                            f"[{transition['previous_state']}] -> [{transition['current_state']}]")
+                target_result['modified_instances'][transition['action']] += 1
 
-    def retrieve_errors_from_components(self):
+    def retrieve_errors_from_components(self, target_results: list):
         """
         Checks automation components for errors to compile them into single http response
+        :param target_results: list = results of every scheduled account/region pair
         :return: list = collection of logged errors from automation components
         """
         found_errors = []
+        if self.errors:
+            logger.info(f"Checking for errors from the scheduler... Found {len(self.errors)} error(s).")
+            found_errors.extend(self.errors)
+
+        if self.__schedule_config is not None and self.__schedule_config.errors:
+            logger.info(f"Checking for errors from schedule configuration... "
+                        f"Found {len(self.__schedule_config.errors)} error(s).")
+            found_errors.extend(self.__schedule_config.errors)
+
+        if self.__event_bridge is not None and self.__event_bridge.errors:
+            logger.info(f"Checking for errors from EventBridge... Found {len(self.__event_bridge.errors)} error(s).")
+            found_errors.extend(self.__event_bridge.errors)
+
         if self.__dynamo_db.errors:
             logger.info(f"Checking for errors from DynamoDB... Found {len(self.__dynamo_db.errors)} error(s).")
             found_errors.extend(self.__dynamo_db.errors)
 
-        if self.__evaluator.errors:
-            logger.info(f"Checking for errors from Period Evaluation... Found {len(self.__evaluator.errors)} error(s).")
-            found_errors.extend(self.__evaluator.errors)
-
-        if self.__ec2.errors:
-            logger.info(f"Checking for errors from EC2... Found {len(self.__ec2.errors)} error(s).")
-            found_errors.extend(self.__ec2.errors)
+        for target_result in target_results:
+            if target_result['errors']:
+                logger.info(f"Checking for errors from [{target_result['target']}]... "
+                            f"Found {len(target_result['errors'])} error(s).")
+                found_errors.extend(f"[{target_result['target']}] {error}" for error in target_result['errors'])
 
         return found_errors
@@ -1,3 +1,5 @@
 CW_SCHEDULED_EVENT = "cw_scheduled_event"
 API_S3_PUT_CONFIG = "cw_s3_put_config"
 API_RETRIEVE_DYNAMO_AS_CONFIG = "api_retrieve_dynamo_as_config"
+CW_EC2_STATE_CHANGE_EVENT = "cw_ec2_state_change_event"
+CW_TAG_CHANGE_EVENT = "cw_tag_change_event"
@@ -0,0 +1,12 @@
+import pytest
+import automated.clients
+import util.scheduleconfig
+
+
+@pytest.fixture(autouse=True)
+def empty_config_cache():
+    # The configuration cache outlives invocations by design, tests each start from a cold container
+    util.scheduleconfig._cache.update(schedules=None, periods=None, version=None, loaded_at=0.0)
+    automated.clients.clear()
+    yield
+    util.scheduleconfig._cache.update(schedules=None, periods=None, version=None, loaded_at=0.0)
@@ -0,0 +1,253 @@
+"""
+Local stand-ins for the boto3 clients used by the automation components.
+They keep a count of every API call so tests can assert on the number of requests made.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import botocore.exceptions
+import jmespath
+import automated.dynamodb_memory
+
+
+class FakePageIterator:
+
+    def __init__(self, pages):
+        self.__pages = pages
+
+    def __iter__(self):
+        return iter(self.__pages)
+
+    def search(self, expression: str):
+        compiled_expression = jmespath.compile(expression)
+        for page in self.__pages:
+            results = compiled_expression.search(page)
+            if isinstance(results, list):
+                yield from results
+            else:
+                yield results
+
+
+class FakePaginator:
+
+    def __init__(self, fake_client, operation_name):
+        self.__client = fake_client
+        self.__operation_name = operation_name
+
+    def paginate(self, **kwargs):
+        return FakePageIterator(self.__client.paginate(self.__operation_name, **kwargs))
+
+
+class FakeEC2Client:
+    """
+    Serves describe_instances pages built from a list of instance descriptions
+    Supports the tag-key and instance-state-name filters, and can fail the first calls of an operation with an error
+    """
+
+    def __init__(self, instances: list, page_size: int = 10):
+        self.instances = instances
+        self.page_size = page_size
+        self.calls = Counter()
+        self.requests = []
+        # operation name -> [error code, ...] raised by the next calls of that operation
+        self.injected_errors = {}
+        self.__lock = threading.Lock()
+
+    def inject_errors(self, operation_name: str, error_code: str, count: int) -> None:
+        self.injected_errors.setdefault(operation_name, []).extend([error_code] * count)
+
+    def __call(self, operation_name: str) -> None:
+        with self.__lock:
+            self.calls[operation_name] += 1
+            pending_errors = self.injected_errors.get(operation_name)
+            error_code = pending_errors.pop(0) if pending_errors else None
+
+        if error_code is not None:
+            raise client_error(error_code, operation_name)
+
+    def describe_instances(self, **kwargs):
+        self.__call("describe_instances")
+        self.requests.append(kwargs)
+        page_size = kwargs.get('MaxResults', self.page_size)
+        start = int(kwargs.get('NextToken', 0))
+        instances = [instance for instance in self.instances if self.__matches(instance, kwargs.get('Filters', []))]
+
+        page = {"Reservations": [{"Instances": instances[start:start + page_size]}]}
+        if start + page_size < len(instances):
+            page['NextToken'] = str(start + page_size)
+
+        return page
+
+    @staticmethod
+    def __matches(instance: dict, filters: list) -> bool:
+        for query_filter in filters:
+            if query_filter['Name'] == "tag-key":
+                if not any(tag['Key'] in query_filter['Values'] for tag in instance.get('Tags', [])):
+                    return False
+            elif query_filter['Name'] == "instance-state-name":
+                if instance['State']['Name'] not in query_filter['Values']:
+                    return False
+
+        return True
+
+    def start_instances(self, InstanceIds, DryRun=False):
+        return {"StartingInstances": self.__change_states("StartInstances", InstanceIds, "pending", "running")}
+
+    def stop_instances(self, InstanceIds, Hibernate=False, DryRun=False):
+        return {"StoppingInstances": self.__change_states("StopInstances", InstanceIds, "stopping", "stopped")}
+
+    def __change_states(self, operation_name: str, instance_ids: list, transition_state: str, final_state: str):
+        self.__call(operation_name)
+        instances = {inst['InstanceId']: inst for inst in self.instances}
+
+        # EC2 rejects the whole request when any one of the instances is unknown or in the wrong state
+        for instance_id in instance_ids:
+            if instance_id not in instances:
+                raise client_error("InvalidInstanceID.NotFound", operation_name)
+            if instances[instance_id]['State']['Name'] in ("terminated", "shutting-down"):
+                raise client_error("IncorrectInstanceState", operation_name)
+
+        state_changes = []
+        for instance_id in instance_ids:
+            previous_state = instances[instance_id]['State']['Name']
+            current_state = previous_state if previous_state in (transition_state, final_state) else transition_state
+            instances[instance_id]['State'] = {"Name": current_state}
+            state_changes.append({
+                "InstanceId": instance_id,
+                "PreviousState": {"Name": previous_state},
+                "CurrentState": {"Name": current_state}
+            })
+
+        return state_changes
+
+    def describe_tags(self, **kwargs):
+        self.__call("describe_tags")
+        resource_id = kwargs['Filters'][0]['Values'][0]
+        instance = next(inst for inst in self.instances if inst['InstanceId'] == resource_id)
+        return {"Tags": instance.get('Tags', [])}
+
+
+def client_error(error_code: str, operation_name: str) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {"Error": {"Code": error_code, "Message": f"Simulated {error_code}"}},
+        operation_name
+    )
+
+
+def fake_instance(instance_id: str, schedule: str = None, override: str = None, state: str = "running",
+                  tag_key: str = "Schedule", lifecycle: str = None) -> dict:
+    """
+    Builds an instance description as returned in describe_instances
+    """
+    tags = [{"Key": "Name", "Value": instance_id}]
+    if schedule is not None:
+        tags.append({"Key": tag_key, "Value": schedule})
+    if override is not None:
+        tags.append({"Key": "override", "Value": override})
+
+    instance = {"InstanceId": instance_id, "State": {"Name": state}, "Tags": tags}
+    if lifecycle is not None:
+        instance['InstanceLifecycle'] = lifecycle
+
+    return instance
+
+
+class FakeDynamoDBClient(automated.dynamodb_memory.MemoryDynamoDBClient):
+    """
+    In memory DynamoDB client holding a single pk/sk table that every table name refers to
+    """
+
+    def __init__(self, page_size: int = 100, page_delay: float = 0.0):
+        super().__init__(page_size=page_size, tables={})
+        self.__table = automated.dynamodb_memory.MemoryTable("Scheduler")
+        # Seconds each query/scan page takes to arrive
+        self.page_delay = page_delay
+
+    @property
+    def items(self) -> dict:
+        return self.__table.items
+
+    def _table(self, table_name: str, operation_name: str) -> automated.dynamodb_memory.MemoryTable:
+        return self.__table
+
+    def query(self, **kwargs):
+        if self.page_delay:
+            time.sleep(self.page_delay)
+        return super().query(**kwargs)
+
+    def scan(self, **kwargs):
+        if self.page_delay:
+            time.sleep(self.page_delay)
+        return super().scan(**kwargs)
+
+    def load_config(self, schedules: dict, periods: dict, timezones: dict = None) -> None:
+        """
+        :param schedules: dict = schedule name -> list of period names
+        :param periods: dict = period name -> (days_of_week, start_time, stop_time)
+        :param timezones: dict = schedule name -> timezone, UTC for schedules not listed
+        """
+        for schedule, period_names in schedules.items():
+            self.put_item("", {
+                "pk": {"S": "schedule"}, "sk": {"S": schedule},
+                "periods": {"SS": period_names}, "timezone": {"S": (timezones or {}).get(schedule, "UTC")}
+            })
+
+        for period, (days_of_week, start_time, stop_time) in periods.items():
+            item = {"pk": {"S": "period"}, "sk": {"S": period}}
+            for name, value in (("days_of_week", days_of_week), ("start_time", start_time), ("stop_time", stop_time)):
+                if value is not None:
+                    item[name] = {"S": value}
+            self.put_item("", item)
+
+
+class FakeSTSClient:
+    """
+    Hands out credentials for any role, valid for credential_lifetime
+    """
+
+    def __init__(self, credential_lifetime: timedelta = timedelta(hours=1)):
+        self.credential_lifetime = credential_lifetime
+        self.calls = Counter()
+        self.__lock = threading.Lock()
+
+    def get_caller_identity(self):
+        self.calls['get_caller_identity'] += 1
+        return {"Account": "111111111111"}
+
+    def assume_role(self, RoleArn, RoleSessionName):
+        with self.__lock:
+            self.calls['assume_role'] += 1
+            self.calls[RoleArn] += 1
+
+        return {
+            "Credentials": {
+                "AccessKeyId": f"AKIA-{RoleArn.split(':')[4]}",
+                "SecretAccessKey": "secret",
+                "SessionToken": "token",
+                "Expiration": datetime.now(timezone.utc) + self.credential_lifetime
+            }
+        }
+
+
+class FakeEventsClient:
+    """
+    EventBridge rules in a dict. Rules fire when the clock reaches the minute of their one shot cron expression
+    """
+
+    def __init__(self):
+        # rule name -> {"ScheduleExpression": ..., "State": ...}
+        self.rules = {}
+        self.calls = Counter()
+
+    def put_rule(self, Name, ScheduleExpression=None, State="ENABLED", **kwargs):
+        self.calls['put_rule'] += 1
+        self.rules[Name] = {"ScheduleExpression": ScheduleExpression, "State": State}
+        return {"RuleArn": f"arn:aws:events:us-west-2:111111111111:rule/{Name}"}
+
+    def next_run(self, rule_name: str) -> datetime:
+        """
+        :return: datetime = UTC minute the rule fires at next
+        """
+        minute, hour, day, month, _, year = self.rules[rule_name]['ScheduleExpression'][len("cron("):-1].split(" ")
+        return datetime(int(year), int(month), int(day), int(hour), int(minute))
@@ -0,0 +1,27 @@
+"""
+Minute by minute reference for the action of a schedule, to check the timelines and matrices against.
+Every period is evaluated on its own with CompiledPeriod.action, and the action that began last wins
+"""
+import automated.ec2_actions
+import util.timeline
+
+DAY = util.timeline.MINUTES_PER_DAY
+
+
+def began(period, weekday: int, minute_of_day: int, action: str) -> int:
+    # Minute of the week the action of the period began, before the week for the morning after a Sunday
+    if action == automated.ec2_actions.STOP:
+        return weekday * DAY + period.stop_minute
+    if period.days_mask >> weekday & 1 and minute_of_day >= period.start_minute:
+        return weekday * DAY + period.start_minute
+    return (weekday - 1) * DAY + period.start_minute
+
+
+def schedule_action(periods: list, weekday: int, minute_of_day: int) -> str:
+    ranked = []
+    for period in periods:
+        action = period.action(weekday, minute_of_day)
+        if action != automated.ec2_actions.NONE:
+            ranked.append((began(period, weekday, minute_of_day, action), -util.timeline.PRECEDENCE.index(action),
+                           action))
+    return max(ranked)[2] if ranked else automated.ec2_actions.NONE
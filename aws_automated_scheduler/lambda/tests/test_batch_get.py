@@ -0,0 +1,58 @@
+import pytest
+import automated.dynamodb
+import config
+from tests.fake_aws import FakeDynamoDBClient
+
+
+@pytest.fixture(name="fake_dynamodb")
+def fake_dynamodb_fixture(monkeypatch):
+    fake_dynamodb = FakeDynamoDBClient()
+    fake_dynamodb.load_config(
+        schedules={},
+        periods={f"period-{index:04}": ("MON-FRI", "08:00", "18:00") for index in range(450)}
+    )
+    monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+    monkeypatch.setattr(config, "API_BACKOFF_BASE_SECONDS", 0.001)
+    fake_dynamodb.calls.clear()
+    return fake_dynamodb
+
+
+class TestBatchGet:
+
+    def test_keys_deduplicated_and_chunked(self, fake_dynamodb):
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        sort_keys = [f"period-{index:04}" for index in range(450)]
+
+        items = dynamodb.batch_get("period", sort_keys + sort_keys[:50] + ["period-missing"])
+
+        assert sorted(items) == sort_keys
+        assert items["period-0007"]['start_time'] == "08:00"
+        assert fake_dynamodb.calls['batch_get_item'] == 5
+
+    def test_unprocessed_keys_retried(self, fake_dynamodb):
+        fake_dynamodb.read_capacity = 30
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+
+        items = dynamodb.batch_get("period", [f"period-{index:04}" for index in range(200)])
+
+        assert len(items) == 200
+        # Each chunk of 100 keys takes 4 calls at 30 keys per call
+        assert fake_dynamodb.calls['batch_get_item'] == 2 * 4
+        assert not dynamodb.errors
+
+    @pytest.mark.parametrize(('read_capacity', 'gives_up'), [(None, False), (60, False), (0, True)])
+    def test_throttled_chunks(self, fake_dynamodb, monkeypatch, read_capacity, gives_up):
+        fake_dynamodb.read_capacity = read_capacity
+        monkeypatch.setattr(config, "DYNAMODB_BATCH_MAX_SECONDS", 0.05)
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        periods = [f"period-{index:04}" for index in range(150)]
+
+        items = dynamodb.batch_get("period", periods)
+
+        # Throttling alone reports nothing, only chunks that could not be read at all
+        if gives_up:
+            assert items == {}
+            assert len(dynamodb.errors) == 2
+        else:
+            assert sorted(items) == periods
+            assert dynamodb.errors == []
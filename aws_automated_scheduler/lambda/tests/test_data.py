@@ -0,0 +1,78 @@
+import decimal
+import logging
+import time
+import pytest
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from util import data
+
+logger = logging.getLogger()
+
+
+def config_items(count: int) -> list:
+    items = []
+    for index in range(count):
+        if index % 2:
+            items.append({"pk": "schedule", "sk": f"schedule-{index:05}", "periods": ["MON-FRI", "SAT", "SUN"],
+                          "timezone": "UTC"})
+        else:
+            items.append({"pk": "period", "sk": f"period-{index:05}", "days_of_week": "MON-FRI",
+                          "start_time": "08:00", "stop_time": "18:00"})
+    return items
+
+
+def boto3_serialize(input_json: list) -> list:
+    serializer = TypeSerializer()
+    return [{k: serializer.serialize(set(v) if isinstance(v, list) else v) for k, v in item.items()}
+            for item in input_json]
+
+
+def boto3_deserialize(input_json: list) -> list:
+    deserializer = TypeDeserializer()
+    return [{k: deserializer.deserialize(v) for k, v in item.items()} for item in input_json]
+
+
+class TestData:
+
+    # Known attributes, known attributes of an unexpected type and unknown attributes
+    items = [
+        {"pk": "period", "sk": "MON-FRI", "days_of_week": "MON-FRI", "start_time": "08:00", "stop_time": "18:00"},
+        {"pk": "schedule", "sk": "us_hours", "periods": ["MON-FRI", "SAT", "MON-FRI"], "timezone": "UTC"},
+        {"pk": "schedule", "sk": "no_timezone", "periods": ["MON-FRI"], "timezone": None},
+        {"pk": "config", "sk": "version", "version": 3, "note": "free text", "flags": ["a", "b"], "ratio": 1.5},
+        {"pk": "inventory_scan", "sk": "111111111111#us-west-2#", "scanned_at": 1600000000, "tags": {"a": "b"}}
+    ]
+
+    @pytest.mark.parametrize('item', items)
+    def test_equivalent_to_boto3(self, item):
+        item = {k: decimal.Decimal(str(v)) if isinstance(v, float) else v for k, v in item.items()}
+        serialized = data.convert_json_to_dynamo_json([item])
+
+        assert [data.canonical_item_hash(i) for i in serialized] == \
+            [data.canonical_item_hash(i) for i in boto3_serialize([item])]
+        assert data.convert_dynamo_json_to_py_data(serialized) == boto3_deserialize(serialized)
+
+    def test_input_not_modified(self):
+        items = config_items(2)
+
+        data.convert_json_to_dynamo_json(items)
+
+        assert items == config_items(2)
+
+    def test_10k_items(self):
+        items = config_items(10000)
+        dynamo_items = boto3_serialize(items)
+
+        timings, results = {}, {}
+        for name, function in (("boto3 serialize", boto3_serialize), ("serialize", data.convert_json_to_dynamo_json),
+                               ("boto3 deserialize", boto3_deserialize),
+                               ("deserialize", data.convert_dynamo_json_to_py_data)):
+            started = time.perf_counter()
+            results[name] = function(dynamo_items if "deserialize" in name else items)
+            timings[name] = time.perf_counter() - started
+
+        # Timings are only logged, comparing them would make the test depend on the load of the machine running it
+        logger.info(f"Conversion of 10k items: {timings}")
+        assert [data.canonical_item_hash(item) for item in results['serialize']] == \
+            [data.canonical_item_hash(item) for item in results['boto3 serialize']]
+        assert results['deserialize'] == results['boto3 deserialize']
+        assert data.convert_dynamo_json_to_py_data(results['serialize']) == results['boto3 deserialize']
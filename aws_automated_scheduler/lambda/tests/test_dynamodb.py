@@ -1,19 +1,13 @@
 import pytest
 import automated.dynamodb
+import automated.dynamodb_memory
 import config
 import logging
 
-# import docker
-
-''' 
-In order to run these tests we need to setup the local database connection
-Use docker SDK for python to run container
- - docker run -p 8000:8000 amazon/dynamodb-local
- - Populate database with required tests
- - Execute tests
- - Terminate container
- OR just ensure these tests are run with the docker running amazon/dynamodb-local container running
- and use the appropriate endpoint:port to connect to it
+'''
+These tests run against the in memory database of automated.dynamodb_memory. To run them against
+amazon/dynamodb-local instead, start it with docker run -p 8000:8000 amazon/dynamodb-local and use
+db_conn=config.DB_CONN_LOCAL with the appropriate endpoint:port in config.DB_CONN_LOCAL_ENDPOINT
 '''
 
 logger = logging.getLogger()
@@ -29,10 +23,12 @@ def db_manager_fixture():
             self.client = automated.dynamodb.DynamoDB(
                 region="us-west-2",
                 table_name="Scheduler",
-                db_conn=config.DB_CONN_LOCAL
+                db_conn=config.DB_CONN_MEMORY
             )
 
-    return DBManager()
+    automated.dynamodb_memory.reset()
+    yield DBManager()
+    automated.dynamodb_memory.reset()
 
 
 class TestDynamoDB:
@@ -111,30 +107,6 @@ class TestDynamoDB:
         # We don't get a return from this, so no response?
         # Should we add a response?
 
-    @pytest.mark.parametrize(('sort_key', 'period_list', 'timezone'), schedule_information)
-    def test_retrieve_periods(self, sort_key, period_list, timezone, db_manager):
-        response = db_manager.client.retrieve_schedule_info(sort_key)
-        # DynamoDB sets do not preserve order. Either sort both lists before assertsions or use a dynamo list for order
-        periods = None
-        for val in response:
-            periods = val.get('periods')
-            timezone = val.get('timezone')
-            period_info = list(periods)
-
-        period_info.sort()
-        period_list.sort()
-        assert period_info == period_list
-        # [print(x) for x in response]
-
-    @pytest.mark.parametrize(('sort_key', 'days_of_week', 'start_time', 'stop_time'), period_information)
-    def test_retrieve_period_info(self, sort_key, days_of_week, start_time, stop_time, db_manager):
-        # db_manager.client.put_period_item(sort_key, days_of_week, start_time, stop_time)
-        response = db_manager.client.retrieve_period_info([sort_key])
-        assert response[0].get('sk') == sort_key
-        assert response[0].get('days_of_week') == days_of_week
-        assert response[0].get('start_time') == start_time
-        assert response[0].get('stop_time') == stop_time
-
     def put_schedule_item(self, sort_key, period_set, timezone, db_manager):
         """
         Helper function to put schedule items individually rather than using a whole config file
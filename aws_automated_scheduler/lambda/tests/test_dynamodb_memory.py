@@ -0,0 +1,72 @@
+import botocore.exceptions
+import pytest
+import automated.dynamodb
+import automated.dynamodb_memory
+import config
+
+
+@pytest.fixture(name="memory_dynamodb")
+def memory_dynamodb_fixture(monkeypatch):
+    monkeypatch.setattr(config, "API_BACKOFF_BASE_SECONDS", 0.001)
+    automated.dynamodb_memory.reset()
+    dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler", db_conn=config.DB_CONN_MEMORY)
+    dynamodb.dynamodb.page_size = 10
+    yield dynamodb
+    automated.dynamodb_memory.reset()
+
+
+def period_requests(count: int) -> list:
+    return [{"PutRequest": {"Item": {"pk": {"S": "period"}, "sk": {"S": f"period-{index:04}"}}}}
+            for index in range(count)]
+
+
+class TestDynamoDBMemory:
+
+    def test_query_and_scan_pages(self, memory_dynamodb):
+        memory_dynamodb.bulk_write(period_requests(95) + [
+            {"PutRequest": {"Item": {"pk": {"S": "schedule"}, "sk": {"S": "us_hours"}}}}
+        ])
+        client = memory_dynamodb.dynamodb
+
+        page = client.query(TableName="Scheduler", KeyConditionExpression="pk = :pk",
+                            ExpressionAttributeValues={":pk": {"S": "period"}})
+        assert page['Count'] == 10
+        assert page['LastEvaluatedKey'] == {"pk": {"S": "period"}, "sk": {"S": "period-0009"}}
+
+        assert [item['sk'] for item in memory_dynamodb.retrieve_partition("period")] == \
+            [f"period-{index:04}" for index in range(95)]
+        assert client.calls['query'] == 1 + 10
+        assert len(list(memory_dynamodb.scan_items(total_segments=3))) == 96
+
+    def test_unprocessed_requests(self, memory_dynamodb):
+        client = memory_dynamodb.dynamodb
+        client.write_capacity = 10
+
+        assert memory_dynamodb.bulk_write(period_requests(25))['written'] == 25
+        assert client.calls['batch_write_item'] == 3
+
+        client.read_capacity = 40
+        assert len(memory_dynamodb.batch_get("period", [f"period-{index:04}" for index in range(25)] + ["x"])) == 25
+
+        response = client.batch_get_item(RequestItems={"Scheduler": {"Keys": [
+            {"pk": {"S": "period"}, "sk": {"S": f"period-{index:04}"}} for index in range(50)
+        ]}})
+        assert len(response['Responses']['Scheduler']) == 25
+        assert len(response['UnprocessedKeys']['Scheduler']['Keys']) == 10
+
+    def test_request_validation(self, memory_dynamodb):
+        client = memory_dynamodb.dynamodb
+        key = {"pk": {"S": "period"}, "sk": {"S": "a"}}
+
+        with pytest.raises(botocore.exceptions.ParamValidationError):
+            client.batch_write_item(RequestItems={"Scheduler": period_requests(26)})
+        with pytest.raises(botocore.exceptions.ClientError, match="ValidationException"):
+            client.batch_get_item(RequestItems={"Scheduler": {"Keys": [key, key]}})
+        with pytest.raises(botocore.exceptions.ClientError, match="ResourceNotFoundException"):
+            client.get_item(TableName="Missing", Key=key)
+
+    def test_tables_shared_by_process(self, memory_dynamodb):
+        memory_dynamodb.bump_config_version()
+        other = automated.dynamodb.DynamoDB(region="us-east-1", table_name="Scheduler", db_conn=config.DB_CONN_MEMORY)
+
+        assert other.retrieve_config_version() == 1
@@ -1,7 +1,9 @@
 import pytest
 import logging
 import automated.ec2
+import automated.ec2_actions
 import config
+from tests.fake_aws import FakeEC2Client, fake_instance
 
 logger = logging.getLogger()
 
@@ -34,5 +36,111 @@ class TestEC2:
         yield
         print("Stop\n")
 
-    def test_get_instances(self):
-        assert True
\ No newline at end of file
+    def test_discovery_reads_tags_from_describe_instances(self, ec2_manager):
+        instances = [fake_instance(f"i-{index:04}", schedule="us_hours") for index in range(25)]
+        instances.append(fake_instance("i-override", schedule="uk_hours", override="STOP"))
+        fake_client = FakeEC2Client(instances)
+        ec2 = automated.ec2.EC2(region="us-west-2", ec2_conn=config.EC2_CONN_LOCAL, page_size=10)
+        ec2._EC2__ec2 = fake_client
+
+        projected_instances = ec2._retrieve_all_instances_with_tag_key("Schedule")
+        instance_list = list(ec2._retrieve_instance_id_and_schedule_tag_info(projected_instances, "Schedule"))
+
+        assert len(instance_list) == 26
+        assert instance_list[0] == {"instance_id": "i-0000", "tag": "us_hours", "override": None, "state": "running"}
+        assert instance_list[-1] == {"instance_id": "i-override", "tag": "uk_hours", "override": "STOP",
+                                     "state": "running"}
+        # One describe_instances call per page and no per instance describe_tags calls
+        assert fake_client.calls['describe_instances'] == 3
+        assert fake_client.calls['describe_tags'] == 0
+
+    def test_discovery_streams_pages(self, ec2_manager):
+        fake_client = FakeEC2Client([fake_instance(f"i-{index:04}", schedule="us_hours") for index in range(25)])
+        ec2 = automated.ec2.EC2(region="us-west-2", ec2_conn=config.EC2_CONN_LOCAL, page_size=10)
+        ec2._EC2__ec2 = fake_client
+
+        instance_stream = ec2._retrieve_instance_id_and_schedule_tag_info(
+            ec2._retrieve_all_instances_with_tag_key("Schedule"), "Schedule"
+        )
+        assert fake_client.calls['describe_instances'] == 0
+
+        # Pages are only requested once the previous one has been consumed
+        for index, instance in enumerate(instance_stream):
+            assert fake_client.calls['describe_instances'] == index // 10 + 1
+
+    def test_discovery_filters_and_projects_instances(self, ec2_manager):
+        instances = [
+            fake_instance("i-running", schedule="us_hours"),
+            fake_instance("i-stopped", schedule="us_hours", state="stopped"),
+            fake_instance("i-terminated", schedule="us_hours", state="terminated"),
+            fake_instance("i-spot", schedule="us_hours", lifecycle="spot"),
+            fake_instance("i-untagged"),
+            fake_instance("i-quoted", schedule="us_hours", tag_key="it's"),
+        ]
+        fake_client = FakeEC2Client(instances)
+        ec2_manager.client._EC2__ec2 = fake_client
+
+        projected_instances = list(ec2_manager.client._retrieve_all_instances_with_tag_key("Schedule"))
+
+        assert [instance['instance_id'] for instance in projected_instances] == ["i-running", "i-stopped"]
+        # Only the scheduler tags are kept from each instance
+        assert projected_instances[0] == {
+            "instance_id": "i-running",
+            "state": "running",
+            "tags": [{"Key": "Schedule", "Value": "us_hours"}]
+        }
+        assert fake_client.requests[0]['MaxResults'] == config.EC2_DESCRIBE_PAGE_SIZE
+
+        quoted_instances = list(ec2_manager.client._retrieve_all_instances_with_tag_key("it's"))
+        assert quoted_instances[0]['tags'] == [{"Key": "it's", "Value": "us_hours"}]
+
+    @pytest.mark.parametrize(('tags', 'expected_result'), [
+        ([], {"Schedule": None, "override": None}),
+        ([{"Key": "Schedule", "Value": "us_hours"}], {"Schedule": "us_hours", "override": None}),
+        ([{"Key": "override", "Value": "START"}, {"Key": "Schedule", "Value": "uk_hours"}],
+         {"Schedule": "uk_hours", "override": "START"}),
+        ([{"Key": "schedule", "Value": "case_sensitive"}], {"Schedule": None, "override": None}),
+    ])
+    def test_get_tag_values(self, tags, expected_result):
+        assert automated.ec2.EC2.get_tag_values(tags, ("Schedule", "override")) == expected_result
+
+    def test_batched_actions(self, ec2_manager):
+        instances = [fake_instance(f"i-{index:04}", schedule="us_hours", state="stopped") for index in range(250)]
+        fake_client = FakeEC2Client(instances)
+        ec2_manager.client._EC2__ec2 = fake_client
+
+        accumulator = automated.ec2.ActionAccumulator(ec2_manager.client, batch_size=100)
+        transitions = []
+        for index, instance in enumerate(instances, start=1):
+            transitions.extend(accumulator.add(automated.ec2_actions.START, instance['InstanceId']))
+            # Full chunks are sent right away
+            assert fake_client.calls['StartInstances'] == index // 100
+        assert accumulator.add(automated.ec2_actions.NONE, "i-ignored") == []
+
+        transitions.extend(accumulator.dispatch())
+
+        assert fake_client.calls['StartInstances'] == 3
+        assert len(transitions) == 250
+        assert all(transition['changed'] for transition in transitions)
+        assert transitions[0] == {
+            "instance_id": "i-0000",
+            "action": automated.ec2_actions.START,
+            "previous_state": "stopped",
+            "current_state": "pending",
+            "changed": True
+        }
+        # Nothing is left to send once dispatched
+        assert accumulator.dispatch() == []
+
+    def test_batch_bisected_on_bad_instance(self, ec2_manager):
+        instances = [fake_instance(f"i-{index:04}", schedule="us_hours") for index in range(8)]
+        instances[5]['State'] = {"Name": "terminated"}
+        fake_client = FakeEC2Client(instances)
+        ec2_manager.client._EC2__ec2 = fake_client
+
+        instance_ids = [instance['InstanceId'] for instance in instances] + ["i-missing"]
+        transitions = ec2_manager.client.perform_batch_action(automated.ec2_actions.STOP, instance_ids)
+
+        stopped = {transition['instance_id'] for transition in transitions}
+        assert stopped == {instance['InstanceId'] for instance in instances} - {"i-0005"}
+        assert fake_client.calls['StopInstances'] < 2 * len(instance_ids)
@@ -0,0 +1,92 @@
+import itertools
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+import pytest
+import automated.ec2_actions
+import util.evalperiod
+import tests.schedule_reference as schedule_reference
+import tests.test_eval_period as eval_period_cases
+
+numpy = pytest.importorskip("numpy")
+import util.evalmatrix  # noqa: E402
+
+logger = logging.getLogger()
+
+
+def scalar_action(periods: list, instant: datetime) -> str:
+    return schedule_reference.schedule_action(periods, instant.weekday(), instant.hour * 60 + instant.minute)
+
+
+def compiled(sort_key: str, days_of_week: str, start_time: str, stop_time: str) -> util.evalperiod.CompiledPeriod:
+    return util.evalperiod.CompiledPeriod.compile(
+        {"sk": sort_key, "days_of_week": days_of_week, "start_time": start_time, "stop_time": stop_time}
+    )
+
+
+class TestEvalMatrix:
+
+    periods = [compiled(*period[:4]) for period in eval_period_cases.TestEvalPeriod.compiled_periods] + \
+        [util.evalperiod.CompiledPeriod.compile(period)
+         for period, _, _ in eval_period_cases.TestEvalPeriod.period_information[:1]]
+
+    @pytest.mark.parametrize(('period', 'testing_days', 'expected_result'),
+                             eval_period_cases.TestEvalPeriod.period_information)
+    def test_eval_period_matrix(self, period, testing_days, expected_result):
+        schedule_matrix = util.evalmatrix.ScheduleMatrix({"schedule": [util.evalperiod.CompiledPeriod.compile(period)]})
+        assert schedule_matrix.action("schedule", testing_days) == expected_result
+
+    def test_period_rows(self):
+        rows = util.evalmatrix.period_rows(self.periods)
+
+        assert rows.shape == (len(self.periods), util.evalmatrix.MINUTES_PER_WEEK)
+        for period, row in zip(self.periods, rows):
+            assert [util.evalmatrix.ACTIONS[code] for code in row] == [
+                period.action(minute // util.evalmatrix.MINUTES_PER_DAY, minute % util.evalmatrix.MINUTES_PER_DAY)
+                for minute in range(util.evalmatrix.MINUTES_PER_WEEK)
+            ]
+
+    def test_same_answers_as_eval_period(self):
+        # Every single period and every ordered pair of periods as a schedule
+        schedules = {f"schedule-{index}": list(periods) for index, periods in enumerate(
+            [(period,) for period in self.periods] + list(itertools.permutations(self.periods, 2))
+        )}
+        instants = list(eval_period_cases.TestEvalPeriod.testing_datetime.values()) + \
+            [datetime(2020, 1, 6) + timedelta(minutes=minute) for minute in range(0, 7 * 24 * 60, 17)]
+
+        schedule_matrix = util.evalmatrix.ScheduleMatrix(schedules)
+        codes = schedule_matrix.codes_at(instants)
+
+        for row, (name, periods) in enumerate(schedules.items()):
+            for column, instant in enumerate(instants):
+                expected = scalar_action(periods, instant)
+                assert util.evalmatrix.ACTIONS[codes[row, column]] == expected
+                assert schedule_matrix.action(name, instant) == expected
+
+        assert schedule_matrix.action("unknown", instants[0]) == automated.ec2_actions.NONE
+
+    def test_benchmark_10k_schedules_one_week(self):
+        rng = random.Random(1)
+        days = ["MON-FRI", "MON-THU", "SAT-SUN", "TUE", "FRI,SUN", "MON-WED,FRI"]
+        periods = [compiled(f"period-{index}", rng.choice(days), f"{rng.randrange(0, 12):02}:{rng.randrange(60):02}",
+                            f"{rng.randrange(12, 24):02}:{rng.randrange(60):02}") for index in range(500)]
+        schedules = {f"schedule-{index}": rng.sample(periods, rng.randrange(1, 4)) for index in range(10000)}
+        minutes = numpy.arange(util.evalmatrix.MINUTES_PER_WEEK)
+
+        started = time.perf_counter()
+        codes = util.evalmatrix.ScheduleMatrix(schedules).codes_at(minutes)
+        matrix_seconds = time.perf_counter() - started
+
+        # The scalar path would take days for all 10k x 10080 evaluations, time a sample of it
+        sample = [(name, rng.randrange(util.evalmatrix.MINUTES_PER_WEEK)) for name in rng.sample(list(schedules), 200)]
+        started = time.perf_counter()
+        for name, minute in sample:
+            action = scalar_action(schedules[name], datetime(2020, 1, 6) + timedelta(minutes=minute))
+            assert util.evalmatrix.ACTIONS[codes[list(schedules).index(name), minute]] == action
+        scalar_seconds = (time.perf_counter() - started) / len(sample) * codes.size
+
+        logger.info(f"Actions of [{len(schedules)}] schedules at every minute of the week: matrix "
+                    f"[{matrix_seconds:.2f}] seconds, scalar (estimated) [{scalar_seconds:.0f}] seconds")
+        assert codes.shape == (10000, util.evalmatrix.MINUTES_PER_WEEK)
+        assert matrix_seconds < scalar_seconds
@@ -1,4 +1,5 @@
 import logging
+import time
 import pytest
 import util.evalperiod
 import automated.ec2_actions
@@ -72,7 +73,7 @@ class TestEvalPeriod:
         # {"sk": "single_period_no_stop", "days_of_week": "MON", "start_time": "08:00", "stop_time": None}
     ]
 
-    # Used for testing evalperiod.__is_matching_day
+    # Used for testing evalperiod.compile_days
     matching_day = [
         (datetime(year=2020, month=1, day=6), "MON", True),
         (datetime(year=2020, month=1, day=7), "TUE", True),
@@ -113,6 +114,99 @@ class TestEvalPeriod:
 
     @pytest.mark.parametrize(('date_time', 'days_of_week', 'expected_result'), matching_day)
     def test_is_matching_day(self, date_time, days_of_week, expected_result):
+        days_mask, _ = util.evalperiod.compile_days(days_of_week)
+        assert bool(days_mask >> date_time.weekday() & 1) == expected_result
+
+    @pytest.mark.parametrize(('period', 'testing_days', 'expected_result'), period_information)
+    def test_eval_compiled_period(self, period, testing_days, expected_result):
+        evaluator = util.evalperiod.EvalPeriod()
+        compiled_period = util.evalperiod.CompiledPeriod.compile(period)
+        assert evaluator.eval_period(period=compiled_period, override_time=testing_days) == expected_result
+
+    # sort_key, days_of_week, start_time, stop_time, expected days_mask, start_minute, stop_minute
+    compiled_periods = [
+        ("MON-THU", "MON-THU", "08:00", "18:00", 0b0001111, 480, 1080),
+        ("no_days", None, "08:00", "18:00", 0, 480, 1080),
+        ("no_start", "MON", None, "18:00", 0b0000001, None, 1080),
+        ("no_stop", "SAT-SUN", "08:00", None, 0b1100000, 480, None),
+        ("midnight", "mon,WED,fri-sun", "24:00", "24:00", 0b1110101, 0, 1439),
+        ("wraparound", "SAT-TUE", "08:00", "18:00", 0b1100011, 480, 1080),
+        ("overnight", "FRI-MON", "22:00", "06:00", 0b1110001, 1320, 360),
+        ("stop_at_midnight", "MON-FRI", "08:00", "00:00", 0b0011111, 480, 0),
+        ("bad_day", "MON,XYZ", "08:00", "18:00", 0, 480, 1080),
+    ]
+
+    @pytest.mark.parametrize(('sort_key', 'days_of_week', 'start_time', 'stop_time', 'days_mask', 'start_minute',
+                              'stop_minute'), compiled_periods)
+    def test_compiled_period(self, sort_key, days_of_week, start_time, stop_time, days_mask, start_minute,
+                             stop_minute):
+        period = {"sk": sort_key, "days_of_week": days_of_week, "start_time": start_time, "stop_time": stop_time}
+        compiled_period = util.evalperiod.CompiledPeriod.compile(period)
+
+        assert (compiled_period.days_mask, compiled_period.start_minute, compiled_period.stop_minute) == \
+            (days_mask, start_minute, stop_minute)
+        assert (compiled_period.error is not None) == (sort_key == "bad_day")
+
+    # sort_key of compiled_periods, testing time, expected action
+    compiled_actions = [
+        ("MON-THU", "MON-06:00", automated.ec2_actions.NONE),
+        ("MON-THU", "THU-12:00", automated.ec2_actions.START),
+        ("MON-THU", "FRI-12:00", automated.ec2_actions.NONE),
+        ("no_days", "MON-12:00", automated.ec2_actions.NONE),
+        ("no_start", "MON-12:00", automated.ec2_actions.NONE),
+        ("no_start", "MON-18:00", automated.ec2_actions.STOP),
+        ("no_stop", "SAT-06:00", automated.ec2_actions.NONE),
+        ("no_stop", "SUN-22:30", automated.ec2_actions.START),
+        ("midnight", "MON-06:00", automated.ec2_actions.START),
+        ("midnight", "TUE-12:00", automated.ec2_actions.NONE),
+        ("wraparound", "SUN-12:00", automated.ec2_actions.START),
+        ("wraparound", "TUE-18:00", automated.ec2_actions.STOP),
+        ("wraparound", "WED-12:00", automated.ec2_actions.NONE),
+        ("overnight", "MON-22:30", automated.ec2_actions.START),
+        ("overnight", "TUE-06:00", automated.ec2_actions.STOP),
+        ("overnight", "WED-06:00", automated.ec2_actions.NONE),
+        ("overnight", "SAT-06:00", automated.ec2_actions.STOP),
+        ("stop_at_midnight", "MON-06:00", automated.ec2_actions.NONE),
+        ("stop_at_midnight", "MON-22:30", automated.ec2_actions.START),
+        ("stop_at_midnight", "SAT-06:00", automated.ec2_actions.STOP),
+        ("bad_day", "MON-12:00", automated.ec2_actions.NONE),
+    ]
+
+    @pytest.mark.parametrize(('sort_key', 'testing_day', 'expected_result'), compiled_actions)
+    def test_compiled_period_action(self, sort_key, testing_day, expected_result):
+        _, days_of_week, start_time, stop_time = next(period[:4] for period in self.compiled_periods
+                                                      if period[0] == sort_key)
+        compiled_period = util.evalperiod.CompiledPeriod.compile(
+            {"sk": sort_key, "days_of_week": days_of_week, "start_time": start_time, "stop_time": stop_time}
+        )
+        evaluator = util.evalperiod.EvalPeriod()
+
+        assert evaluator.eval_period(compiled_period, override_time=self.testing_datetime[testing_day]) == \
+            expected_result
+        # Problems parsing the days are reported on every evaluation
+        assert evaluator.errors == ([compiled_period.error] if sort_key == "bad_day" else [])
+
+    def test_compiled_period_benchmark(self):
+        period = {"sk": "hyphenated_period", "days_of_week": "MON-THU,SAT", "start_time": "08:00", "stop_time": "18:00"}
+        instants = [(testing_day.weekday(), testing_day.hour * 60 + testing_day.minute)
+                    for testing_day in self.testing_datetime.values()]
+        evaluations = 1000000
+
+        started = time.perf_counter()
+        compiled_period = util.evalperiod.CompiledPeriod.compile(period)
+        action = compiled_period.action
+        for index in range(evaluations):
+            action(*instants[index % len(instants)])
+        compiled_seconds = time.perf_counter() - started
+
+        # A period item is compiled on every evaluation, time a sample of it
         evaluator = util.evalperiod.EvalPeriod()
-        dt = evaluator._EvalPeriod__is_matching_day(date_time, days_of_week)
-        assert dt == expected_result
+        testing_days = list(self.testing_datetime.values())
+        started = time.perf_counter()
+        for index in range(evaluations // 100):
+            evaluator.eval_period(period, override_time=testing_days[index % len(testing_days)])
+        item_seconds = (time.perf_counter() - started) * 100
+
+        # Timings only, comparing them would make the test depend on the load of the machine running it
+        logger.info(f"Evaluating {evaluations} periods: compiled once [{compiled_seconds:.2f}] seconds, "
+                    f"compiled on every evaluation (estimated) [{item_seconds:.2f}] seconds")
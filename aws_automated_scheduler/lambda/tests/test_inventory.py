@@ -0,0 +1,142 @@
+import logging
+import time
+import pytest
+import automated.dynamodb
+import config
+import automated.ec2
+import automated.sts
+import events.inventory
+import events.scheduler
+from tests.fake_aws import FakeDynamoDBClient, FakeSTSClient, client_error
+
+logger = logging.getLogger()
+
+ACCOUNT_ID = "111111111111"
+REGION = "us-west-2"
+ENV_VARS = {"region": REGION, "tag_key": "Schedule", "table_name": "Scheduler"}
+
+
+@pytest.fixture(name="fake_dynamodb")
+def fake_dynamodb_fixture(monkeypatch):
+    fake_dynamodb = FakeDynamoDBClient(page_size=2)
+    monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+    monkeypatch.setattr(automated.sts, "client", lambda *args, **kwargs: FakeSTSClient())
+    monkeypatch.setattr(automated.sts, "_account_id", None)
+    return fake_dynamodb
+
+
+def tag_change_event(instance_id: str, tags: dict) -> dict:
+    return {
+        "detail-type": "Tag Change on Resource",
+        "source": "aws.tag",
+        "account": ACCOUNT_ID,
+        "region": REGION,
+        "resources": [f"arn:aws:ec2:{REGION}:{ACCOUNT_ID}:instance/{instance_id}"],
+        "detail": {"service": "ec2", "resource-type": "instance", "changed-tag-keys": list(tags), "tags": tags}
+    }
+
+
+def state_change_event(instance_id: str, state: str) -> dict:
+    return {
+        "detail-type": "EC2 Instance State-change Notification",
+        "source": "aws.ec2",
+        "account": ACCOUNT_ID,
+        "region": REGION,
+        "detail": {"instance-id": instance_id, "state": state}
+    }
+
+
+def retrieve_inventory() -> dict:
+    dynamodb = automated.dynamodb.DynamoDB(region=REGION, table_name="Scheduler")
+    return {instance['instance_id']: instance for instance in dynamodb.retrieve_inventory(ACCOUNT_ID, REGION)}
+
+
+class TestInventory:
+
+    def test_tag_and_state_changes(self, fake_dynamodb):
+        events.inventory.record_tag_change(tag_change_event("i-001", {"Schedule": "us_hours"}), ENV_VARS)
+        events.inventory.record_tag_change(
+            tag_change_event("i-002", {"Schedule": "uk_hours", "override": "STOP"}), ENV_VARS)
+        events.inventory.record_state_change(state_change_event("i-001", "stopped"), ENV_VARS)
+
+        assert retrieve_inventory() == {
+            "i-001": {"instance_id": "i-001", "tag": "us_hours", "override": None, "state": "stopped"},
+            "i-002": {"instance_id": "i-002", "tag": "uk_hours", "override": "STOP", "state": None},
+        }
+
+        # Retagging keeps the last known state, removing the override tag removes it from the record
+        events.inventory.record_tag_change(tag_change_event("i-001", {"Schedule": "uk_hours"}), ENV_VARS)
+        events.inventory.record_tag_change(tag_change_event("i-002", {"Schedule": "uk_hours"}), ENV_VARS)
+
+        assert retrieve_inventory() == {
+            "i-001": {"instance_id": "i-001", "tag": "uk_hours", "override": None, "state": "stopped"},
+            "i-002": {"instance_id": "i-002", "tag": "uk_hours", "override": None, "state": None},
+        }
+
+    def test_removed_instances(self, fake_dynamodb):
+        for instance_id in ("i-001", "i-002", "i-003"):
+            events.inventory.record_tag_change(tag_change_event(instance_id, {"Schedule": "us_hours"}), ENV_VARS)
+
+        events.inventory.record_tag_change(tag_change_event("i-001", {"Name": "untagged"}), ENV_VARS)
+        events.inventory.record_state_change(state_change_event("i-002", "terminated"), ENV_VARS)
+        # Instances that were never tagged are not added by state changes
+        response = events.inventory.record_state_change(state_change_event("i-untracked", "running"), ENV_VARS)
+
+        assert response['statusCode'] == 200
+        assert list(retrieve_inventory()) == ["i-003"]
+
+    def test_throttled_inventory_calls_are_reported(self, fake_dynamodb, monkeypatch):
+        def throttled(**kwargs):
+            raise client_error("ProvisionedThroughputExceededException", "UpdateItem")
+
+        monkeypatch.setattr(fake_dynamodb, "update_item", throttled)
+        monkeypatch.setattr(fake_dynamodb, "get_item", throttled)
+
+        for response in (
+            events.inventory.record_tag_change(tag_change_event("i-001", {"Schedule": "us_hours"}), ENV_VARS),
+            events.inventory.record_state_change(state_change_event("i-001", "stopped"), ENV_VARS)
+        ):
+            assert response['statusCode'] == 500
+            assert "ProvisionedThroughputExceededException" in response['body']['message'][0]
+
+        # An unreadable scan time asks for a rescan
+        dynamodb = automated.dynamodb.DynamoDB(region=REGION, table_name="Scheduler")
+        assert dynamodb.retrieve_inventory_scan_time(ACCOUNT_ID, REGION) == 0
+        assert len(dynamodb.errors) == 1
+
+    def test_scheduler_loads_inventory(self, fake_dynamodb, monkeypatch):
+        describe_calls = []
+
+        def discovery(ec2, tag_key):
+            describe_calls.append(tag_key)
+            return [
+                {"instance_id": "i-001", "tag": "us_hours", "override": None, "state": "running"},
+                {"instance_id": "i-002", "tag": "us_hours", "override": None, "state": "stopped"},
+            ]
+
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", discovery)
+        events.inventory.record_tag_change(tag_change_event("i-stale", {"Schedule": "us_hours"}), ENV_VARS)
+
+        env_vars = {**ENV_VARS, "use_inventory": True}
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+
+        # Never scanned, so the first run rescans and repairs the inventory
+        assert len(describe_calls) == 1
+        assert sorted(retrieve_inventory()) == ["i-001", "i-002"]
+
+        query_calls = fake_dynamodb.calls['query']
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+
+        # Later runs load the inventory with a Query instead of describing the instances
+        # The schedule configuration comes from the warm container cache
+        assert len(describe_calls) == 1
+        assert fake_dynamodb.calls['query'] == query_calls + 1
+
+        # Rescans once the inventory is older than the rescan interval
+        dynamodb = automated.dynamodb.DynamoDB(region=REGION, table_name="Scheduler")
+        dynamodb.replace_inventory(ACCOUNT_ID, REGION, [],
+                                   scanned_at=int(time.time()) - 2 * config.INVENTORY_RESCAN_SECONDS)
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+
+        assert len(describe_calls) == 2
+        assert sorted(retrieve_inventory()) == ["i-001", "i-002"]
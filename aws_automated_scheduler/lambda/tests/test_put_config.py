@@ -0,0 +1,207 @@
+import json
+from datetime import datetime
+import pytest
+import automated.dynamodb
+import automated.dynamodb_memory
+import automated.eventbridge
+import automated.s3
+import config
+import events.put_config
+import util.scheduleconfig
+from tests.fake_aws import FakeDynamoDBClient, FakeEventsClient
+
+
+def config_items(count: int) -> list:
+    return [{"pk": "period", "sk": f"period-{index:05}", "days_of_week": "MON-FRI", "start_time": "08:00"}
+            for index in range(count)]
+
+
+@pytest.fixture(name="fake_dynamodb")
+def fake_dynamodb_fixture(monkeypatch):
+    fake_dynamodb = FakeDynamoDBClient()
+    monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+    monkeypatch.setattr(config, "API_BACKOFF_BASE_SECONDS", 0.001)
+    return fake_dynamodb
+
+
+class TestPutConfig:
+
+    def test_large_config_loaded_in_chunks(self, fake_dynamodb):
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        items = [{k: {"S": v} for k, v in item.items()} for item in config_items(5000)]
+
+        result = dynamodb.load_json_into_db(items)
+
+        assert result == {"written": 5000, "retried": 0, "failed": 0}
+        assert fake_dynamodb.calls['batch_write_item'] == 5000 // 25
+        assert len(fake_dynamodb.items) == 5000
+
+    def test_unprocessed_items_resubmitted(self, fake_dynamodb):
+        fake_dynamodb.write_capacity = 10
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        items = [{k: {"S": v} for k, v in item.items()} for item in config_items(100)]
+
+        result = dynamodb.load_json_into_db(items)
+
+        # Each chunk of 25 takes 3 calls: 25 -> 15 unprocessed -> 5 unprocessed -> done
+        assert result == {"written": 100, "retried": 4 * (15 + 5), "failed": 0}
+        assert fake_dynamodb.calls['batch_write_item'] == 4 * 3
+        assert not dynamodb.errors
+
+    def test_gives_up_at_deadline(self, fake_dynamodb, monkeypatch):
+        fake_dynamodb.write_capacity = 0
+        monkeypatch.setattr(config, "DYNAMODB_BATCH_MAX_SECONDS", 0.05)
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        items = [{k: {"S": v} for k, v in item.items()} for item in config_items(30)]
+
+        result = dynamodb.load_json_into_db(items)
+
+        assert result['written'] == 0
+        assert result['failed'] == 30
+        assert len(dynamodb.errors) == 1
+
+    def test_put_config_syncs_changes(self, fake_dynamodb, monkeypatch):
+        uploaded = {"config": []}
+
+        class FakeS3:
+            def __init__(self, s3_conn):
+                pass
+
+            def retrieve_data_from_s3_object(self):
+                return json.dumps(uploaded['config'])
+
+        monkeypatch.setattr(automated.s3, "S3", FakeS3)
+        env_vars = {"region": "us-west-2", "table_name": "Scheduler"}
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        schedules = [{"pk": "schedule", "sk": f"schedule-{index}", "periods": ["a", "b", "c"], "timezone": "UTC"}
+                     for index in range(3)]
+
+        uploaded['config'] = config_items(60) + schedules
+        response = events.put_config.put_config_into_dynamo(env_vars)
+
+        assert response['statusCode'] == 200
+        assert "added [63], changed [0], deleted [0], unchanged [0]" in response['body']['message']
+        assert dynamodb.retrieve_config_version() == 1
+
+        # Same config with the period sets in a different order
+        uploaded['config'] = config_items(60) + [{**schedule, "periods": ["c", "a", "b"]} for schedule in schedules]
+        writes = fake_dynamodb.calls['batch_write_item']
+        response = events.put_config.put_config_into_dynamo(env_vars)
+
+        assert "added [0], changed [0], deleted [0], unchanged [63]" in response['body']['message']
+        assert fake_dynamodb.calls['batch_write_item'] == writes
+        # Nothing changed, so warm containers keep their cached config
+        assert dynamodb.retrieve_config_version() == 1
+
+        # One period edited, one schedule and ten periods removed, one period added
+        edited = config_items(50)
+        edited[7]['start_time'] = "09:00"
+        uploaded['config'] = edited + schedules[:2] + [{"pk": "period", "sk": "new", "days_of_week": "SAT"}]
+        response = events.put_config.put_config_into_dynamo(env_vars)
+
+        assert "added [1], changed [1], deleted [11], unchanged [51]" in response['body']['message']
+        assert fake_dynamodb.calls['batch_write_item'] == writes + 1
+        assert ("schedule", "schedule-2") not in fake_dynamodb.items
+        assert fake_dynamodb.items[("period", "period-00007")]['start_time'] == {"S": "09:00"}
+        assert dynamodb.retrieve_config_version() == 2
+
+    def test_sync_leaves_other_partitions(self, fake_dynamodb):
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        dynamodb.put_inventory_item("111111111111", "us-west-2", "i-001", "us_hours", None)
+
+        result = dynamodb.sync_config_items([{"pk": {"S": "period"}, "sk": {"S": "a"}}])
+
+        assert (result['added'], result['deleted']) == (1, 0)
+        assert len(fake_dynamodb.items) == 2
+
+    def test_scheduler_loads_config_snapshot(self, fake_dynamodb, monkeypatch):
+        uploaded = {"config": []}
+
+        class FakeS3:
+            def __init__(self, s3_conn):
+                pass
+
+            def retrieve_data_from_s3_object(self):
+                return json.dumps(uploaded['config'])
+
+        monkeypatch.setattr(automated.s3, "S3", FakeS3)
+        # Small chunks so the snapshot is split over several items
+        monkeypatch.setattr(config, "CONFIG_SNAPSHOT_CHUNK_BYTES", 1000)
+        env_vars = {"region": "us-west-2", "table_name": "Scheduler"}
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        schedules = [{"pk": "schedule", "sk": "us_hours", "periods": ["period-00001", "period-00002"],
+                      "timezone": "UTC"}]
+
+        uploaded['config'] = config_items(500) + schedules
+        events.put_config.put_config_into_dynamo(env_vars)
+
+        version, chunks = dynamodb.retrieve_config_snapshot_head()
+        assert (version, chunks) == (1, len(dynamodb.retrieve_config_snapshot()[1]) // 1000 + 1)
+        assert chunks > 1
+
+        queries, gets = fake_dynamodb.calls['query'], fake_dynamodb.calls['get_item']
+        schedule_config = util.scheduleconfig.get_schedule_config(dynamodb)
+        periods, timezone = schedule_config.get_schedule("us_hours")
+
+        assert fake_dynamodb.calls['query'] == queries
+        # Version probe and snapshot head, the other chunks come from one batch_get_item
+        assert fake_dynamodb.calls['get_item'] == gets + 2
+        assert timezone == "UTC"
+        assert [(period.name, period.days_mask, period.start_minute, period.stop_minute) for period in periods] == \
+            [("period-00001", 0b0011111, 8 * 60, None), ("period-00002", 0b0011111, 8 * 60, None)]
+        assert len(schedule_config.periods) == 500
+
+        # A smaller config replaces the snapshot and removes the chunks of the previous one
+        uploaded['config'] = config_items(10) + schedules
+        events.put_config.put_config_into_dynamo(env_vars)
+
+        assert dynamodb.retrieve_config_snapshot_head() == (2, 1)
+        assert not [key for key in fake_dynamodb.items if key[1].startswith("snapshot#")]
+        assert len(util.scheduleconfig.ScheduleConfig.from_snapshot(dynamodb.retrieve_config_snapshot()[1]).periods) \
+            == 10
+
+    def test_unreadable_snapshot_head_rebuilds_snapshot(self, fake_dynamodb, monkeypatch):
+        class FakeS3:
+            def __init__(self, s3_conn):
+                pass
+
+            def retrieve_data_from_s3_object(self):
+                return json.dumps(config_items(3))
+
+        monkeypatch.setattr(automated.s3, "S3", FakeS3)
+        get_item = fake_dynamodb.get_item
+
+        def throttled_head(**kwargs):
+            if kwargs['Key']['sk']['S'] == automated.dynamodb.CONFIG_SNAPSHOT_SK and 'ProjectionExpression' in kwargs:
+                raise automated.dynamodb_memory.client_error("ProvisionedThroughputExceededException", "GetItem")
+            return get_item(**kwargs)
+
+        monkeypatch.setattr(fake_dynamodb, "get_item", throttled_head)
+
+        response = events.put_config.put_config_into_dynamo({"region": "us-west-2", "table_name": "Scheduler"})
+
+        assert response['statusCode'] == 200
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        assert dynamodb.retrieve_config_snapshot()[0] == 1
+
+    def test_put_config_rearms_scheduler_rule(self, fake_dynamodb, monkeypatch):
+        class FakeS3:
+            def __init__(self, s3_conn):
+                pass
+
+            def retrieve_data_from_s3_object(self):
+                return json.dumps(config_items(3))
+
+        fake_events = FakeEventsClient()
+        monkeypatch.setattr(automated.s3, "S3", FakeS3)
+        monkeypatch.setattr(automated.eventbridge, "client", lambda *args, **kwargs: fake_events)
+        env_vars = {"region": "us-west-2", "table_name": "Scheduler", "rule_name": "AutomatedSchedulerRule"}
+
+        assert events.put_config.put_config_into_dynamo(env_vars)['statusCode'] == 200
+        # The scheduler runs in the next minute and arms the rule from the new config
+        assert fake_events.rules["AutomatedSchedulerRule"]['State'] == "ENABLED"
+        assert 0 < (fake_events.next_run("AutomatedSchedulerRule") - datetime.utcnow()).total_seconds() <= 60
+
+        # An unchanged config leaves the rule alone
+        events.put_config.put_config_into_dynamo(env_vars)
+        assert fake_events.calls['put_rule'] == 1
@@ -0,0 +1,119 @@
+import json
+import time
+import botocore.exceptions
+import pytest
+import automated.dynamodb
+import automated.s3
+import events.put_config
+import events.retrieve_config
+from util import data
+from tests.fake_aws import FakeDynamoDBClient
+
+
+@pytest.fixture(name="fake_dynamodb")
+def fake_dynamodb_fixture(monkeypatch):
+    fake_dynamodb = FakeDynamoDBClient(page_size=100)
+    for index in range(2500):
+        fake_dynamodb.put_item("", {
+            "pk": {"S": "period"}, "sk": {"S": f"period-{index:05}"},
+            "days_of_week": {"S": "MON-FRI"}, "start_time": {"S": "08:00"}
+        })
+    monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+    return fake_dynamodb
+
+
+class TestRetrieveConfig:
+
+    @pytest.mark.parametrize('total_segments', [1, 4, 7])
+    def test_scan_follows_every_page_of_every_segment(self, fake_dynamodb, total_segments):
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+
+        items = list(dynamodb.scan_items(total_segments=total_segments))
+
+        # Nothing past the first page is dropped and no item is returned twice
+        assert sorted(item['sk']['S'] for item in items) == [f"period-{index:05}" for index in range(2500)]
+        assert fake_dynamodb.calls['scan'] >= 2500 // 100
+
+    def test_segments_scanned_concurrently(self, fake_dynamodb):
+        fake_dynamodb.page_delay = 0.02
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+
+        started = time.monotonic()
+        assert len(dynamodb.retrieve_all_items_from_dynamo()) == 2500
+        elapsed = time.monotonic() - started
+
+        # 25 pages split over 4 segments, sequentially this would take 25 * 0.02 seconds
+        assert elapsed < 25 * 0.02 * 0.6
+
+    def test_consumer_can_stop_early(self, fake_dynamodb):
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        stream = dynamodb.scan_items(total_segments=4)
+
+        assert len([next(stream) for _ in range(10)]) == 10
+        # Closing the stream releases the segment workers blocked on the full queue
+        stream.close()
+
+    def test_segment_error_ends_the_scan(self, fake_dynamodb, monkeypatch):
+        scan = fake_dynamodb.scan
+
+        def failing_scan(**kwargs):
+            if kwargs['Segment'] == 2:
+                raise botocore.exceptions.EndpointConnectionError(
+                    endpoint_url="https://dynamodb.us-west-2.amazonaws.com"
+                )
+            return scan(**kwargs)
+
+        monkeypatch.setattr(fake_dynamodb, "scan", failing_scan)
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+
+        # Reported as a fatal error instead of waiting forever on the failed segment
+        with pytest.raises(SystemExit, match="Could not connect to the endpoint URL"):
+            list(dynamodb.scan_items(total_segments=4))
+        assert dynamodb.errors[0].startswith("Error retrieving all items from DynamoDB: Could not connect")
+
+    def test_config_export(self, fake_dynamodb, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+
+        response = events.retrieve_config.retrieve_dynamo_as_config({"region": "us-west-2", "table_name": "Scheduler"})
+
+        assert response['statusCode'] == 200
+        exported = json.loads((tmp_path / "automated_config.json").read_text())
+        assert len(exported) == 2500
+        assert exported[0] == {"pk": "period", "sk": "period-00000", "days_of_week": "MON-FRI", "start_time": "08:00"}
+        assert response['body']['message'].startswith("[{'pk': 'period', 'sk': 'period-")
+
+    def test_config_export_after_put_config(self, fake_dynamodb, tmp_path, monkeypatch):
+        uploaded = [{"pk": "schedule", "sk": "us_hours", "periods": ["period-00001"], "timezone": "UTC"},
+                    {"pk": "period", "sk": "period-00001", "days_of_week": "MON-FRI", "start_time": "08:00"}]
+
+        class FakeS3:
+            def __init__(self, s3_conn):
+                pass
+
+            def retrieve_data_from_s3_object(self):
+                return json.dumps(uploaded)
+
+        monkeypatch.setattr(automated.s3, "S3", FakeS3)
+        monkeypatch.chdir(tmp_path)
+        env_vars = {"region": "us-west-2", "table_name": "Scheduler"}
+        events.put_config.put_config_into_dynamo(env_vars)
+        dynamodb = automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler")
+        dynamodb.put_inventory_item("111111111111", "us-west-2", "i-001", tag_value="us_hours", override=None)
+        assert {key[0] for key in fake_dynamodb.items} >= {"config", "inventory"}
+
+        response = events.retrieve_config.retrieve_dynamo_as_config(env_vars)
+
+        # The version, snapshot and inventory items stay out of the export
+        assert response['statusCode'] == 200
+        exported = json.loads((tmp_path / "automated_config.json").read_text())
+        assert sorted(exported, key=lambda item: item['pk']) == uploaded[1:] + uploaded[:1]
+
+    @pytest.mark.parametrize('use_pretty_json', [True, False])
+    @pytest.mark.parametrize('items', [[], [{"sk": "a", "periods": {"x"}}], [{"b": 1, "a": [1, 2]}, {"c": None}]])
+    def test_streamed_file_matches_whole_file(self, tmp_path, items, use_pretty_json):
+        data.write_json_to_file(items, file_name=tmp_path / "whole.json", use_pretty_json=use_pretty_json)
+        streamed = list(data.tee_json_to_file(iter(items), file_name=tmp_path / "streamed.json",
+                                              use_pretty_json=use_pretty_json))
+
+        assert streamed == items
+        assert (tmp_path / "streamed.json").read_text() == (tmp_path / "whole.json").read_text()
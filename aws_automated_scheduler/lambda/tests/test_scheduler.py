@@ -0,0 +1,422 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+import events.scheduler
+import automated.clients
+import automated.dynamodb
+import automated.ec2
+import automated.ec2_actions
+import automated.eventbridge
+import automated.sts
+import config
+import util.scheduleconfig
+import util.timeline
+import util.timezones
+from tests.fake_aws import FakeDynamoDBClient, FakeEC2Client, FakeEventsClient, FakeSTSClient, fake_instance
+
+logger = logging.getLogger()
+
+
+class TestScheduler:
+
+    # action, current instance state, should the action be sent
+    reconciliation = [
+        (automated.ec2_actions.START, "stopped", True),
+        (automated.ec2_actions.START, "running", False),
+        (automated.ec2_actions.START, "pending", False),
+        (automated.ec2_actions.START, "stopping", False),
+        (automated.ec2_actions.STOP, "running", True),
+        (automated.ec2_actions.STOP, "stopped", False),
+        (automated.ec2_actions.STOP, "stopping", False),
+        (automated.ec2_actions.STOP, "pending", False),
+        (automated.ec2_actions.START, None, True),
+        (automated.ec2_actions.STOP, None, True),
+        (automated.ec2_actions.NONE, "running", False),
+        (automated.ec2_actions.NONE, "stopped", False),
+    ]
+
+    @pytest.mark.parametrize(('action_type', 'instance_state', 'expected_result'), reconciliation)
+    def test_is_actionable(self, action_type, instance_state, expected_result):
+        assert events.scheduler.is_actionable(action_type, instance_state) == expected_result
+
+    def test_regions_scheduled_concurrently(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(
+            schedules={"us_hours": ["MON-THU"], "uk_hours": ["TUE-SAT"]},
+            periods={"MON-THU": ("MON-THU", "08:00", "18:00"), "TUE-SAT": ("TUE-SAT", "00:30", "01:00")}
+        )
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+
+        regions = ["us-west-2", "us-east-1", "eu-west-1", "ap-southeast-2"]
+        # Discovery of every region waits for all the others, which only returns if they are all in flight at once
+        all_regions_in_flight = threading.Barrier(len(regions), timeout=10)
+
+        def discovery(ec2, tag_key):
+            all_regions_in_flight.wait()
+            return [{"instance_id": f"i-{ec2._region}", "tag": "us_hours", "override": None, "state": "running"}]
+
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", discovery)
+
+        scheduler = events.scheduler.Scheduler(
+            {"region": "us-west-2", "regions": regions, "max_workers": len(regions), "tag_key": "Schedule",
+             "table_name": "Scheduler"}
+        )
+        response = scheduler.automated_schedule()
+
+        assert response['statusCode'] == 200
+        assert not all_regions_in_flight.broken
+        for region in regions:
+            assert any(line.startswith(f"[{region}] Modified instances") for line in response['body']['message'])
+
+    def test_accounts_scheduled_with_bounded_concurrency(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_sts = FakeSTSClient()
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.sts, "client", lambda *args, **kwargs: fake_sts)
+        automated.sts._credentials_cache.clear()
+
+        ec2_clients = []
+
+        def fake_ec2_client(*args, **kwargs):
+            ec2_clients.append(kwargs)
+            return FakeEC2Client([])
+
+        monkeypatch.setattr(automated.ec2, "client", fake_ec2_client)
+
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+
+        def slow_discovery(ec2, tag_key):
+            with lock:
+                in_flight['current'] += 1
+                in_flight['peak'] = max(in_flight['peak'], in_flight['current'])
+            time.sleep(0.05)
+            with lock:
+                in_flight['current'] -= 1
+            return []
+
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", slow_discovery)
+
+        account_roles = [f"arn:aws:iam::{account:012}:role/AutomatedScheduler" for account in range(6)]
+        env_vars = {
+            "region": "us-west-2",
+            "regions": ["us-west-2", "us-east-1"],
+            "account_roles": account_roles,
+            "max_workers": 3,
+            "tag_key": "Schedule",
+            "table_name": "Scheduler"
+        }
+
+        for _ in range(2):
+            response = events.scheduler.Scheduler(env_vars).automated_schedule()
+            assert response['statusCode'] == 200
+
+        # Each role is assumed once, both regions and the second invocation reuse the cached credentials
+        assert fake_sts.calls['assume_role'] == len(account_roles)
+        assert in_flight['peak'] <= 3
+        # One client per account/region pair, the second invocation reuses them
+        assert len(ec2_clients) == len(account_roles) * 2
+        assert {client['aws_access_key_id'] for client in ec2_clients} == \
+            {f"AKIA-{account:012}" for account in range(6)}
+        automated.sts._credentials_cache.clear()
+
+    def test_config_read_once_per_run(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(
+            schedules={"us_hours": ["MON-THU", "FRI"], "uk_hours": ["TUE-SAT", "MISSING"]},
+            periods={"MON-THU": ("MON-THU", "08:00", "18:00"), "FRI": ("FRI", "08:00", "12:00"),
+                     "TUE-SAT": ("TUE-SAT", "00:30", "01:00")}
+        )
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+
+        def discovery(ec2, tag_key):
+            for index in range(500):
+                yield {"instance_id": f"i-{index:04}", "tag": ("us_hours", "uk_hours", "nonexistent")[index % 3],
+                       "override": None, "state": "running"}
+
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", discovery)
+
+        response = events.scheduler.Scheduler(
+            {"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler"}
+        ).automated_schedule()
+
+        # One Query per partition, no matter how many instances share the schedules
+        assert fake_dynamodb.calls['query'] == 2
+        # The config version probe
+        assert fake_dynamodb.calls['get_item'] == 1
+        assert fake_dynamodb.calls['batch_get_item'] == 0
+        # Each broken schedule is reported once rather than once per instance
+        assert response['statusCode'] == 500
+        assert len(response['body']['message']) == 2
+
+    def test_config_cached_across_invocations(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(schedules={"us_hours": ["MON-THU"]},
+                                  periods={"MON-THU": ("MON-THU", "08:00", "18:00")})
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([]))
+        env_vars = {"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler"}
+        stats = util.scheduleconfig.cache_stats()
+
+        def run() -> dict:
+            events.scheduler.Scheduler(env_vars).automated_schedule()
+            current = util.scheduleconfig.cache_stats()
+            return {outcome: current[outcome] - stats[outcome] for outcome in current}
+
+        assert run() == {"hits": 0, "misses": 1, "reloads": 0}
+        assert run() == {"hits": 1, "misses": 1, "reloads": 0}
+        assert fake_dynamodb.calls['query'] == 2
+
+        # A config upload bumps the version
+        automated.dynamodb.DynamoDB(region="us-west-2", table_name="Scheduler").bump_config_version()
+        assert run() == {"hits": 1, "misses": 1, "reloads": 1}
+        assert fake_dynamodb.calls['query'] == 4
+
+        monkeypatch.setattr(config, "CONFIG_CACHE_TTL_SECONDS", 0)
+        assert run() == {"hits": 1, "misses": 1, "reloads": 2}
+
+    def test_clients_reused_across_invocations(self, monkeypatch):
+        created = []
+
+        def fake_client(service_name, **kwargs):
+            created.append(service_name)
+            return {"dynamodb": FakeDynamoDBClient, "sts": FakeSTSClient}.get(service_name, lambda: FakeEC2Client([]))()
+
+        for module in (automated.dynamodb, automated.ec2, automated.sts):
+            monkeypatch.setattr(module, "client", fake_client)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([]))
+        env_vars = {"region": "us-west-2", "regions": ["us-west-2", "us-east-1"], "tag_key": "Schedule",
+                    "table_name": "Scheduler"}
+
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+        assert sorted(created) == ["dynamodb", "ec2", "ec2", "sts"]
+
+        stats = automated.clients.stats()
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+
+        assert len(created) == 4
+        assert automated.clients.stats()['created'] == stats['created']
+        assert automated.clients.stats()['reused'] == stats['reused'] + 4
+
+    def test_each_schedule_evaluated_once(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(
+            schedules={"us_hours": ["MON-THU", "FRI"], "uk_hours": ["TUE-SAT"]},
+            periods={"MON-THU": ("MON-THU", "08:00", "18:00"), "FRI": ("FRI", "08:00", "12:00"),
+                     "TUE-SAT": ("TUE-SAT", "00:30", "01:00")}
+        )
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+
+        def discovery(ec2, tag_key):
+            for index in range(5000):
+                yield {"instance_id": f"i-{index:04}", "tag": ("us_hours", "uk_hours")[index % 2],
+                       "override": None, "state": "running"}
+
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", discovery)
+
+        evaluated_at = []
+        timeline_action = util.timeline.ScheduleTimeline.action
+
+        def counting_action(timeline, weekday, minute_of_day):
+            evaluated_at.append((weekday, minute_of_day))
+            return timeline_action(timeline, weekday, minute_of_day)
+
+        monkeypatch.setattr(util.timeline.ScheduleTimeline, "action", counting_action)
+
+        response = events.scheduler.Scheduler(
+            {"region": "us-west-2", "regions": ["us-west-2", "us-east-1"], "tag_key": "Schedule",
+             "table_name": "Scheduler"}
+        ).automated_schedule()
+
+        assert response['statusCode'] == 200
+        assert "Schedules evaluated: 2" in response['body']['message']
+        # One lookup per schedule, no matter how many instances or regions use them
+        assert len(evaluated_at) == 2
+        # Every schedule is evaluated at the same time
+        assert len(set(evaluated_at)) == 1
+
+    def test_rule_rearmed_for_next_transition(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(
+            schedules={"us_hours": ["MON-FRI"], "uk_hours": ["TUE-SAT"], "unused": ["SUN"]},
+            periods={"MON-FRI": ("MON-FRI", "08:00", "18:00"), "TUE-SAT": ("TUE-SAT", "00:30", "01:00"),
+                     "SUN": ("SUN", "23:00", None)}
+        )
+        fake_events = FakeEventsClient()
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.eventbridge, "client", lambda *args, **kwargs: fake_events)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([
+            {"instance_id": "i-0001", "tag": "us_hours", "override": None, "state": None}
+        ]))
+
+        clock = {"now": datetime(2020, 1, 6, 12, 0, 5)}
+        monkeypatch.setattr(events.scheduler, "utcnow", lambda: clock['now'])
+        env_vars = {"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler",
+                    "rule_name": "AutomatedSchedulerRule"}
+
+        # A week of runs, each one woken up by the rule the previous one armed
+        runs = []
+        while clock['now'] < datetime(2020, 1, 13, 12, 0):
+            response = events.scheduler.Scheduler(env_vars).automated_schedule()
+            assert response['statusCode'] == 200
+            runs.append(clock['now'])
+            clock['now'] = fake_events.next_run("AutomatedSchedulerRule") + timedelta(seconds=5)
+
+        # us_hours starts and stops on 5 days, uk_hours on 5 days, unused starts once. Nothing happens in the 46 hours
+        # from Saturday 01:00 to Sunday 23:00, the rule wakes up once in between after SCHEDULER_MAX_SLEEP_MINUTES
+        assert len(runs) == 1 + 5 * 2 + 5 * 2 + 1 + 1
+        assert datetime(2020, 1, 12, 1, 0, 5) in runs
+        assert runs[1:4] == [datetime(2020, 1, 6, 18, 0, 5), datetime(2020, 1, 7, 0, 30, 5),
+                             datetime(2020, 1, 7, 1, 0, 5)]
+        assert datetime(2020, 1, 12, 23, 0, 5) in runs
+        assert fake_events.calls['put_rule'] == len(runs)
+
+    def test_rule_never_armed_in_the_past(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(schedules={"us_hours": ["MON-FRI"]},
+                                  periods={"MON-FRI": ("MON-FRI", "08:00", "08:01")})
+        fake_events = FakeEventsClient()
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.eventbridge, "client", lambda *args, **kwargs: fake_events)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([]))
+
+        # The run starts before the 08:01 transition and ends after it
+        times = iter([datetime(2020, 1, 6, 8, 0, 50), datetime(2020, 1, 6, 8, 1, 10)])
+        monkeypatch.setattr(events.scheduler, "utcnow", lambda: next(times))
+
+        response = events.scheduler.Scheduler({"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler",
+                                               "rule_name": "AutomatedSchedulerRule"}).automated_schedule()
+
+        assert "Next run: 2020-01-06 08:02:00" in response['body']['message']
+        assert fake_events.next_run("AutomatedSchedulerRule") == datetime(2020, 1, 6, 8, 2)
+
+    def test_rule_sleeps_at_most_max_sleep(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_events = FakeEventsClient()
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.eventbridge, "client", lambda *args, **kwargs: fake_events)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([]))
+        monkeypatch.setattr(events.scheduler, "utcnow", lambda: datetime(2020, 1, 6, 8, 0, 30))
+        monkeypatch.setattr(config, "SCHEDULER_MAX_SLEEP_MINUTES", 90)
+        env_vars = {"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler",
+                    "rule_name": "AutomatedSchedulerRule"}
+
+        events.scheduler.Scheduler(env_vars).automated_schedule()
+        assert fake_events.rules["AutomatedSchedulerRule"] == {"ScheduleExpression": "cron(30 9 6 1 ? 2020)",
+                                                               "State": "ENABLED"}
+
+        # Configured by the stack along with its heartbeat rule
+        events.scheduler.Scheduler({**env_vars, "max_sleep_minutes": 45}).automated_schedule()
+        assert fake_events.rules["AutomatedSchedulerRule"]['ScheduleExpression'] == "cron(45 8 6 1 ? 2020)"
+
+    @pytest.mark.parametrize(('instance_state', 'stop_errors'), [("pending", 0), ("running", 2)])
+    def test_rule_rearmed_for_retry(self, monkeypatch, instance_state, stop_errors):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(schedules={"us_hours": ["MON-FRI"]},
+                                  periods={"MON-FRI": ("MON-FRI", "08:00", "18:00")})
+        fake_events = FakeEventsClient()
+        fake_ec2 = FakeEC2Client([fake_instance("i-0001", schedule="us_hours", state=instance_state)])
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        monkeypatch.setattr(automated.eventbridge, "client", lambda *args, **kwargs: fake_events)
+        monkeypatch.setattr(automated.ec2, "client", lambda *args, **kwargs: fake_ec2)
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([
+            {"instance_id": "i-0001", "tag": "us_hours", "override": None,
+             "state": fake_ec2.instances[0]['State']['Name']}
+        ]))
+        monkeypatch.setattr(events.scheduler, "utcnow", lambda: datetime(2020, 1, 6, 18, 0, 5))
+        monkeypatch.setattr(config, "API_MAX_ATTEMPTS", 2)
+        env_vars = {"region": "us-west-2", "tag_key": "Schedule", "table_name": "Scheduler",
+                    "rule_name": "AutomatedSchedulerRule"}
+
+        def run():
+            scheduler = events.scheduler.Scheduler(env_vars)
+            # Send the stop actions to the fake client
+            scheduler._test_run = False
+            return scheduler.automated_schedule()
+
+        # At the stop time of us_hours the instance is still starting, or every attempt to stop it is throttled
+        fake_ec2.inject_errors("StopInstances", "RequestLimitExceeded", stop_errors)
+        response = run()
+        assert response['statusCode'] == (500 if stop_errors else 200)
+        # Checked again the next minute instead of at the 08:00 start on Tuesday
+        assert fake_events.next_run("AutomatedSchedulerRule") == datetime(2020, 1, 6, 18, 1)
+
+        # Stopped on the retry, the rule goes back to sleeping until the next transition
+        fake_ec2.instances[0]['State']['Name'] = "running"
+        response = run()
+        assert response['statusCode'] == 200
+        assert fake_ec2.instances[0]['State']['Name'] != "running"
+        assert fake_events.next_run("AutomatedSchedulerRule") == datetime(2020, 1, 7, 8, 0)
+
+    def test_schedules_evaluated_on_their_wall_clock(self, monkeypatch):
+        fake_dynamodb = FakeDynamoDBClient()
+        fake_dynamodb.load_config(
+            schedules={"new_york": ["office"], "chicago": ["office"], "london": ["office"], "sydney": ["office"],
+                       "tokyo": ["office"], "utc": ["office"], "broken": ["office"]},
+            periods={"office": ("MON-FRI", "08:00", "18:00")},
+            timezones={"new_york": "America/New_York", "chicago": "America/Chicago", "london": "Europe/London",
+                       "sydney": "Australia/Sydney", "tokyo": "Asia/Tokyo", "utc": "UTC", "broken": "America/Nowhere"}
+        )
+        monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+        # Monday 13:30 UTC: 09:30 in New York (EDT), 08:30 in Chicago, 13:30 in London (GMT), 22:30 in Tokyo and
+        # already Tuesday 00:30 in Sydney (AEDT)
+        monkeypatch.setattr(events.scheduler, "utcnow", lambda: datetime(2021, 3, 15, 13, 30))
+
+        schedules = ["new_york", "chicago", "london", "sydney", "tokyo", "utc", "broken"]
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([
+            {"instance_id": f"i-{index:04}", "tag": schedules[index % len(schedules)], "override": None,
+             "state": "running"} for index in range(700)
+        ]))
+
+        zones_built = []
+        zone_offsets = util.timezones.ZoneOffsets
+
+        def counting_zone_offsets(timezone_name, around):
+            zones_built.append(timezone_name)
+            return zone_offsets(timezone_name, around)
+
+        monkeypatch.setattr(util.timezones, "ZoneOffsets", counting_zone_offsets)
+
+        scheduler = events.scheduler.Scheduler({"region": "us-west-2", "regions": ["us-west-2", "us-east-1"],
+                                                "tag_key": "Schedule", "table_name": "Scheduler"})
+        response = scheduler.automated_schedule()
+
+        assert {schedule: scheduler.schedule_action(schedule) for schedule in schedules} == {
+            "new_york": automated.ec2_actions.START, "chicago": automated.ec2_actions.START,
+            "london": automated.ec2_actions.START, "sydney": automated.ec2_actions.NONE,
+            "tokyo": automated.ec2_actions.STOP, "utc": automated.ec2_actions.START,
+            "broken": automated.ec2_actions.NONE
+        }
+        # The wall clock of each zone is worked out once per run
+        assert sorted(zones_built) == sorted(["America/New_York", "America/Chicago", "Europe/London",
+                                              "Australia/Sydney", "Asia/Tokyo", "UTC", "America/Nowhere"])
+        assert response['statusCode'] == 500
+        assert len(response['body']['message']) == 1
+        assert "America/Nowhere" in response['body']['message'][0]
+
+    def test_overlapping_periods_in_any_order(self, monkeypatch):
+        # Weekday office hours, a Friday half day and an overnight batch window from Sunday into Monday
+        periods = {"office": ("MON-FRI", "08:00", "18:00"), "half_day": ("FRI", "08:00", "12:00"),
+                   "batch": ("SUN", "22:00", "02:00")}
+        monkeypatch.setattr(automated.ec2.EC2, "get_instances_from_tag_key", lambda ec2, tag_key: iter([]))
+        actions = {}
+
+        for order in (["office", "half_day", "batch"], ["half_day", "batch", "office"]):
+            fake_dynamodb = FakeDynamoDBClient()
+            fake_dynamodb.load_config(schedules={"mixed": order}, periods=periods)
+            monkeypatch.setattr(automated.dynamodb, "client", lambda *args, **kwargs: fake_dynamodb)
+            util.scheduleconfig._cache.update(schedules=None)
+
+            for now in (datetime(2020, 1, 10, 14, 0), datetime(2020, 1, 13, 1, 0), datetime(2020, 1, 13, 3, 0)):
+                monkeypatch.setattr(events.scheduler, "utcnow", lambda: now)
+                scheduler = events.scheduler.Scheduler({"region": "us-west-2", "tag_key": "Schedule",
+                                                        "table_name": "Scheduler"})
+                scheduler.automated_schedule()
+                actions.setdefault(tuple(order), []).append(scheduler.schedule_action("mixed"))
+
+        # Friday 14:00 the 12:00 stop of the half day ends the office hours started before it, Monday 01:00 is
+        # inside the batch window carried over from Sunday, which stops it at 02:00
+        assert list(actions.values()) == [[automated.ec2_actions.STOP, automated.ec2_actions.START,
+                                           automated.ec2_actions.STOP]] * 2
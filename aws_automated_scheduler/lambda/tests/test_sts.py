@@ -0,0 +1,47 @@
+import logging
+import pytest
+import automated.sts
+from datetime import timedelta
+from tests.fake_aws import FakeSTSClient
+
+logger = logging.getLogger()
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/AutomatedScheduler"
+
+
+@pytest.fixture(name="fake_sts")
+def fake_sts_fixture(monkeypatch):
+    fake_sts = FakeSTSClient()
+    monkeypatch.setattr(automated.sts, "client", lambda *args, **kwargs: fake_sts)
+    automated.sts._credentials_cache.clear()
+    yield fake_sts
+    automated.sts._credentials_cache.clear()
+
+
+class TestSTS:
+
+    def test_credentials_cached_across_invocations(self, fake_sts):
+        credentials = automated.sts.STS(region="us-west-2").get_credentials(ROLE_ARN)
+        # A new STS object, as created by a later warm invocation, reuses the cached credentials
+        cached_credentials = automated.sts.STS(region="us-west-2").get_credentials(ROLE_ARN)
+
+        assert cached_credentials is credentials
+        assert credentials['AccessKeyId'] == "AKIA-123456789012"
+        assert fake_sts.calls['assume_role'] == 1
+
+    def test_expiring_credentials_refreshed(self, fake_sts):
+        fake_sts.credential_lifetime = timedelta(seconds=60)
+        sts = automated.sts.STS(region="us-west-2")
+
+        sts.get_credentials(ROLE_ARN)
+        sts.get_credentials(ROLE_ARN)
+
+        assert fake_sts.calls['assume_role'] == 2
+
+    @pytest.mark.parametrize(('role_arn', 'expected_result'), [
+        (ROLE_ARN, "123456789012"),
+        ("arn:aws:iam::000000000001:role/path/Role", "000000000001"),
+        ("not-an-arn", "not-an-arn"),
+    ])
+    def test_account_id_from_role_arn(self, role_arn, expected_result):
+        assert automated.sts.account_id_from_role_arn(role_arn) == expected_result
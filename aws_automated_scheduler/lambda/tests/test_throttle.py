@@ -0,0 +1,122 @@
+import time
+import pytest
+import automated.clients
+import automated.ec2
+import automated.ec2_actions
+import automated.exceptions
+import automated.throttle as throttle
+import config
+from tests.fake_aws import FakeEC2Client, client_error, fake_instance
+
+
+class FakeContext:
+    def __init__(self, remaining_millis: int):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters(monkeypatch):
+    monkeypatch.setattr(config, "API_BACKOFF_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(config, "API_BACKOFF_CAP_SECONDS", 0.01)
+    for api_family, rate, burst in ((throttle.DESCRIBE, 20.0, 100), (throttle.MUTATE, 5.0, 50)):
+        monkeypatch.setitem(throttle._limiters, api_family, throttle.AdaptiveRateLimiter(
+            # A high floor keeps the waits of tests that throttle repeatedly short
+            name=api_family, rate=rate, burst=burst, min_rate=rate / 4, max_rate=rate
+        ))
+    throttle.start_invocation({})
+    yield
+    throttle.start_invocation({})
+
+
+def fake_ec2(instances: list) -> tuple:
+    fake_client = FakeEC2Client(instances)
+    ec2 = automated.ec2.EC2(region="us-west-2", ec2_conn=config.EC2_CONN_LOCAL, page_size=10)
+    ec2._EC2__ec2 = fake_client
+    return ec2, fake_client
+
+
+class TestThrottle:
+
+    def test_rate_decreases_on_throttle_and_recovers(self):
+        limiter = throttle.AdaptiveRateLimiter(name="test", rate=8.0, burst=10, min_rate=1.0, max_rate=8.0)
+
+        limiter.on_throttle()
+        assert limiter.rate == 8.0 * config.RATE_LIMIT_DECREASE_FACTOR
+        for _ in range(3):
+            limiter.on_throttle()
+        assert limiter.rate == 1.0
+
+        for _ in range(100):
+            limiter.on_success()
+        assert limiter.rate == 8.0
+
+    def test_throttled_discovery_is_retried(self):
+        ec2, fake_client = fake_ec2([fake_instance(f"i-{index:04}", schedule="us_hours") for index in range(25)])
+        fake_client.inject_errors("describe_instances", "RequestLimitExceeded", 2)
+
+        projected_instances = ec2._retrieve_all_instances_with_tag_key("Schedule")
+        instance_list = list(ec2._retrieve_instance_id_and_schedule_tag_info(projected_instances, "Schedule"))
+
+        assert len(instance_list) == 25
+        # 3 pages plus the 2 throttled attempts
+        assert fake_client.calls['describe_instances'] == 5
+        assert throttle.stats()['throttles'] == 2
+        assert throttle.stats()['retries'] == 2
+        assert throttle._limiters[throttle.DESCRIBE].rate < 20.0
+        # Mutating calls have their own bucket
+        assert throttle._limiters[throttle.MUTATE].rate == 5.0
+
+    @pytest.mark.parametrize(('error_code', 'expected_calls'), [
+        ("RequestLimitExceeded", 2),
+        ("InternalError", 2),
+        ("UnauthorizedOperation", 1),
+    ])
+    def test_only_throttled_and_transient_errors_are_retried(self, error_code, expected_calls):
+        ec2, fake_client = fake_ec2([fake_instance("i-0001", schedule="us_hours", state="stopped")])
+        fake_client.inject_errors("StartInstances", error_code, 1)
+
+        transitions = ec2.perform_batch_action(automated.ec2_actions.START, ["i-0001"])
+
+        assert fake_client.calls['StartInstances'] == expected_calls
+        assert len(transitions) == expected_calls - 1
+
+    def test_exhausted_retries_are_reported_not_fatal(self, monkeypatch):
+        monkeypatch.setattr(config, "API_MAX_ATTEMPTS", 3)
+        ec2, fake_client = fake_ec2([fake_instance("i-0001", schedule="us_hours")])
+        fake_client.inject_errors("StopInstances", "RequestLimitExceeded", config.API_MAX_ATTEMPTS)
+
+        transitions = ec2.perform_batch_action(automated.ec2_actions.STOP, ["i-0001"])
+
+        assert transitions == []
+        assert fake_client.calls['StopInstances'] == config.API_MAX_ATTEMPTS
+        assert len(ec2.errors) == 1
+
+    def test_waits_stop_at_deadline(self):
+        limiter = throttle.AdaptiveRateLimiter(name="test", rate=1.0, burst=1, min_rate=1.0, max_rate=1.0)
+        throttle.start_invocation(FakeContext(remaining_millis=int(config.DEADLINE_MARGIN_SECONDS * 1000) + 200))
+
+        assert limiter.acquire() == 0.0
+        # The next token is a second away but only ~0.2 seconds are left
+        with pytest.raises(automated.exceptions.DeadlineExceeded):
+            limiter.acquire()
+
+    def test_calls_are_paced_by_rate(self):
+        limiter = throttle.AdaptiveRateLimiter(name="test", rate=50.0, burst=1, min_rate=1.0, max_rate=50.0)
+
+        waited = sum(limiter.acquire() for _ in range(6))
+
+        assert waited == pytest.approx(0.1, abs=0.03)
+
+    def test_client_read_timeout_set_by_function_timeout(self, monkeypatch):
+        throttle.start_invocation(FakeContext(remaining_millis=5000))
+        # The client is built late in the invocation, with well under a second left
+        monkeypatch.setattr(throttle, "_deadline", time.monotonic() + 0.2)
+
+        # Clients outlive the invocation, they get the time of a whole invocation whenever they are built
+        assert automated.clients.connection_config().read_timeout == 5 - config.DEADLINE_MARGIN_SECONDS
+
+        throttle.start_invocation({})
+        assert automated.clients.connection_config().read_timeout == config.CLIENT_READ_TIMEOUT_SECONDS
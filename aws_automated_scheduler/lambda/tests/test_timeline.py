@@ -0,0 +1,114 @@
+import itertools
+import logging
+import random
+import time
+import pytest
+import automated.ec2_actions
+import tests.schedule_reference as schedule_reference
+import util.evalperiod
+import util.timeline
+
+logger = logging.getLogger()
+
+START, STOP, NONE = automated.ec2_actions.START, automated.ec2_actions.STOP, automated.ec2_actions.NONE
+DAY = util.timeline.MINUTES_PER_DAY
+
+
+def compiled(days_of_week: str, start_time: str = None, stop_time: str = None) -> util.evalperiod.CompiledPeriod:
+    return util.evalperiod.CompiledPeriod.compile(
+        {"sk": f"{days_of_week}-{start_time}-{stop_time}", "days_of_week": days_of_week, "start_time": start_time,
+         "stop_time": stop_time}
+    )
+
+
+def loop_action(periods: list, minute_of_week: int) -> str:
+    return schedule_reference.schedule_action(periods, minute_of_week // DAY, minute_of_week % DAY)
+
+
+class TestTimeline:
+
+    # periods, expected intervals of the week
+    timelines = [
+        ([compiled("MON", "08:00", "18:00")],
+         [(0, 480, NONE), (480, 1080, START), (1080, DAY, STOP), (DAY, 7 * DAY, NONE)]),
+        # Wraps around the end of the week
+        ([compiled("SAT-TUE", "08:00")],
+         [(0, 480, NONE), (480, DAY, START), (DAY, DAY + 480, NONE), (DAY + 480, 2 * DAY, START),
+          (2 * DAY, 5 * DAY + 480, NONE), (5 * DAY + 480, 6 * DAY, START), (6 * DAY, 6 * DAY + 480, NONE),
+          (6 * DAY + 480, 7 * DAY, START)]),
+        # Overnight from Sunday into Monday
+        ([compiled("SUN", "22:00", "02:00")],
+         [(0, 120, START), (120, DAY, STOP), (DAY, 6 * DAY + 1320, NONE), (6 * DAY + 1320, 7 * DAY, START)]),
+        # A 00:00 stop is the end of the day
+        ([compiled("WED", "08:00", "00:00")],
+         [(0, 2 * DAY + 480, NONE), (2 * DAY + 480, 3 * DAY, START), (3 * DAY, 4 * DAY, STOP),
+          (4 * DAY, 7 * DAY, NONE)]),
+        # Where periods overlap the action that began last wins, start over stop when they began at the same minute,
+        # touching intervals of the same action are merged
+        ([compiled("MON", "08:00", "12:00"), compiled("MON", "10:00", "18:00"), compiled("MON", "18:00", "20:00")],
+         [(0, 480, NONE), (480, 720, START), (720, 1080, STOP), (1080, 1200, START), (1200, DAY, STOP),
+          (DAY, 7 * DAY, NONE)]),
+        # A stop only period ends the start of a start only period
+        ([compiled("MON", "08:00"), compiled("MON", stop_time="18:00")],
+         [(0, 480, NONE), (480, 1080, START), (1080, DAY, STOP), (DAY, 7 * DAY, NONE)]),
+        # An overnight start carried over into Monday began on the Sunday before, a Monday stop ends it
+        ([compiled("SUN", "22:00", "06:00"), compiled("MON", "01:00", "04:00")],
+         [(0, 240, START), (240, DAY, STOP), (DAY, 6 * DAY + 1320, NONE), (6 * DAY + 1320, 7 * DAY, START)]),
+        # No periods, no days
+        ([], [(0, 7 * DAY, NONE)]),
+        ([compiled("", "08:00", "18:00")], [(0, 7 * DAY, NONE)]),
+    ]
+
+    @pytest.mark.parametrize(('periods', 'expected_intervals'), timelines)
+    def test_intervals(self, periods, expected_intervals):
+        timeline = util.timeline.ScheduleTimeline.build(periods)
+
+        assert timeline.intervals() == expected_intervals
+        for minute in range(0, 7 * DAY, 7):
+            assert timeline.action_at(minute) == loop_action(periods, minute)
+
+    def test_same_week_in_any_order(self):
+        rng = random.Random(7)
+        days = ["MON-FRI", "SAT-TUE", "FRI-MON", "WED", "SUN", "THU,SAT"]
+        times = [None, "00:00", "02:00", "08:00", "12:30", "18:00", "22:00", "24:00"]
+
+        for _ in range(200):
+            periods = [compiled(rng.choice(days), rng.choice(times), rng.choice(times))
+                       for _ in range(rng.randrange(1, 5))]
+            timelines = [util.timeline.ScheduleTimeline.build(list(order)) for order in itertools.permutations(periods)]
+
+            # Sorted, non-overlapping, covering the week, with no two neighbours alike
+            intervals = timelines[0].intervals()
+            assert intervals[0][0] == 0 and intervals[-1][1] == 7 * DAY
+            assert all(current[1] == following[0] and current[2] != following[2]
+                       for current, following in zip(intervals, intervals[1:]))
+            assert all(timeline.intervals() == intervals for timeline in timelines)
+
+            for minute in range(0, 7 * DAY, 11):
+                assert timelines[0].action_at(minute) == loop_action(periods, minute)
+
+    def test_transitions(self):
+        timeline = util.timeline.ScheduleTimeline.build([compiled("MON-TUE", "08:00", "18:00")])
+        assert timeline.transitions() == [480, 1080, DAY + 480, DAY + 1080]
+
+    def test_benchmark_lookup(self):
+        periods = [compiled(days, f"{hour:02}:00", f"{hour + 8:02}:30")
+                   for hour, days in zip(range(0, 15), itertools.cycle(["MON-FRI", "SAT-TUE", "WED", "FRI-MON"]))]
+        timeline = util.timeline.ScheduleTimeline.build(periods)
+        minutes = list(range(0, 7 * DAY, 13))
+
+        started = time.perf_counter()
+        for _ in range(20):
+            for minute in minutes:
+                timeline.action_at(minute)
+        timeline_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(20):
+            for minute in minutes:
+                loop_action(periods, minute)
+        loop_seconds = time.perf_counter() - started
+
+        logger.info(f"[{20 * len(minutes)}] lookups of a schedule with [{len(periods)}] periods: timeline "
+                    f"[{timeline_seconds:.3f}] seconds, loop over periods [{loop_seconds:.3f}] seconds")
+        assert timeline_seconds < loop_seconds
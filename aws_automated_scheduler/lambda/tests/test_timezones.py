@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+import zoneinfo
+import pytest
+import automated.ec2_actions
+import util.evalperiod
+import util.timezones
+import util.transitions
+
+
+def real_local(timezone_name: str, utc: datetime) -> datetime:
+    return utc.replace(tzinfo=timezone.utc).astimezone(zoneinfo.ZoneInfo(timezone_name)).replace(tzinfo=None)
+
+
+class TestTimezones:
+
+    # zone, UTC instant of the change, wall clock before -> after the change
+    dst_changes = [
+        # Spring forward
+        ("America/New_York", datetime(2021, 3, 14, 7, 0), datetime(2021, 3, 14, 1, 59), datetime(2021, 3, 14, 3, 0)),
+        ("Europe/London", datetime(2021, 3, 28, 1, 0), datetime(2021, 3, 28, 0, 59), datetime(2021, 3, 28, 2, 0)),
+        ("Australia/Sydney", datetime(2021, 10, 2, 16, 0), datetime(2021, 10, 3, 1, 59), datetime(2021, 10, 3, 3, 0)),
+        # Fall back
+        ("America/New_York", datetime(2021, 11, 7, 6, 0), datetime(2021, 11, 7, 1, 59), datetime(2021, 11, 7, 1, 0)),
+        ("Europe/London", datetime(2021, 10, 31, 1, 0), datetime(2021, 10, 31, 1, 59), datetime(2021, 10, 31, 1, 0)),
+        ("Australia/Sydney", datetime(2021, 4, 3, 16, 0), datetime(2021, 4, 4, 2, 59), datetime(2021, 4, 4, 2, 0)),
+        # Half hour change
+        ("Australia/Lord_Howe", datetime(2021, 4, 3, 15, 0), datetime(2021, 4, 4, 1, 59), datetime(2021, 4, 4, 1, 30)),
+    ]
+
+    @pytest.mark.parametrize(('timezone_name', 'changed_at', 'local_before', 'local_after'), dst_changes)
+    def test_offset_table(self, timezone_name, changed_at, local_before, local_after):
+        zone = util.timezones.ZoneOffsets(timezone_name, around=changed_at - timedelta(hours=20))
+
+        assert changed_at in zone.boundaries
+        assert zone.local(changed_at - timedelta(minutes=1)) == local_before
+        assert zone.local(changed_at) == local_after
+        for minute in range(-6 * 60, 6 * 60):
+            utc = changed_at + timedelta(minutes=minute)
+            assert zone.local(utc) == real_local(timezone_name, utc)
+
+    @pytest.mark.parametrize(('timezone_name', 'changed_at', 'local_before', 'local_after'), dst_changes)
+    def test_to_utc(self, timezone_name, changed_at, local_before, local_after):
+        zone = util.timezones.ZoneOffsets(timezone_name, around=changed_at)
+
+        for minute in range(-6 * 60, 6 * 60):
+            utc = changed_at + timedelta(minutes=minute)
+            # Each wall clock time maps back to the first instant showing it
+            assert zone.local(zone.to_utc(zone.local(utc))) == zone.local(utc)
+            assert zone.to_utc(zone.local(utc)) <= utc
+
+        if local_after > local_before:
+            # Every wall clock time skipped by the change maps to the instant of the change
+            for minute in range(1, int((local_after - local_before).total_seconds() // 60)):
+                assert zone.to_utc(local_before + timedelta(minutes=minute)) == changed_at
+        else:
+            # Repeated wall clock times map to their first occurrence
+            assert zone.to_utc(local_after) == changed_at - (local_before - local_after) - timedelta(minutes=1)
+
+    def test_unknown_timezone(self):
+        with pytest.raises(ValueError, match="Unknown timezone"):
+            util.timezones.ZoneOffsets("Mars/Olympus_Mons", around=datetime(2021, 1, 1))
+
+        assert util.timezones.ZoneOffsets(None, around=datetime(2021, 1, 1)).offsets == [timedelta(0)]
+
+    # zone, UTC time of the run, expected action of a MON-SUN 02:30 - 23:00 period
+    period_actions = [
+        # 01:59 EST, then 03:00 EDT which is past the skipped 02:30 start
+        ("America/New_York", datetime(2021, 3, 14, 6, 59), automated.ec2_actions.NONE),
+        ("America/New_York", datetime(2021, 3, 14, 7, 0), automated.ec2_actions.START),
+        # 01:30 EST after falling back from 01:59 EDT, then 02:30 EST
+        ("America/New_York", datetime(2021, 11, 7, 6, 30), automated.ec2_actions.NONE),
+        ("America/New_York", datetime(2021, 11, 7, 7, 29), automated.ec2_actions.NONE),
+        ("America/New_York", datetime(2021, 11, 7, 7, 30), automated.ec2_actions.START),
+        ("Europe/London", datetime(2021, 10, 31, 1, 30), automated.ec2_actions.NONE),
+        ("Europe/London", datetime(2021, 10, 31, 2, 30), automated.ec2_actions.START),
+        ("Australia/Sydney", datetime(2021, 10, 2, 15, 59), automated.ec2_actions.NONE),
+        ("Australia/Sydney", datetime(2021, 10, 2, 16, 0), automated.ec2_actions.START),
+        # 23:59 AEDT
+        ("Australia/Sydney", datetime(2021, 4, 3, 12, 59), automated.ec2_actions.STOP),
+    ]
+
+    @pytest.mark.parametrize(('timezone_name', 'utc', 'expected_result'), period_actions)
+    def test_period_on_wall_clock(self, timezone_name, utc, expected_result):
+        period = util.evalperiod.CompiledPeriod.compile(
+            {"sk": "daily", "days_of_week": "MON-SUN", "start_time": "02:30", "stop_time": "23:00"}
+        )
+        zone = util.timezones.ZoneOffsets(timezone_name, around=utc)
+
+        assert util.evalperiod.EvalPeriod().eval_period(period, override_time=zone.local(utc)) == expected_result
+
+    def test_calendar_across_dst_changes(self):
+        period = util.evalperiod.CompiledPeriod.compile(
+            {"sk": "daily", "days_of_week": "MON-SUN", "start_time": "02:30", "stop_time": "23:00"}
+        )
+        now = datetime(2021, 3, 13, 12, 0)
+        zones = {name: util.timezones.ZoneOffsets(name, around=now) for name in ("America/New_York", "Europe/London")}
+        calendar = util.transitions.TransitionCalendar({name: [period] for name in zones}, zones)
+
+        upcoming = []
+        for instant, name in calendar.upcoming(now):
+            if instant > datetime(2021, 3, 15):
+                break
+            upcoming.append((instant, name))
+
+        assert upcoming == [
+            # 23:00 in London (GMT) and New York (EST)
+            (datetime(2021, 3, 13, 23, 0), "Europe/London"),
+            (datetime(2021, 3, 14, 2, 30), "Europe/London"),
+            (datetime(2021, 3, 14, 4, 0), "America/New_York"),
+            # 02:30 does not exist in New York that night, the start is run when the clock jumps to 03:00 EDT
+            (datetime(2021, 3, 14, 7, 0), "America/New_York"),
+            (datetime(2021, 3, 14, 23, 0), "Europe/London"),
+        ]
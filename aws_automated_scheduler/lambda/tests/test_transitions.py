@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+import pytest
+import automated.ec2_actions
+import tests.schedule_reference as schedule_reference
+import util.evalperiod
+import util.transitions
+
+
+def compiled(days_of_week: str, start_time: str = None, stop_time: str = None) -> util.evalperiod.CompiledPeriod:
+    return util.evalperiod.CompiledPeriod.compile(
+        {"sk": days_of_week, "days_of_week": days_of_week, "start_time": start_time, "stop_time": stop_time}
+    )
+
+
+def schedule_action(periods: list, instant: datetime) -> str:
+    return schedule_reference.schedule_action(periods, instant.weekday(), instant.hour * 60 + instant.minute)
+
+
+class TestTransitions:
+
+    schedules = {
+        "us_hours": [compiled("MON-FRI", "08:00", "18:00")],
+        "uk_hours": [compiled("TUE-SAT", "00:30", "01:00"), compiled("SUN", stop_time="12:00")],
+        "weekend": [compiled("SAT-SUN", "10:00")],
+        "never": [compiled("MON")],
+    }
+
+    # now, expected next transition, schedules changing then
+    next_transitions = [
+        (datetime(2020, 1, 6, 7, 59, 59), datetime(2020, 1, 6, 8, 0), ["us_hours"]),
+        # The transition of the current minute has been run already
+        (datetime(2020, 1, 6, 8, 0, 30), datetime(2020, 1, 6, 18, 0), ["us_hours"]),
+        (datetime(2020, 1, 7, 0, 0), datetime(2020, 1, 7, 0, 30), ["uk_hours"]),
+        (datetime(2020, 1, 10, 18, 0), datetime(2020, 1, 11, 0, 30), ["uk_hours"]),
+        (datetime(2020, 1, 11, 1, 0), datetime(2020, 1, 11, 10, 0), ["weekend"]),
+        # Wraps around to Monday of the next week
+        (datetime(2020, 1, 12, 12, 0), datetime(2020, 1, 13, 8, 0), ["us_hours"]),
+    ]
+
+    @pytest.mark.parametrize(('now', 'expected_transition', 'expected_schedules'), next_transitions)
+    def test_next_transition(self, now, expected_transition, expected_schedules):
+        calendar = util.transitions.TransitionCalendar(self.schedules)
+        assert calendar.next_transition(now) == (expected_transition, expected_schedules)
+
+    def test_transitions_at_same_instant(self):
+        calendar = util.transitions.TransitionCalendar({
+            "a": [compiled("MON", "08:00")], "b": [compiled("MON-TUE", "08:00", "09:00")], "c": [compiled("TUE")]
+        })
+
+        assert len(calendar) == 2
+        assert calendar.next_transition(datetime(2020, 1, 6)) == (datetime(2020, 1, 6, 8, 0), ["a", "b"])
+
+    def test_no_transitions(self):
+        calendar = util.transitions.TransitionCalendar({"never": [compiled("", "08:00")], "empty": []})
+
+        assert len(calendar) == 0
+        assert calendar.next_transition(datetime(2020, 1, 6)) == (None, [])
+
+    def test_every_action_change_is_a_transition(self):
+        calendar = util.transitions.TransitionCalendar(self.schedules)
+        now = datetime(2020, 1, 8, 13, 7)
+        # Two weeks of the calendar against the action of every schedule at every minute
+        upcoming = []
+        for instant, name in calendar.upcoming(now):
+            if instant > now + timedelta(weeks=2):
+                break
+            upcoming.append((instant, name))
+        transitions = set(upcoming)
+
+        assert [instant for instant, _ in upcoming] == sorted(instant for instant, _ in upcoming)
+        assert len(transitions) == len(upcoming)
+
+        for name, periods in self.schedules.items():
+            previous_action = schedule_action(periods, now)
+            for minute in range(1, 2 * 7 * 24 * 60 + 1):
+                instant = now + timedelta(minutes=minute)
+                action = schedule_action(periods, instant)
+                if action != previous_action and action is not automated.ec2_actions.NONE:
+                    assert (instant, name) in transitions
+                previous_action = action
+
+        assert len([name for _, name in transitions if name == "us_hours"]) == 2 * 5 * 2
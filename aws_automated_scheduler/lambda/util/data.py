@@ -1,6 +1,8 @@
 import decimal
+import hashlib
 import logging
 import json
+import textwrap
 import config
 import automated.exceptions
 import events.http_response as http_response
@@ -33,6 +35,33 @@ def validate_json(s3_object_data: str) -> list:
     return valid_json
 
 
+# DynamoDB attribute type of the attributes every scheduler item is made of. These are converted directly, any other
+# attribute, or a known attribute holding an unexpected type, goes through the generic boto3 (de)serializer
+ITEM_SCHEMA = {
+    "pk": "S",
+    "sk": "S",
+    # schedule
+    "periods": "SS",
+    "timezone": "S",
+    # period
+    "days_of_week": "S",
+    "start_time": "S",
+    "stop_time": "S",
+    # inventory
+    "tag": "S",
+    "override": "S",
+    "state": "S",
+    "region": "S",
+    "account": "S"
+}
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# DynamoDB set types, their members are unordered
+_SET_TYPES = ("SS", "NS", "BS")
+
+
 def convert_json_to_dynamo_json(input_json: list) -> list:
     """
     Re-Serializes the data into DynamoDB compatible JSON that can be used to put items into the dynamo table
@@ -42,28 +71,23 @@ def convert_json_to_dynamo_json(input_json: list) -> list:
     # I am choosing to go with DynamoDB attribute string sets, because I do not want duplicate entries for periods,
     # and it is easier to parse visually. The only drawback I have seen so far is that sets are unordered,
     # but since we are not evaluating the period string set responses in any particular order that should not matter.
-    # Can we change this to use cls instead of for loops?
-
-    serializer = TypeSerializer()
-    py_data, json_data = [], []
 
     logger.info(f"Converting JSON config to DynamoDB compatible JSON.")
 
-    # Loop through JSON file data looking for Python object type list
-    # Convert the list object into a set of strings
-    # Store new data types as python object
-    for data in input_json:
-        for k, v in data.items():
-            if isinstance(v, list):
-                data[k] = set(v)
-        py_data.append(data)
+    return [{k: _serialize_attribute(k, v) for k, v in data.items()} for data in input_json]
+
 
-    # Serialize previously modified python object data into DynamoDB JSON
-    for data in py_data:
-        dynamo_data = {k: serializer.serialize(v) for k, v in data.items()}
-        json_data.append(dynamo_data)
+def _serialize_attribute(name: str, value) -> dict:
+    type_tag = ITEM_SCHEMA.get(name)
 
-    return json_data
+    if type_tag == "S" and isinstance(value, str):
+        return {"S": value}
+
+    if type_tag == "SS" and isinstance(value, (list, set)) and value and all(isinstance(v, str) for v in value):
+        return {"SS": list(dict.fromkeys(value))}
+
+    # Lists in the config are stored as sets, see above
+    return _serializer.serialize(set(value) if isinstance(value, list) else value)
 
 
 def convert_dynamo_json_to_py_data(input_json: list) -> list:
@@ -72,16 +96,75 @@ def convert_dynamo_json_to_py_data(input_json: list) -> list:
     :param input_json: DynamoDB compatible JSON with included attributes
     :return: py_data: DynamoDB incompatible JSON with removed attributes
     """
-    py_data = []
-    deserializer = TypeDeserializer()
-    for item in input_json:
-        json_data = {k: deserializer.deserialize(v) for k, v in item.items()}
-        py_data.append(json_data)
+    py_data = [convert_dynamo_item_to_py_data(item) for item in input_json]
 
-    logger.debug(f"Stripped attributes result: {py_data}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Stripped attributes result: {py_data}")
     return py_data
 
 
+def convert_dynamo_item_to_py_data(item: dict) -> dict:
+    """
+    Single item version of convert_dynamo_json_to_py_data, for converting a stream of items one at a time
+    :param item: DynamoDB item with included attributes
+    :return: dict = item with removed attributes
+    """
+    py_item = {}
+
+    for k, v in item.items():
+        type_tag = ITEM_SCHEMA.get(k)
+
+        if type_tag == "S" and "S" in v:
+            py_item[k] = v["S"]
+        elif type_tag == "SS" and "SS" in v:
+            py_item[k] = set(v["SS"])
+        else:
+            py_item[k] = _deserializer.deserialize(v)
+
+    return py_item
+
+
+def canonical_item_hash(item: dict) -> str:
+    """
+    Hashes the canonical form of a DynamoDB JSON item: attribute names sorted and set members sorted, so two items with
+    the same content always hash the same no matter the order DynamoDB or the config file returned them in
+    :param item: DynamoDB item with included attributes
+    :return: str = hex digest
+    """
+    return hashlib.sha256(json.dumps(_canonical_form(item), sort_keys=True).encode()).hexdigest()
+
+
+def _canonical_form(value):
+    if isinstance(value, dict):
+        return {k: sorted(v) if k in _SET_TYPES else _canonical_form(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical_form(v) for v in value]
+    return value
+
+
+def tee_json_to_file(items, file_name="automated_config.json", use_pretty_json=config.USE_PRETTY_JSON):
+    """
+    Writes a stream of items to a file as a JSON array, yielding each item after it is written so the stream can be
+    consumed further without holding the whole array in memory. Output matches write_json_to_file
+    :param items: iterable of JSON serializable items
+    """
+    logger.info(f"Writing JSON to [{file_name}]")
+    separator = ",\n" if use_pretty_json else ", "
+
+    with open(file_name, 'w') as f:
+        f.write("[")
+        for index, item in enumerate(items):
+            if use_pretty_json:
+                f.write(("\n" if index == 0 else separator) + textwrap.indent(human_readable_json(item), "    "))
+            else:
+                f.write(("" if index == 0 else separator) + machine_readable_json(item))
+            yield item
+        else:
+            if use_pretty_json and f.tell() > 1:
+                f.write("\n")
+        f.write("]")
+
+
 def write_json_to_file(input_json, file_name="automated_config.json", use_pretty_json=config.USE_PRETTY_JSON) -> None:
     logger.info(f"Writing JSON to [{file_name}]")
     with open(file_name, 'w') as f:
@@ -0,0 +1,125 @@
+"""
+Vectorized alternative to util.evalperiod.EvalPeriod for offline planning and very large configurations.
+Every period is expanded into a row of keys for each minute of the week, ranking its action by the minute it began,
+the row of a schedule is the action of the maximum of the keys of its periods, and the action of every schedule at any
+number of instants is then a matter of array indexing.
+Requires numpy, which the scheduler Lambda itself does not use. The module is left out of the Lambda asset
+"""
+from datetime import datetime
+import logging
+import numpy
+import automated.ec2_actions as ec2_actions
+import util.timeline
+
+logger = logging.getLogger()
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Action codes of the matrices, index into ACTIONS. Codes rank the actions by util.timeline.PRECEDENCE
+ACTIONS = (ec2_actions.NONE,) + tuple(reversed(util.timeline.PRECEDENCE))
+NONE, START, STOP = (ACTIONS.index(action) for action in (ec2_actions.NONE, ec2_actions.START, ec2_actions.STOP))
+
+
+def minute_of_week(instant: datetime) -> int:
+    """
+    :return: int = minutes since Monday 00:00 of the week of instant
+    """
+    return instant.weekday() * MINUTES_PER_DAY + instant.hour * 60 + instant.minute
+
+
+def period_keys(periods: list) -> numpy.ndarray:
+    """
+    Action of every period at every minute of the week, with the minute the action began, computed for all periods at
+    once by broadcasting their days, start and stop minutes against the minutes of the day. Keys order the actions the
+    way util.timeline resolves overlapping periods: the action that began last is the highest key, and actions that
+    began at the same minute are ordered by their code
+    :param periods: list = CompiledPeriod
+    :return: numpy.ndarray = int32 (minute of the week the action began + MINUTES_PER_WEEK) * len(ACTIONS) + action
+        code, 0 for no action, shape (periods, MINUTES_PER_WEEK)
+    """
+    # A missing start or stop time is a time that is never reached
+    days = numpy.array([period.days_mask for period in periods], dtype=numpy.int64).reshape(-1, 1, 1)
+    start = numpy.array([MINUTES_PER_DAY if period.start_minute is None else period.start_minute
+                         for period in periods], dtype=numpy.int64).reshape(-1, 1, 1)
+    stop = numpy.array([MINUTES_PER_DAY if period.stop_minute is None else period.stop_minute
+                        for period in periods], dtype=numpy.int64).reshape(-1, 1, 1)
+    overnight = numpy.array([period.overnight for period in periods], dtype=bool).reshape(-1, 1, 1)
+
+    # (periods, days, minutes of the day) grid. An overnight period runs on from the day before into the morning
+    weekdays = numpy.arange(7).reshape(1, -1, 1)
+    minutes = numpy.arange(MINUTES_PER_DAY).reshape(1, 1, -1)
+    today = (days >> weekdays & 1).astype(bool)
+    yesterday = numpy.roll(today, 1, axis=1) & overnight
+
+    started_today = today & (minutes >= start) & (overnight | (minutes < stop))
+    started_yesterday = yesterday & (minutes < stop)
+    stopped = numpy.where(overnight, yesterday, today) & (minutes >= stop)
+
+    # Monday mornings of overnight periods began on the Sunday before, ahead of the start of the week
+    day_start = weekdays * MINUTES_PER_DAY
+    codes = numpy.where(started_today | started_yesterday, START, numpy.where(stopped, STOP, NONE))
+    began = numpy.where(started_today, day_start + start,
+                        numpy.where(started_yesterday, day_start - MINUTES_PER_DAY + start, day_start + stop))
+
+    keys = numpy.where(codes == NONE, 0, (began + MINUTES_PER_WEEK) * len(ACTIONS) + codes).astype(numpy.int32)
+    return keys.reshape(len(periods), MINUTES_PER_WEEK)
+
+
+def period_rows(periods: list) -> numpy.ndarray:
+    """
+    Same answers as CompiledPeriod.action for every period at every minute of the week
+    :param periods: list = CompiledPeriod
+    :return: numpy.ndarray = int8 action codes, shape (periods, MINUTES_PER_WEEK)
+    """
+    return (period_keys(periods) % len(ACTIONS)).astype(numpy.int8)
+
+
+class ScheduleMatrix:
+    """
+    (schedules x minutes of the week) matrix of action codes, with the same answers as the scheduler's lookups
+    """
+
+    def __init__(self, schedules: dict):
+        """
+        :param schedules: dict = schedule name -> list of CompiledPeriod, e.g. the periods returned by
+            ScheduleConfig.get_schedule
+        """
+        self.names = list(schedules)
+        self.index = {name: row for row, name in enumerate(self.names)}
+
+        # One row per distinct period, shared by every schedule using it
+        period_index = {}
+        for periods in schedules.values():
+            for period in periods:
+                period_index.setdefault(id(period), (len(period_index), period))
+        keys = period_keys([period for _, period in period_index.values()])
+
+        # Schedules with the same periods share a week, whatever order the periods are in
+        weeks = {}
+        self.matrix = numpy.zeros((len(self.names), MINUTES_PER_WEEK), dtype=numpy.int8)
+        for row, periods in enumerate(schedules.values()):
+            key = frozenset(period_index[id(period)][0] for period in periods)
+            if key not in weeks:
+                weeks[key] = keys[sorted(key)].max(axis=0) % len(ACTIONS) if key else NONE
+            self.matrix[row] = weeks[key]
+
+        logger.info(f"Built action matrix of [{len(self.names)}] schedules from [{len(keys)}] periods and "
+                    f"[{len(weeks)}] distinct weeks")
+
+    def codes_at(self, instants) -> numpy.ndarray:
+        """
+        :param instants: iterable of datetime, or an array of minutes of the week
+        :return: numpy.ndarray = (schedules x instants) action codes
+        """
+        if not isinstance(instants, numpy.ndarray):
+            instants = numpy.array([minute_of_week(instant) for instant in instants], dtype=numpy.int64)
+
+        return self.matrix[:, instants % MINUTES_PER_WEEK]
+
+    def action(self, schedule_name: str, instant: datetime) -> str:
+        """
+        :return: str = action type of the schedule at instant, no action for unknown schedules
+        """
+        row = self.index.get(schedule_name)
+        return ec2_actions.NONE if row is None else ACTIONS[self.matrix[row, minute_of_week(instant)]]
@@ -5,8 +5,10 @@ import events.put_config
 import events.http_response as http_response
 import logging
 import events.retrieve_config
+import events.inventory
 import os
 import automated.exceptions
+import automated.throttle
 
 logger = logging.getLogger()
 
@@ -41,11 +43,14 @@ class AutomationEventHandler:
             * CW_SCHEDULED_EVENT: Scheduled event that is the basis of the app functionality
             * API_S3_PUT_CONFIG: CloudTrail API event that is sent when config is updated
             * API_RETRIEVE_DYNAMO_AS_CONFIG: API triggered event that retrieves all items from Automated DynamoDB Table
+            * CW_EC2_STATE_CHANGE_EVENT: EC2 instance state change that updates the instance inventory
+            * CW_TAG_CHANGE_EVENT: Tag change on an EC2 instance that updates the instance inventory
         :return: dict = HTTP response to return to caller
         """
 
         logger.info(f"Received event: '{self.__event}'")
         logger.info(f"Received context: '{self.__context}'")
+        automated.throttle.start_invocation(self.__context)
 
         response: dict = dict()
         event_type: str = self.__event["detail-type"]
@@ -59,6 +64,12 @@ class AutomationEventHandler:
                         and self.__event["detail"]["eventName"] == "PutObject":
                     event_type = events.type.API_S3_PUT_CONFIG
 
+                elif event_type == "EC2 Instance State-change Notification":
+                    event_type = events.type.CW_EC2_STATE_CHANGE_EVENT
+
+                elif event_type == "Tag Change on Resource":
+                    event_type = events.type.CW_TAG_CHANGE_EVENT
+
             except KeyError:
                 automated.exceptions.log_error(
                     self,
@@ -79,6 +90,12 @@ class AutomationEventHandler:
         elif event_type == events.type.API_RETRIEVE_DYNAMO_AS_CONFIG:
             response = events.retrieve_config.retrieve_dynamo_as_config(self._get_env_variables())
 
+        elif event_type == events.type.CW_EC2_STATE_CHANGE_EVENT:
+            response = events.inventory.record_state_change(self.__event, self._get_env_variables())
+
+        elif event_type == events.type.CW_TAG_CHANGE_EVENT:
+            response = events.inventory.record_tag_change(self.__event, self._get_env_variables())
+
         else:
             automated.exceptions.log_error(
                 self,
@@ -132,8 +149,49 @@ class AutomationEventHandler:
                 fatal_error=True
             )
 
+        # Optional, defaults to scheduling the home region only
+        regions = [
+            scheduler_region.strip() for scheduler_region in os.environ.get('scheduler_regions', region).split(',')
+            if scheduler_region.strip()
+        ]
+        logger.debug(f"Scheduling regions {regions} from environment variable 'scheduler_regions'")
+
+        # Optional, roles to assume in member accounts. Defaults to the instances of the Lambda account only
+        account_roles = [
+            role_arn.strip() for role_arn in os.environ.get('scheduler_account_roles', '').split(',')
+            if role_arn.strip()
+        ]
+        logger.debug(f"Scheduling accounts {account_roles} from environment variable 'scheduler_account_roles'")
+
+        try:
+            max_workers = int(os.environ.get('scheduler_max_workers', config.MAX_SCHEDULER_WORKERS))
+        except ValueError:
+            logger.warning(f"Environment variable 'scheduler_max_workers' is not a number. "
+                           f"Using [{config.MAX_SCHEDULER_WORKERS}] workers.")
+            max_workers = config.MAX_SCHEDULER_WORKERS
+
+        # Optional, load instances from the inventory index kept by EC2 events instead of describing all instances
+        use_inventory = os.environ.get('scheduler_use_inventory', 'false').lower() == 'true'
+
+        # Optional, EventBridge rule re-armed for the next schedule transition at the end of every run
+        rule_name = os.environ.get('scheduler_rule_name') or None
+        logger.debug(f"Re-arming rule [{rule_name}] from environment variable 'scheduler_rule_name'")
+
+        try:
+            max_sleep_minutes = int(os.environ.get('scheduler_max_sleep_minutes', config.SCHEDULER_MAX_SLEEP_MINUTES))
+        except ValueError:
+            logger.warning(f"Environment variable 'scheduler_max_sleep_minutes' is not a number. "
+                           f"Sleeping at most [{config.SCHEDULER_MAX_SLEEP_MINUTES}] minutes.")
+            max_sleep_minutes = config.SCHEDULER_MAX_SLEEP_MINUTES
+
         return {
             "region": region,
+            "rule_name": rule_name,
+            "max_sleep_minutes": max_sleep_minutes,
+            "use_inventory": use_inventory,
+            "regions": regions,
+            "account_roles": account_roles,
+            "max_workers": max_workers,
             "tag_key": tag_key,
             "table_name": table_name
         }
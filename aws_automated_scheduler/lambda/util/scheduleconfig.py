@@ -0,0 +1,330 @@
+import json
+import threading
+import time
+import logging
+import zlib
+import automated.dynamodb
+import automated.exceptions
+import config
+import util.evalperiod
+import util.timeline
+
+logger = logging.getLogger()
+
+SCHEDULE_PK = automated.dynamodb.SCHEDULE_PK
+PERIOD_PK = automated.dynamodb.PERIOD_PK
+
+# Bumped whenever the layout of the compiled snapshot changes, snapshots of another format are ignored
+SNAPSHOT_FORMAT = 1
+# Period attributes evaluated by util.evalperiod, anything else is left out of the snapshot
+PERIOD_ATTRIBUTES = ("days_of_week", "start_time", "stop_time")
+
+# Parsed configuration kept for the life of the container so warm invocations skip reloading it
+_cache = {"schedules": None, "periods": None, "version": None, "loaded_at": 0.0}
+_cache_lock = threading.Lock()
+# hit: cached config reused, miss: nothing cached yet, reload: version changed or the TTL ran out
+_cache_stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+
+def get_schedule_config(dynamodb: automated.dynamodb.DynamoDB):
+    """
+    Returns the schedule configuration, reusing the copy cached by a previous invocation when its version is still
+    current and it is younger than CONFIG_CACHE_TTL_SECONDS. Costs one consistent read of the version item on a hit
+    :param dynamodb: DynamoDB component of the scheduler table
+    :return: ScheduleConfig
+    """
+    version = dynamodb.retrieve_config_version()
+
+    with _cache_lock:
+        now = time.monotonic()
+
+        if _cache['schedules'] is None:
+            outcome = "misses"
+        elif _cache['version'] != version or now - _cache['loaded_at'] >= config.CONFIG_CACHE_TTL_SECONDS:
+            outcome = "reloads"
+        else:
+            outcome = "hits"
+
+        _cache_stats[outcome] += 1
+
+        if outcome == "hits":
+            logger.info(f"Using cached schedule configuration version [{version}]")
+        else:
+            logger.info(f"Loading schedule configuration version [{version}] (cache {outcome[:-1]})")
+            schedule_config = ScheduleConfig.load(dynamodb, version)
+            _cache.update(
+                schedules=schedule_config.schedules,
+                periods=schedule_config.periods,
+                version=version,
+                loaded_at=now
+            )
+            return schedule_config
+
+        # A fresh index per run so missing schedules and periods are reported again on every run
+        return ScheduleConfig(_cache['schedules'], _cache['periods'])
+
+
+def compile_snapshot(config_items: list, version: int) -> bytes:
+    """
+    Validates the schedule and period items of a config upload and compiles them into a compact, compressed snapshot
+    that ScheduleConfig.from_snapshot turns back into ready to evaluate structures
+    :param config_items: list = config items as python data, e.g. {"pk": "schedule", "sk": "us_hours", "periods": {...}}
+    :param version: int = config version the snapshot is compiled for
+    :return: bytes = zlib compressed JSON snapshot
+    """
+    schedules, periods = {}, {}
+
+    for item in config_items:
+        if not isinstance(item, dict) or not isinstance(item.get('pk'), str) or not isinstance(item.get('sk'), str):
+            automated.exceptions.log_error(
+                automation_component=None,
+                error_message=f"Config item needs string 'pk' and 'sk' attributes: {item}",
+                output_to_logger=True,
+                include_in_http_response=False,
+                fatal_error=True
+            )
+
+        if item['pk'] == SCHEDULE_PK:
+            schedules[item['sk']] = {
+                "periods": sorted(set(item.get('periods') or ())),
+                "timezone": item.get('timezone')
+            }
+        elif item['pk'] == PERIOD_PK:
+            periods[item['sk']] = {attribute: item[attribute] for attribute in PERIOD_ATTRIBUTES
+                                   if item.get(attribute) is not None}
+
+    for schedule_name, schedule in schedules.items():
+        missing = [period for period in schedule['periods'] if period not in periods]
+        if missing:
+            logger.warning(f"Schedule [{schedule_name}] references periods that do not exist: {missing}")
+
+    snapshot = json.dumps(
+        {"format": SNAPSHOT_FORMAT, "version": version, "schedules": schedules, "periods": periods},
+        separators=(",", ":"),
+        sort_keys=True
+    ).encode()
+
+    compressed = zlib.compress(snapshot, 9)
+    logger.info(f"Compiled config snapshot version [{version}] of [{len(schedules)}] schedules and [{len(periods)}] "
+                f"periods: [{len(snapshot)}] bytes, [{len(compressed)}] compressed")
+
+    return compressed
+
+
+def cache_stats() -> dict:
+    """
+    :return: dict = hits, misses and reloads of the configuration cache over the life of the container
+    """
+    with _cache_lock:
+        return dict(_cache_stats)
+
+
+class ScheduleConfig:
+    """
+    In memory index of every schedule and period in the scheduler table, loaded once per run so evaluating an instance
+    never has to read DynamoDB
+    """
+
+    def __init__(self, schedules: dict, periods: dict):
+        """
+        :param schedules: dict = schedule name -> schedule item, e.g. {"periods": {"MON-FRI"}, "timezone": "UTC"}
+        :param periods: dict = period name -> period item, e.g. {"days_of_week": "MON-FRI", "start_time": "08:00"}
+        """
+        self.__schedules = schedules
+        self.__periods = periods
+        # schedule name -> (compiled periods, timezone). Filled on first lookup so problems are reported once per
+        # schedule
+        self.__resolved = {}
+        # period name -> CompiledPeriod, shared by every schedule using the period
+        self.__compiled = {}
+        # schedule name -> (ScheduleTimeline, timezone)
+        self.__timelines = {}
+        self.__lock = threading.Lock()
+        self.__errors = []
+
+    @property
+    def errors(self):
+        return self.__errors
+
+    @errors.setter
+    def errors(self, error_message):
+        self.__errors.append(error_message)
+
+    @errors.getter
+    def errors(self):
+        return self.__errors
+
+    @property
+    def schedules(self) -> dict:
+        return self.__schedules
+
+    @property
+    def periods(self) -> dict:
+        return self.__periods
+
+    @classmethod
+    def load(cls, dynamodb: automated.dynamodb.DynamoDB, version: int = None):
+        """
+        Loads the compiled snapshot of the config version with a single get_item. Without a snapshot of that version,
+        reads every schedule and period item with one paginated Query per partition. Either way the number of reads
+        depends on the size of the configuration, not on the number of instances
+        :param dynamodb: DynamoDB component of the scheduler table
+        :param version: int = current config version, None to skip the snapshot
+        :return: ScheduleConfig
+        """
+        if config.CONFIG_SNAPSHOT and version:
+            snapshot_version, snapshot = dynamodb.retrieve_config_snapshot()
+            schedule_config = cls.from_snapshot(snapshot) if snapshot_version == version else None
+
+            if schedule_config is not None:
+                return schedule_config
+
+            logger.info(f"No usable snapshot of config version [{version}], loading schedule and period items")
+
+        schedules = {item['sk']: item for item in dynamodb.retrieve_partition(SCHEDULE_PK)}
+        periods = {item['sk']: item for item in dynamodb.retrieve_partition(PERIOD_PK)}
+        logger.info(f"Loaded [{len(schedules)}] schedules and [{len(periods)}] periods")
+
+        return cls(schedules, periods)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: bytes):
+        """
+        :param snapshot: bytes = compressed snapshot built by compile_snapshot
+        :return: ScheduleConfig, None if the snapshot can not be read
+        """
+        try:
+            compiled = json.loads(zlib.decompress(snapshot))
+        except (zlib.error, ValueError) as err:
+            logger.warning(f"Unable to read config snapshot: {err}")
+            return None
+
+        if compiled.get('format') != SNAPSHOT_FORMAT:
+            logger.warning(f"Ignoring config snapshot of format [{compiled.get('format')}]")
+            return None
+
+        # Same shape as the items returned by DynamoDB.retrieve_partition
+        schedules = {
+            name: {"pk": SCHEDULE_PK, "sk": name, "periods": set(schedule['periods']),
+                   "timezone": schedule['timezone']}
+            for name, schedule in compiled['schedules'].items()
+        }
+        periods = {name: {"pk": PERIOD_PK, "sk": name, **period} for name, period in compiled['periods'].items()}
+        logger.info(f"Loaded [{len(schedules)}] schedules and [{len(periods)}] periods from config snapshot "
+                    f"version [{compiled['version']}]")
+
+        return cls(schedules, periods)
+
+    def get_schedule(self, schedule_name: str) -> tuple:
+        """
+        :param schedule_name: str = schedule name as retrieved from AWS scheduler tag value
+        :return: tuple = (list = CompiledPeriod of each period of the schedule, str = timezone). No periods if the
+            schedule is unknown
+        """
+        with self.__lock:
+            if schedule_name not in self.__resolved:
+                self.__resolved[schedule_name] = self.__resolve(schedule_name)
+
+            return self.__resolved[schedule_name]
+
+    def get_timeline(self, schedule_name: str) -> tuple:
+        """
+        :param schedule_name: str = schedule name as retrieved from AWS scheduler tag value
+        :return: tuple = (util.timeline.ScheduleTimeline = the periods of the schedule merged into one week, str =
+            timezone). The timeline has no action if the schedule is unknown
+        """
+        periods, timezone_name = self.get_schedule(schedule_name)
+
+        with self.__lock:
+            if schedule_name not in self.__timelines:
+                self.__timelines[schedule_name] = (util.timeline.ScheduleTimeline.build(periods), timezone_name)
+
+            return self.__timelines[schedule_name]
+
+    def compiled_schedules(self) -> dict:
+        """
+        Periods of every schedule in the configuration, whether or not an instance uses it. Missing periods and periods
+        that can not be compiled are left out quietly, they are reported when a schedule using them is evaluated
+        :return: dict = schedule name -> (list = CompiledPeriod, str = timezone)
+        """
+        compiled_schedules = {}
+
+        with self.__lock:
+            for schedule_name, schedule in self.__schedules.items():
+                periods = []
+                for period_name in sorted(schedule.get('periods') or ()):
+                    if period_name in self.__compiled:
+                        period = self.__compiled[period_name]
+                    elif period_name in self.__periods:
+                        # Not kept, so the problems of the period are still reported when it is evaluated
+                        try:
+                            period = util.evalperiod.CompiledPeriod.compile(self.__periods[period_name])
+                        except ValueError:
+                            period = None
+                    else:
+                        period = None
+
+                    if period is not None:
+                        periods.append(period)
+
+                compiled_schedules[schedule_name] = (periods, schedule.get('timezone'))
+
+        return compiled_schedules
+
+    def __resolve(self, schedule_name: str) -> tuple:
+        schedule = self.__schedules.get(schedule_name)
+
+        if schedule is None or not schedule.get('periods'):
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Unable to retrieve periods from schedule: [{schedule_name}]. "
+                              f"Are there any periods defined in the periods attribute for the schedule: "
+                              f"[{schedule_name}] ?",
+                include_in_http_response=True,
+                fatal_error=False
+            )
+            return [], None
+
+        # Periods are stored as a set, sort them so evaluation order is the same on every run
+        period_names = sorted(schedule['periods'])
+        missing = [period for period in period_names if period not in self.__periods]
+
+        if missing:
+            automated.exceptions.log_error(
+                automation_component=self,
+                error_message=f"Schedule [{schedule_name}] references periods that do not exist: {missing}. "
+                              f"Requested: [{len(period_names)}], Found: [{len(period_names) - len(missing)}].",
+                include_in_http_response=True,
+                fatal_error=False
+            )
+
+        periods = [self.__compile(period) for period in period_names if period in self.__periods]
+        periods = [period for period in periods if period is not None]
+        logger.info(f"Schedule [{schedule_name}] resolved to [{len(periods)}] periods: {[p.name for p in periods]}")
+
+        return periods, schedule.get('timezone')
+
+    def __compile(self, period_name: str):
+        if period_name not in self.__compiled:
+            try:
+                self.__compiled[period_name] = util.evalperiod.CompiledPeriod.compile(self.__periods[period_name])
+            except ValueError as err:
+                automated.exceptions.log_error(
+                    automation_component=self,
+                    error_message=f"Unable to parse the start/stop time of period [{period_name}]: {err}. "
+                                  f"Please ensure times are in the form of HH:MM.",
+                    include_in_http_response=True,
+                    fatal_error=False
+                )
+                self.__compiled[period_name] = None
+                return None
+
+            if self.__compiled[period_name].error is not None:
+                automated.exceptions.log_error(
+                    automation_component=self,
+                    error_message=f"Period [{period_name}]: {self.__compiled[period_name].error}",
+                    include_in_http_response=True,
+                    fatal_error=False
+                )
+
+        return self.__compiled[period_name]
@@ -0,0 +1,133 @@
+"""
+The periods of a schedule merged into one canonical week: sorted, non-overlapping intervals that each carry the action
+of the schedule during the interval. Looking up the action of a schedule is a bisect into its intervals, whatever the
+number of periods or the order they are stored in
+"""
+import bisect
+import heapq
+import automated.ec2_actions as ec2_actions
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Where the periods of a schedule disagree, the action that began most recently wins: a stop time ends a start that
+# came before it in another period, e.g. a start only period MON 08:00 and a stop only period MON 18:00 run the
+# instance from 08:00 to 18:00. Actions that begin at the same minute are ranked by PRECEDENCE, highest first
+PRECEDENCE = (ec2_actions.START, ec2_actions.STOP)
+
+
+def period_intervals(period) -> list:
+    """
+    Same rules as CompiledPeriod.action as intervals of the week. Intervals of Sunday, and of Saturday for overnight
+    periods, run past the end of the week, into Monday of the next one
+    :param period: util.evalperiod.CompiledPeriod
+    :return: list = (start minute of the week, end minute of the week (exclusive), action type)
+    """
+    intervals = []
+
+    for weekday in range(7):
+        if not period.days_mask >> weekday & 1:
+            continue
+
+        day = weekday * MINUTES_PER_DAY
+        if period.overnight:
+            intervals.append((day + period.start_minute, day + MINUTES_PER_DAY + period.stop_minute, ec2_actions.START))
+            intervals.append((day + MINUTES_PER_DAY + period.stop_minute, day + 2 * MINUTES_PER_DAY, ec2_actions.STOP))
+            continue
+
+        if period.start_minute is not None:
+            start_end = period.stop_minute if period.stop_minute is not None else MINUTES_PER_DAY
+            intervals.append((day + period.start_minute, day + start_end, ec2_actions.START))
+        if period.stop_minute is not None:
+            intervals.append((day + period.stop_minute, day + MINUTES_PER_DAY, ec2_actions.STOP))
+
+    return [(start, end, action) for start, end, action in intervals if end > start]
+
+
+class ScheduleTimeline:
+    """
+    Week of a schedule as sorted interval starts, each interval running until the next start, or the end of the week
+    for the last one, with the action of the schedule during the interval. Built with ScheduleTimeline.build
+    """
+
+    __slots__ = ("starts", "actions")
+
+    def __init__(self, starts: list, actions: list):
+        """
+        :param starts: list = sorted minutes of the week the intervals start at, the first one is 0
+        :param actions: list = action type of each interval, no two neighbours alike
+        """
+        self.starts = starts
+        self.actions = actions
+
+    @classmethod
+    def build(cls, periods: list):
+        """
+        Sweeps the interval boundaries of every period in order, keeping the open intervals in a heap ordered by when
+        they began. The action at each boundary is that of the open interval that began last, see PRECEDENCE
+        :param periods: list = CompiledPeriod of the schedule, in any order
+        :return: ScheduleTimeline
+        """
+        # Intervals running into this week from the end of the previous week began before Monday 00:00
+        intervals = []
+        for period in periods:
+            for start, end, action in period_intervals(period):
+                intervals.append((start, end, action))
+                if end > MINUTES_PER_WEEK:
+                    intervals.append((start - MINUTES_PER_WEEK, end - MINUTES_PER_WEEK, action))
+        intervals.sort()
+
+        boundaries = sorted({0} | {min(max(minute, 0), MINUTES_PER_WEEK) for interval in intervals
+                                   for minute in interval[:2]} - {MINUTES_PER_WEEK})
+
+        starts, actions = [], []
+        # (-began, rank in PRECEDENCE, end, action) of every interval opened so far. Closed intervals are dropped when
+        # they reach the top
+        open_intervals = []
+        position = 0
+
+        for minute in boundaries:
+            while position < len(intervals) and intervals[position][0] <= minute:
+                start, end, action = intervals[position]
+                heapq.heappush(open_intervals, (-start, PRECEDENCE.index(action), end, action))
+                position += 1
+
+            while open_intervals and open_intervals[0][2] <= minute:
+                heapq.heappop(open_intervals)
+
+            action = open_intervals[0][3] if open_intervals else ec2_actions.NONE
+            if not actions or actions[-1] != action:
+                starts.append(minute)
+                actions.append(action)
+
+        return cls(starts, actions)
+
+    def action_at(self, minute_of_week: int) -> str:
+        """
+        :param minute_of_week: int = minutes since Monday 00:00
+        :return: str = action type
+        """
+        return self.actions[bisect.bisect_right(self.starts, minute_of_week) - 1]
+
+    def action(self, weekday: int, minute_of_day: int) -> str:
+        """
+        :param weekday: int = 0 for Monday through 6 for Sunday
+        :param minute_of_day: int = minutes since the start of the day
+        :return: str = action type
+        """
+        return self.action_at(weekday * MINUTES_PER_DAY + minute_of_day)
+
+    def intervals(self) -> list:
+        """
+        :return: list = (start minute of the week, end minute of the week (exclusive), action type) of every interval
+        """
+        return list(zip(self.starts, self.starts[1:] + [MINUTES_PER_WEEK], self.actions))
+
+    def transitions(self) -> list:
+        """
+        :return: list = minutes of the week the schedule changes to a start or stop action
+        """
+        return [start for start, action in zip(self.starts, self.actions) if action is not ec2_actions.NONE]
+
+    def __repr__(self):
+        return f"ScheduleTimeline({self.intervals()})"
@@ -0,0 +1,104 @@
+"""
+UTC offsets of the schedule timezones, precomputed once per zone per run into a table of offset changes (DST
+boundaries). Converting a time from and to the zone is then a bisect into the table instead of a tz database lookup
+"""
+from datetime import datetime, timedelta, timezone
+import bisect
+import zoneinfo
+
+# Zone of schedules that have none
+DEFAULT_TIMEZONE = "UTC"
+
+# Window around the time of the run covered by a table. Reaches past the furthest the scheduler looks ahead, a week of
+# transitions for the next run. Offsets outside the window are those of its first or last instant
+TABLE_DAYS_BEFORE = 1
+TABLE_DAYS_AFTER = 8
+# Offsets are sampled this often to find the changes, then every change is narrowed down to the minute. Zones change
+# their offset at most twice a year, never twice within a sample
+TABLE_SAMPLE = timedelta(hours=1)
+
+
+def zone_info(timezone_name: str) -> zoneinfo.ZoneInfo:
+    """
+    :param timezone_name: str = IANA timezone, e.g. America/Chicago. None or "" for DEFAULT_TIMEZONE
+    :return: zoneinfo.ZoneInfo
+    :raises ValueError: when the timezone is unknown
+    """
+    try:
+        return zoneinfo.ZoneInfo(timezone_name or DEFAULT_TIMEZONE)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError) as err:
+        raise ValueError(f"Unknown timezone [{timezone_name}]") from err
+
+
+class ZoneOffsets:
+    """
+    Offset changes of a zone over the window around a run. All datetimes are naive, UTC or the zone's wall clock
+    """
+
+    def __init__(self, timezone_name: str, around: datetime):
+        """
+        :param timezone_name: str = IANA timezone, None or "" for DEFAULT_TIMEZONE
+        :param around: datetime = UTC time of the run
+        :raises ValueError: when the timezone is unknown
+        """
+        self.name = timezone_name or DEFAULT_TIMEZONE
+        self.__zone = zone_info(timezone_name)
+
+        start = around.replace(second=0, microsecond=0) - timedelta(days=TABLE_DAYS_BEFORE)
+        end = around + timedelta(days=TABLE_DAYS_AFTER)
+
+        # UTC instants the offset changes at, and the offset from each of them on
+        self.boundaries = [start]
+        self.offsets = [self.__offset(start)]
+
+        sample = start + TABLE_SAMPLE
+        while sample <= end:
+            if self.__offset(sample) != self.offsets[-1]:
+                boundary = self.__find_boundary(sample - TABLE_SAMPLE, sample)
+                self.boundaries.append(boundary)
+                self.offsets.append(self.__offset(boundary))
+            sample += TABLE_SAMPLE
+
+    def __offset(self, utc: datetime) -> timedelta:
+        return utc.replace(tzinfo=timezone.utc).astimezone(self.__zone).utcoffset()
+
+    def __find_boundary(self, before: datetime, after: datetime) -> datetime:
+        """
+        :return: datetime = first minute after before with the offset of after
+        """
+        offset = self.__offset(after)
+        low, high = 0, int((after - before).total_seconds() // 60)
+
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.__offset(before + timedelta(minutes=middle)) == offset:
+                high = middle
+            else:
+                low = middle
+
+        return before + timedelta(minutes=high)
+
+    def offset_at(self, utc: datetime) -> timedelta:
+        return self.offsets[max(bisect.bisect_right(self.boundaries, utc) - 1, 0)]
+
+    def local(self, utc: datetime) -> datetime:
+        """
+        :return: datetime = wall clock time of the zone at utc
+        """
+        return utc + self.offset_at(utc)
+
+    def to_utc(self, local: datetime) -> datetime:
+        """
+        :param local: datetime = wall clock time of the zone
+        :return: datetime = first UTC instant the wall clock shows local. When the clock skips local, e.g. 02:30 on the
+            night it springs forward from 02:00 to 03:00, the instant it skips it
+        """
+        candidates = sorted({local - offset for offset in self.offsets})
+        matching = [utc for utc in candidates if self.local(utc) == local]
+
+        if matching:
+            return matching[0]
+
+        # In a gap, the boundary it lies in is between the candidates of the offsets before and after it
+        index = bisect.bisect_left(self.boundaries, candidates[0])
+        return self.boundaries[index] if index < len(self.boundaries) else candidates[-1]
@@ -0,0 +1,102 @@
+"""
+Calendar of the instants at which schedules change action. The scheduler sleeps until the next of them instead of
+waking up every minute to find that nothing changed
+"""
+from datetime import datetime, timedelta
+import bisect
+import heapq
+import util.timeline
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def transition_minutes(periods: list) -> list:
+    """
+    Starts of the intervals of the schedule's week with a start or stop action. Every other change is to no action,
+    which needs no run
+    :param periods: list = CompiledPeriod of the schedule
+    :return: list = sorted distinct minutes of the week, since Monday 00:00
+    """
+    return util.timeline.ScheduleTimeline.build(periods).transitions()
+
+
+class TransitionCalendar:
+    """
+    Upcoming start/stop transitions of every schedule, earliest first. Periods are on the wall clock of the schedule's
+    timezone, transitions are returned in UTC
+    """
+
+    def __init__(self, schedules: dict, zones: dict = None):
+        """
+        :param schedules: dict = schedule name -> list of CompiledPeriod
+        :param zones: dict = schedule name -> util.timezones.ZoneOffsets of the schedule's timezone. Schedules without
+            one are on UTC
+        """
+        self.__zones = zones or {}
+        # schedule name -> transition minutes of the week. Schedules that never transition are left out
+        self.__minutes = {
+            name: minutes for name, minutes in
+            ((name, transition_minutes(periods)) for name, periods in schedules.items()) if minutes
+        }
+
+    def __len__(self):
+        return len(self.__minutes)
+
+    def upcoming(self, now: datetime):
+        """
+        Transitions strictly after the minute of now. The next transition of each schedule is kept in a min-heap,
+        popping one pushes the following transition of the same schedule, wrapping around to the next week
+        :param now: datetime = UTC time the calendar is read at
+        :return: iterator of (datetime = UTC transition instant, str = schedule name). Endless unless there are no
+            schedules
+        """
+        now_minute_start = now.replace(second=0, microsecond=0)
+
+        # (UTC instant, schedule name, index into the schedule's transitions counting over all weeks, local week start)
+        heap = []
+        for name, minutes in self.__minutes.items():
+            zone = self.__zones.get(name)
+            local_now = zone.local(now) if zone is not None else now
+            week_start = (local_now - timedelta(days=local_now.weekday())).replace(hour=0, minute=0, second=0,
+                                                                                   microsecond=0)
+            index = bisect.bisect_right(minutes, local_now.weekday() * MINUTES_PER_DAY + local_now.hour * 60 +
+                                        local_now.minute)
+            heap.append((self.__instant(name, week_start, index), name, index, week_start))
+        heapq.heapify(heap)
+
+        while heap:
+            instant, name, index, week_start = heap[0]
+            # When the clock falls back, a later wall clock minute can be an instant that has passed already
+            if instant > now_minute_start:
+                yield instant, name
+            heapq.heapreplace(heap, (self.__instant(name, week_start, index + 1), name, index + 1, week_start))
+
+    def next_transition(self, now: datetime) -> tuple:
+        """
+        :param now: datetime = UTC time the calendar is read at
+        :return: tuple = (datetime = earliest transition after now, list = names of the schedules changing then).
+            (None, []) when no schedule ever transitions
+        """
+        transition_at, schedule_names = None, []
+
+        for instant, name in self.upcoming(now):
+            if transition_at is not None and instant != transition_at:
+                break
+            transition_at = instant
+            # Wall clock minutes skipped when the clock springs forward all happen at the same instant
+            if name not in schedule_names:
+                schedule_names.append(name)
+
+        return transition_at, schedule_names
+
+    def __instant(self, name: str, week_start: datetime, index: int) -> datetime:
+        """
+        :return: datetime = UTC instant of the index-th transition of the schedule from the start of its local week
+        """
+        minutes = self.__minutes[name]
+        weeks, position = divmod(index, len(minutes))
+        local = week_start + timedelta(minutes=weeks * MINUTES_PER_WEEK + minutes[position])
+
+        zone = self.__zones.get(name)
+        return zone.to_utc(local) if zone is not None else local